@@ -1,29 +1,29 @@
-import yt
+import os
+import sys
 import numpy as np
-from yt.units import K
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'python'))
+from exodus_sampler import line_points
+from nemesis_reader import open_output
 
 home = "/Users/lindad"
 
-def _units(field, data):
-    return data[('all', 'temp')] * K
-
-
-ds = yt.load(
-    home + '/projects/moltres/problems/'
-    '2017_annals_pub_msre_compare/2group_out.e', step=-1)
-ds.add_field(('all', 'temp_K'), units='K', function=_units, take_log=False)
-lines = []
-lines.append(yt.LineBuffer(
-    ds, (0, 0, 0), (0, 162.56, 0), 1000, label='fuel moltres'))
-lines.append(yt.LineBuffer(ds, (3, 0, 0), (3, 162.56, 0),
-                           1000, label='graphite moltres'))
-plt = yt.LinePlot.from_lines(ds, [('all', 'temp_K')], lines, field_labels={
-                             ('all', 'temp_K'): ''})
-plt.annotate_legend(('all', 'temp_K'))
-plt.set_x_unit('cm')
-plt.set_xlabel('z (cm)')
-plt.set_ylabel('Temperature (K)')
-plt._setup_plots()
+fig, ax = plt.subplots()
+# Both lines are sampled from one read of the mesh and temperature field
+with open_output(
+        home + '/projects/moltres/problems/'
+        '2017_annals_pub_msre_compare/2group_out.e', ['temp'],
+        [-1]) as exodus:
+    for start, end, label in [((0, 0, 0), (0, 162.56, 0), 'fuel moltres'),
+                              ((3, 0, 0), (3, 162.56, 0),
+                               'graphite moltres')]:
+        points, z = line_points(start, end, 1000)
+        ax.plot(z, exodus.sample(['temp'], points)['temp'], label=label)
+ax.set_xlabel('z (cm)')
+ax.set_ylabel('Temperature (K)')
 
 msre_temp_axial_data = np.loadtxt(
     home + '/publications/figures/'
@@ -31,11 +31,9 @@ msre_temp_axial_data = np.loadtxt(
 x = msre_temp_axial_data[:, 0] * 2.54
 fuel_temp = (msre_temp_axial_data[:, 1] - 32) * 5. / 9. + 273.15
 graphite_temp = (msre_temp_axial_data[:, 2] - 32) * 5. / 9. + 273.15
-plt.plots[('all', 'temp_K')].axes.plot(x, fuel_temp, label=r'fuel msre')
-plt.plots[('all', 'temp_K')].axes.plot(
-    x, graphite_temp, label=r'graphite msre')
-plt.plots[('all', 'temp_K')].axes.legend()
-plt._setup_plots()
+ax.plot(x, fuel_temp, label=r'fuel msre')
+ax.plot(x, graphite_temp, label=r'graphite msre')
+ax.legend()
 
-plt.save(home + '/publications/figures/'
-         'combined_msre_moltres_axial_temps.eps')
+fig.savefig(home + '/publications/figures/'
+            'combined_msre_moltres_axial_temps.eps')
@@ -1,18 +1,93 @@
+import argparse
+import glob
+import json
+import os
 import numpy as np
 
+# Power of the density ratio each cross section scales with. Macroscopic
+# cross sections are proportional to the density and the diffusion
+# coefficient to its inverse. Anything else (spectra, precursor data,
+# velocities, energies per fission) does not depend on the density. Both the
+# txt table names and the JSON library names are listed.
+density_powers = {"DIFFCOEF": -1, "REMXS": 1, "NSF": 1, "FISS": 1,
+                  "FISSXS": 1, "SP0": 1, "GTRANSFXS": 1}
 
-def extrapolate(xs_name):
+# Tables the script rewrites unless told otherwise
+default_xs = ["DIFFCOEF", "FISS", "NSF", "REMXS", "SP0"]
+
+
+def density(temp, rho_ref=2.0e3, alpha=2.0e-4, temp_ref=900.):
+    """Salt density at temp from the linear thermal expansion of [1].
+
+    Parameters
+    ----------
+    temp : array_like
+        Temperatures [K].
+    rho_ref : float
+        Density at temp_ref [kg m-3].
+    alpha : float
+        Thermal expansion coeff [K-1].
+    temp_ref : float
+        Temperature of the reference density [K].
+
+    Returns
+    -------
+    numpy.ndarray
+        Densities [kg m-3], with the shape of temp.
+    """
+    return rho_ref * (1 - alpha * (np.asarray(temp, dtype=float) - temp_ref))
+
+
+def apply_feedback(xs_name, data_ref, temp, rho_ref=2.0e3, alpha=2.0e-4,
+                   temp_ref=900.):
+    """Scale reference cross section data to every temperature of temp.
+
+    Parameters
+    ----------
+    xs_name : str
+        Name of the cross section, which sets the power of the density
+        ratio applied, see density_powers.
+    data_ref : array_like
+        Cross section data at temp_ref, of any shape.
+    temp : array_like
+        1D array of temperatures [K] to extrapolate to.
+    rho_ref, alpha, temp_ref :
+        See density().
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (len(temp),) + data_ref.shape.
+    """
+    data_ref = np.asarray(data_ref, dtype=float)
+    rho = density(temp, rho_ref, alpha, temp_ref)
+    rho = rho.reshape((-1,) + (1,) * data_ref.ndim)
+    power = density_powers.get(xs_name, 0)
+    if power < 0:
+        return data_ref / rho**-power * rho_ref**-power
+    return data_ref * rho**power / rho_ref**power
+
+
+def extrapolate(xs_name, temp=np.linspace(950, 1500, 12), root="benchmark_",
+                rho_ref=2.0e3, alpha=2.0e-4, temp_ref=900.):
     """Extrapolate cross section based on thermal salt expansion feedback.
 
-    Extrapolates cross section data at 900 K to 1500 K at 50 K intervals
-    based on the thermal salt expansion feedback formula from [1]. Writes
-    the extrapolated data back into the .txt cross section files in the
-    Moltres-compatible format.
+    Extrapolates the cross section data at temp_ref to the temperatures in
+    temp based on the thermal salt expansion feedback formula from [1].
+    Writes the reference row and the extrapolated rows back into the .txt
+    cross section file in the Moltres-compatible format.
 
     Parameters
     ----------
-    xs_name : list of str
-        Names of cross sections to be extrapolated.
+    xs_name : str
+        Name of the cross section to be extrapolated.
+    temp : array_like
+        Temperatures [K] to extrapolate to, 950 K to 1500 K at 50 K
+        intervals by default.
+    root : str
+        The file read and written is root + xs_name + ".txt".
+    rho_ref, alpha, temp_ref :
+        See density().
 
     Returns
     -------
@@ -24,56 +99,136 @@ def extrapolate(xs_name):
     codes dedicated to molten salt fast reactors," Annals of Nuclear Energy,
     vol. 142, July 2020, 107428.
     """
-
-    rho_900 = 2.0e3         # Density at 900 K [kg m-3]
-    alpha = 2.0e-4          # Thermal expansion coeff [K-1]
-    input_file = "benchmark_" + xs_name + ".txt"
-
-    # Setup temperature values to extrapolate to
-    temp = np.linspace(950, 1500, 12)
-
-    # Read cross section data at 900K
-    f = open(input_file, 'r+')
-    lines = f.readlines()
-    data_900 = list(lines[0].split())
-    f.close()
-
-    # Setup space separated data to be written back into txt
-    s = " "
-    xs = [s.join(data_900) + "\n"]
-    h = open(input_file, 'w')
-
-    for i in range(len(temp)):
-        # Calculate density at temp[i]
-        rho = rho_900 * (1 - alpha * (temp[i]-900))
-
-        # Apply extrapolation formula at temp[i]
-        data_next = [0, ] * len(data_900)
-        data_next[0] = str(temp[i])
-        for i in range(1, len(data_900)):
-            if xs_name == "DIFFCOEF":
-                data = float(data_900[i]) / rho * rho_900
-                data_next[i] = '{:0.5e}'.format(data)
-            else:
-                data = float(data_900[i]) * rho / rho_900
-                data_next[i] = '{:0.5e}'.format(data)
-
-        data_next = s.join(data_next) + "\n"
-        xs.append(data_next)
+    input_file = root + xs_name + ".txt"
+
+    # Read cross section data at the reference temperature
+    with open(input_file, 'r') as f:
+        rows = [line for line in f
+                if line.split() and not line.lstrip().startswith('#')]
+    table = np.loadtxt(rows, ndmin=2)
+    ref = np.nonzero(table[:, 0] == temp_ref)[0]
+    if len(ref) == 0:
+        raise Exception("{} has no data at {} K".format(input_file, temp_ref))
+    data_ref = table[ref[0], 1:]
+
+    temp = np.asarray(temp, dtype=float)
+    temp = temp[temp != temp_ref]
+    data = apply_feedback(xs_name, data_ref, temp, rho_ref, alpha, temp_ref)
+
+    lines = [rows[ref[0]].rstrip("\n") + "\n"]
+    for t, row in zip(temp.tolist(), data.tolist()):
+        lines.append(" ".join(['{:g}'.format(t)] +
+                              ['{:0.5e}'.format(d) for d in row]) + "\n")
 
     # Write cross section data into txt file
-    h = open(input_file, 'w')
-    h.writelines(xs)
-    h.close()
+    with open(input_file, 'w') as h:
+        h.writelines(lines)
+    return
+
+
+def extrapolate_json(json_file, out_file, temp=np.linspace(950, 1500, 12),
+                     materials=None, rho_ref=2.0e3, alpha=2.0e-4,
+                     temp_ref=900):
+    """Apply the thermal salt expansion feedback to a JSON library.
+
+    Every cross section of each material at temp_ref is extrapolated to the
+    temperatures in temp, and the material is written with the reference
+    temperature and temp as its temperature grid.
+
+    Parameters
+    ----------
+    json_file : str
+        MoltresJsonMaterial library to read.
+    out_file : str
+        Library to write, may be json_file.
+    temp : array_like
+        Integer temperatures [K] to extrapolate to.
+    materials : list of str
+        Materials to extrapolate, all of them if None. The others are
+        copied unchanged.
+    rho_ref, alpha, temp_ref :
+        See density().
+
+    Returns
+    -------
+    None
+    """
+    temp = np.asarray(temp, dtype=float)
+    if np.any(temp != np.round(temp)):
+        raise Exception("JSON libraries need integer temperatures")
+    temp = temp[temp != temp_ref].astype(int)
+    with open(json_file, 'r') as f:
+        library = json.load(f)
+
+    for mat in library if materials is None else materials:
+        data_ref = library[mat][str(int(temp_ref))]
+        mat_dict = {"temp": [int(temp_ref)] + temp.tolist(),
+                    str(int(temp_ref)): data_ref}
+        for t in temp:
+            mat_dict[str(t)] = {}
+        for xs_name, values in data_ref.items():
+            data = apply_feedback(xs_name, values, temp, rho_ref, alpha,
+                                  temp_ref)
+            for t, row in zip(temp, data.tolist()):
+                mat_dict[str(t)][xs_name] = row
+        library[mat] = mat_dict
+
+    with open(out_file, 'w') as f:
+        json.dump(library, f, indent=4)
     return
 
 
 def main():
-    """Runs extrapolate() for the relevant cross sections.
+    """Runs extrapolate() for the cross sections of the benchmark, or
+    extrapolate_json() for a JSON library. Only the tables of default_xs
+    are rewritten unless others are asked for with --xs or --all.
     """
-    xs_names = ["DIFFCOEF", "FISS", "NSF", "REMXS", "SP0"]
+    parser = argparse.ArgumentParser(
+        description='Applies the salt thermal expansion feedback to cross \
+            section data.')
+    parser.add_argument('--root', type=str, default='benchmark_',
+                        help='root of the .txt cross section files')
+    parser.add_argument('--xs', type=str, nargs='+', default=None,
+                        help='cross sections to extrapolate, {} by \
+                            default'.format(' '.join(default_xs)))
+    parser.add_argument('--all', action='store_true',
+                        help='extrapolate every file starting with root')
+    parser.add_argument('--json', type=str, nargs=2, default=None,
+                        metavar=('JSON_FILE', 'OUT_FILE'),
+                        help='extrapolate a JSON library instead')
+    parser.add_argument('--materials', type=str, nargs='+', default=None,
+                        help='materials of the JSON library to extrapolate')
+    parser.add_argument('--temps', type=float, nargs='+', default=None,
+                        help='temperatures to extrapolate to [K]')
+    parser.add_argument('--range', type=float, nargs=3, default=None,
+                        metavar=('START', 'STOP', 'STEP'),
+                        help='extrapolate from START to STOP [K] every STEP')
+    parser.add_argument('--rho', type=float, default=2.0e3,
+                        help='density at the reference temperature [kg m-3]')
+    parser.add_argument('--alpha', type=float, default=2.0e-4,
+                        help='thermal expansion coefficient [K-1]')
+    parser.add_argument('--ref-temp', type=float, default=900.,
+                        help='temperature of the reference data [K]')
+    args = parser.parse_args()
+
+    if args.temps is not None:
+        temp = np.array(args.temps)
+    elif args.range is not None:
+        start, stop, step = args.range
+        temp = start + step * np.arange(int(round((stop - start) / step)) + 1)
+    else:
+        temp = np.linspace(950, 1500, 12)
+
+    if args.json is not None:
+        extrapolate_json(args.json[0], args.json[1], temp, args.materials,
+                         args.rho, args.alpha, args.ref_temp)
+        return
+    xs_names = args.xs or default_xs
+    if args.all:
+        xs_names = sorted(os.path.basename(f)[len(args.root):-len(".txt")]
+                          for f in glob.glob(args.root + "*.txt"))
     for i in xs_names:
-        extrapolate(i)
+        extrapolate(i, temp, args.root, args.rho, args.alpha, args.ref_temp)
     return
 
 
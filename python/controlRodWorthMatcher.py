@@ -3,41 +3,313 @@
 # results from a more detailed transport code.
 #
 # usage:
-#   controlRodWorthMatcher.py <inputfile> <rodWorthFile>
+#   controlRodWorthMatcher.py <inputfile> <rodWorthFile> [options]
 #
-# The file called rodWorthFile can have any number of rows. The last column
-# is assumed to be the control rod worth IN RELATIVE REACTIVITY ie change in (k-1)/k
-# as compared to the state with no control rods inserted.
-# All preceding columns are assumed to belong to control rods 1, 2, 3, all
-# the way up to n. This script will find the moltres absorbtion factor for
-# each rod that most closely matches reactivities.
+# The file called rodWorthFile can have any number of rows. Each row is one
+# rod configuration: the first n columns are the positions of control rods
+# 1, 2, 3, all the way up to n, where the rods are the RoddedMaterial blocks
+# of the input file in order. The next column is the control rod worth IN
+# RELATIVE REACTIVITY ie change in (k-1)/k as compared to the state with no
+# control rods inserted, which is the input file as given. An optional last
+# column holds the uncertainty of each worth. This script will find the
+# moltres absorbtion factor for each rod that most closely matches
+# reactivities.
 #
-# NOTE:
-# This script is unfinished. I'm putting it into the python directory so
-# that others have an idea of the methodology I had in mind to determine
-# the rod multiplicative factor for absorbtion for systems with many rods.
+# A residual is formed from the reactivity differences between detailed
+# transport (e.g. Serpent) and Moltres' results. A Jacobian is formed from
+# perturbing each rod multiplicative factor, with all of its columns
+# evaluated at once in a process pool. Then a Newton iteration (Gauss-Newton
+# if there are more configurations than rods) is done to drive the residual
+# to zero, until results are within uncertainty of the Monte Carlo
+# neutronics.
 #
-# The general idea would be to form a residual term that is squared reactivity
-# differences between detailed transport (e.g. Serpent) and Moltres' results.
-# A Jacobian is formed from perturbing each rod multiplicative factor. Then
-# a Newton iteration is done to drive the residual to zero. Repeat until results
-# are within uncertainty of the Monte Carlo neutronics. Note that forming the Jacobian
-# for this residual should probably happen in parallel on a computing cluster.
+# Moltres is run with command line overrides of absorb_factor and
+# rodPosition, so the input file itself is never modified. Any Python
+# callable taking (factors, positions) and returning k can be used in place
+# of Moltres.
 #
-import numpy
+import argparse
+import glob
+import os
+import re
+import shlex
 import subprocess
-import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+
+def reactivity(k):
+    return (k - 1.) / k
+
+
+def findRods(inputText):
+    """Returns the names of the RoddedMaterial blocks of a Moltres input,
+    in the order they appear."""
+    return re.findall(r'\[(?:\./)?([^\]/.]+)\]'
+                      r'[^\[]*?type\s*=\s*RoddedMaterial\b', inputText)
+
+
+def blockParameter(inputText, block, name):
+    """Returns the value of parameter name set directly in the block
+    [block] or [./block] of a Moltres input, skipping its sub-blocks, or
+    None if the block does not set it."""
+    value = None
+    depth = None
+    for line in inputText.splitlines():
+        line = line.split('#')[0].strip()
+        header = re.match(r'\[(?:\./)?([^\]]*)\]$', line)
+        if depth is None:
+            if header and header.group(1) == block:
+                depth = 0
+            continue
+        if header:
+            if header.group(1) in ['', '../']:
+                depth -= 1
+                if depth < 0:
+                    return value
+            else:
+                depth += 1
+        elif depth == 0:
+            match = re.match(re.escape(name) + r'\s*=\s*(\S+)', line)
+            if match:
+                value = match.group(1).strip("'\"")
+    return value
+
+
+def readFactors(inputText, rods):
+    """Returns the absorb_factor of each rod set in a Moltres input, in its
+    RoddedMaterial block or else in [GlobalParams]. absorb_factor has no
+    default value, so a rod setting it nowhere raises."""
+    factors = []
+    for rod in rods:
+        factor = blockParameter(inputText, rod, 'absorb_factor')
+        if factor is None:
+            factor = blockParameter(inputText, 'GlobalParams',
+                                    'absorb_factor')
+        if factor is None:
+            raise Exception("The input sets no absorb_factor for rod {}, "
+                            "pass the initial factors with --factors.".format(
+                                rod))
+        try:
+            factors.append(float(factor))
+        except ValueError:
+            raise Exception("absorb_factor = {} of rod {} is not a number, "
+                            "pass the initial factors with --factors.".format(
+                                factor, rod))
+    return factors
+
+
+def readRodWorths(rodWorthFile, numRods):
+    """Returns the rod positions, worths and uncertainties (None if the file
+    has no uncertainty column) of each configuration of rodWorthFile."""
+    data = numpy.loadtxt(rodWorthFile, ndmin=2)
+    if data.shape[1] not in [numRods + 1, numRods + 2]:
+        raise Exception("{} has {} columns, but there are {} rods.".format(
+            rodWorthFile, data.shape[1], numRods))
+    uncertainty = data[:, numRods + 1] if data.shape[1] == numRods + 2 \
+        else None
+    return data[:, :numRods], data[:, numRods], uncertainty
+
+
+class moltresEvaluator:
+    """
+        Runs Moltres on inputFile with the absorb_factor and rodPosition of
+        each rod overridden on the command line, and returns the k printed
+        by the run.
+
+        Parameters
+        ----------
+        inputFile: str
+            Moltres input file
+        rods: list of str
+            Names of the RoddedMaterial blocks, see findRods
+        command: list of str
+            Moltres executable and any arguments placed before -i
+        kPattern: str
+            Regular expression whose first group is k. The last match in
+            the output of the run is used.
+    """
+
+    def __init__(self, inputFile, rods, command=['moltres-opt'],
+                 kPattern=r'\bk\s*=\s*([-+0-9.eE]+)'):
+        self.inputFile = inputFile
+        self.rods = rods
+        self.command = command
+        self.kPattern = kPattern
+
+    def __call__(self, factors, positions=None):
+        inputDir = os.path.dirname(os.path.abspath(self.inputFile))
+        # Runs go on in parallel, so each one writes its own outputs
+        fd, fileBase = tempfile.mkstemp(prefix='rodMatch_', dir=inputDir)
+        os.close(fd)
+        args = list(self.command) + ['-i', os.path.basename(self.inputFile)]
+        for i, rod in enumerate(self.rods):
+            args.append('Materials/{}/absorb_factor={!r}'.format(
+                rod, float(factors[i])))
+            if positions is not None:
+                args.append('Materials/{}/rodPosition={!r}'.format(
+                    rod, float(positions[i])))
+        args.append('Outputs/file_base=' + os.path.basename(fileBase))
+        try:
+            result = subprocess.run(args, cwd=inputDir,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+        finally:
+            for f in glob.glob(fileBase + '*'):
+                os.remove(f)
+        matches = re.findall(self.kPattern, result.stdout)
+        if result.returncode != 0 or not matches:
+            raise Exception("Could not get k from {}:\n{}".format(
+                ' '.join(args), result.stdout[-2000:]))
+        return float(matches[-1])
+
+
+def _evaluate(evaluator, case):
+    return evaluator(*case)
+
+
+def evaluateCases(evaluator, cases, pool=None):
+    """Returns k for each (factors, positions) case, using pool if given."""
+    if pool is None:
+        return numpy.array([evaluator(*case) for case in cases])
+    return numpy.array(list(pool.map(_evaluate, [evaluator] * len(cases),
+                                     cases)))
+
+
+def matchRodWorths(evaluator, positions, worths, factors, uncertainty=1e-3,
+                   relStep=1e-2, maxIterations=20, workers=None,
+                   verbose=False):
+    """
+        Finds the absorbtion factor of each rod that matches the worths.
+
+        Parameters
+        ----------
+        evaluator: callable
+            Returns k given the factors and positions of all rods. Called
+            with positions None for the state with no rods inserted.
+        positions: array
+            Rod positions of each configuration, shape (configurations, rods)
+        worths: array
+            Target change in (k-1)/k of each configuration
+        factors: array
+            Initial absorbtion factor of each rod
+        uncertainty: float or array
+            Allowed reactivity difference of each configuration
+        relStep: float
+            Relative perturbation of the factors for the Jacobian
+        maxIterations: int
+            Number of Newton steps before giving up
+        workers: int
+            Size of the process pool, runs serially if 1
+        verbose: bool
+            Print the residual of each iteration
+        Returns
+        ----------
+        factors: array
+            Absorbtion factor of each rod
+        residual: array
+            Reactivity difference of each configuration at the factors
+    """
+    positions = numpy.atleast_2d(numpy.asarray(positions, dtype=float))
+    worths = numpy.asarray(worths, dtype=float)
+    factors = numpy.array(factors, dtype=float)
+    numRods = len(factors)
+    if not numpy.all(factors > 0):
+        raise Exception("Absorbtion factors have to be positive to start "
+                        "from, got {}.".format(factors.tolist()))
+    pool = ProcessPoolExecutor(workers) if workers is None or workers > 1 \
+        else None
+    try:
+        # The state with no rods inserted does not depend on the factors, so
+        # it is evaluated once
+        rhoRef = reactivity(evaluator(tuple(factors), None))
+
+        def residual(k):
+            return reactivity(k) - rhoRef - worths
+
+        base = residual(evaluateCases(
+            evaluator, [(tuple(factors), tuple(p)) for p in positions], pool))
+        for iteration in range(maxIterations):
+            if verbose:
+                print("Iteration {}: factors {} residual {}".format(
+                    iteration, factors.tolist(), base.tolist()))
+            if numpy.all(numpy.abs(base) <= uncertainty):
+                return factors, base
+            steps = relStep * numpy.where(factors != 0, numpy.abs(factors), 1)
+            cases = [(tuple(factors + steps[i] * numpy.eye(numRods)[i]),
+                      tuple(p)) for i in range(numRods) for p in positions]
+            k = evaluateCases(evaluator, cases, pool)
+            # Forward differences against the base state already evaluated
+            jacobian = ((residual(k.reshape(numRods, -1)) - base) /
+                        steps[:, None]).T
+            delta = numpy.linalg.lstsq(jacobian, -base, rcond=None)[0]
+            if not numpy.all(numpy.isfinite(delta)):
+                raise Exception("Newton step is not finite at factors {}, "
+                                "residual {}".format(factors.tolist(),
+                                                     base.tolist()))
+            # Absorbtion factors have to stay positive, so a step that
+            # would reach zero only goes half of the way there
+            shrinking = delta < 0
+            if numpy.any(factors[shrinking] + delta[shrinking] <= 0):
+                delta *= 0.5 * numpy.min(factors[shrinking] /
+                                         -delta[shrinking])
+            factors = factors + delta
+            base = residual(evaluateCases(
+                evaluator, [(tuple(factors), tuple(p)) for p in positions],
+                pool))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    raise Exception("Rod worths not matched within {} iterations, residual "
+                    "{}".format(maxIterations, base.tolist()))
 
-inputFile = sys.argv[1]
-rodWorthFile = sys.argv[2]
 
-if len(sys.argv) > 2:
-    raise Exception("Too many command line args.")
+if __name__ == '__main__':
 
-with open(inputFile) as infile:
-    infileText = infile.read()
+    parser = argparse.ArgumentParser(
+        description='Matches control rod worths of RoddedMaterial blocks \
+            to reference results.')
+    parser.add_argument('inputFile', type=str, help='Moltres input file')
+    parser.add_argument('rodWorthFile', type=str,
+                        help='rod positions and worths of each configuration')
+    parser.add_argument('--command', type=str, default='moltres-opt',
+                        help='Moltres executable, with any arguments placed \
+                            before -i')
+    parser.add_argument('--k-pattern', type=str,
+                        default=r'\bk\s*=\s*([-+0-9.eE]+)',
+                        help='regular expression matching k in the output')
+    parser.add_argument('--factors', type=float, nargs='+', default=None,
+                        help='initial absorbtion factor of each rod, those of \
+                            the input file by default')
+    parser.add_argument('--uncertainty', type=float, default=1e-3,
+                        help='allowed reactivity difference, if the rod worth \
+                            file has no uncertainty column')
+    parser.add_argument('--rel-step', type=float, default=1e-2,
+                        help='relative perturbation of the factors')
+    parser.add_argument('--max-iterations', type=int, default=20,
+                        help='number of Newton steps before giving up')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of Moltres runs at once, all cores by \
+                            default')
+    args = parser.parse_args()
 
-with open(rodWorthFile) as rWFile:
-    for line in rWFile:
-        sline = line.split()
-        rodPos, worth = ( float(sline[0]), float(sline[1]) )
+    with open(args.inputFile) as infile:
+        infileText = infile.read()
+    rods = findRods(infileText)
+    if not rods:
+        raise Exception("No RoddedMaterial in {}.".format(args.inputFile))
+    factors = args.factors
+    if factors is None:
+        factors = readFactors(infileText, rods)
+    positions, worths, uncertainty = readRodWorths(args.rodWorthFile,
+                                                   len(rods))
+    evaluator = moltresEvaluator(args.inputFile, rods,
+                                 shlex.split(args.command), args.k_pattern)
+    factors, residual = matchRodWorths(
+        evaluator, positions, worths, factors,
+        args.uncertainty if uncertainty is None else uncertainty,
+        args.rel_step, args.max_iterations, args.workers, verbose=True)
+    for rod, factor in zip(rods, factors):
+        print("{} absorb_factor = {!r}".format(rod, factor))
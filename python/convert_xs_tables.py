@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# This script converts between the one-quantity-per-file txt tables read by
+# GenericMoltresMaterial and the single-file JSON libraries read by
+# MoltresJsonMaterial. A whole property directory can be turned into one
+# JSON library, and a JSON library back into txt tables.
+import argparse
+import os
+import numpy as np
+from moltres_xs import write_json, load_library
+
+xsec_names = ['REMXS', 'FISSXS', 'NSF', 'FISSE', 'DIFFCOEF', 'RECIPVEL',
+              'CHI_T', 'CHI_P', 'CHI_D', 'GTRANSFXS', 'BETA_EFF',
+              'DECAY_CONSTANT']
+
+# Table names used by GenericMoltresMaterial, with and without sss2_input
+file_map = {'REMXS': 'REMXS', 'FISSXS': 'FISSXS', 'NSF': 'NSF',
+            'FISSE': 'FISSE', 'DIFFCOEF': 'DIFFCOEF',
+            'RECIPVEL': 'RECIPVEL', 'CHI_T': 'CHI', 'CHI_P': 'CHI',
+            'CHI_D': 'CHI_D', 'GTRANSFXS': 'GTRANSFXS',
+            'BETA_EFF': 'BETA_EFF', 'DECAY_CONSTANT': 'DECAY_CONSTANT'}
+sss2_file_map = {'REMXS': 'REMXS', 'FISSXS': 'FISS', 'NSF': 'NSF',
+                 'FISSE': 'KAPPA', 'DIFFCOEF': 'DIFFCOEF',
+                 'RECIPVEL': 'INVV', 'CHI_T': 'CHIT', 'CHI_P': 'CHIP',
+                 'CHI_D': 'CHID', 'GTRANSFXS': 'SP0',
+                 'BETA_EFF': 'BETA_EFF', 'DECAY_CONSTANT': 'LAMBDA'}
+
+
+def table_path(root, sss2, xs):
+    return root + (sss2_file_map if sss2 else file_map)[xs] + '.txt'
+
+
+def root_tables(directory):
+    """ Returns a dict from every prefix of a table name in directory to
+    whether it uses the sss2_input names and the tables it lacks of those
+    GenericMoltresMaterial requires; CHI_D may be missing. A prefix with
+    tables missing under both namings gets the one it lacks fewer of."""
+    names = set(os.listdir(directory))
+    prefixes = set()
+    for mapping in [file_map, sss2_file_map]:
+        for table in set(mapping.values()):
+            suffix = '_' + table + '.txt'
+            prefixes.update(name[:-len(suffix) + 1] for name in names
+                            if name.endswith(suffix))
+    roots = {}
+    for prefix in prefixes:
+        root = os.path.join(directory, prefix)
+        found = []
+        for sss2 in [True, False]:
+            missing = sorted(set(
+                os.path.basename(table_path(root, sss2, xs))
+                for xs in xsec_names if xs != 'CHI_D') - names)
+            found.append((len(missing), sss2, missing))
+        # sss2 names win ties, e.g. roots that have both sets of tables
+        count, sss2, missing = min(found, key=lambda f: f[0])
+        roots[root] = (sss2, missing)
+    return roots
+
+
+def find_roots(directory):
+    """ Returns a dict from every table root in directory to whether it
+    uses the sss2_input names. A root only counts if all the tables that
+    GenericMoltresMaterial requires exist; CHI_D may be missing. See
+    incomplete_roots for the others."""
+    return dict((root, sss2) for root, (sss2, missing) in
+                root_tables(directory).items() if not missing)
+
+
+def incomplete_roots(directory):
+    """ Returns a dict from every prefix of a table name in directory that
+    is not a complete table root to the table files it lacks."""
+    return dict((root, missing) for root, (sss2, missing) in
+                root_tables(directory).items() if missing)
+
+
+def to_temperature(value):
+    if value != int(value):
+        raise Exception('MoltresJsonMaterial needs integer temperatures, '
+                        'got {}'.format(value))
+    return int(value)
+
+
+def read_tables(root, sss2=False):
+    """ Reads the txt tables starting with root in one bulk load per file.
+    Returns the temperatures and a dict from XS name to an array with one
+    row per temperature. Rows may be wrapped over several lines."""
+    def load(xs, width=None):
+        values = np.fromfile(table_path(root, sss2, xs), sep=' ')
+        if width is None:
+            with open(table_path(root, sss2, xs)) as f:
+                width = len(f.readline().split())
+        if values.size % width:
+            raise Exception('{} does not hold rows of one temperature and '
+                            '{} values'.format(table_path(root, sss2, xs),
+                                               width - 1))
+        return values.reshape(-1, width)
+
+    remxs = load('REMXS')
+    num_groups = remxs.shape[1] - 1
+    num_precursors = load('BETA_EFF').shape[1] - 1
+    widths = dict((xs, num_groups + 1) for xs in xsec_names)
+    widths['GTRANSFXS'] = num_groups * num_groups + 1
+    widths['BETA_EFF'] = num_precursors + 1
+    widths['DECAY_CONSTANT'] = num_precursors + 1
+
+    temps = remxs[:, 0]
+    tables = {}
+    for xs in xsec_names:
+        if xs == 'CHI_D' and not os.path.exists(table_path(root, sss2, xs)):
+            continue
+        table = load(xs, widths[xs])
+        if not np.array_equal(table[:, 0], temps):
+            raise Exception('Temperatures of {} differ from those of '
+                            '{}'.format(table_path(root, sss2, xs),
+                                        table_path(root, sss2, 'REMXS')))
+        tables[xs] = table[:, 1:]
+    return [to_temperature(t) for t in temps], tables
+
+
+def tables_to_material(temps, tables):
+    """ Lays tables out like a material of a MoltresJsonMaterial file."""
+    material = {'temp': temps}
+    for i, t in enumerate(temps):
+        material[str(t)] = dict((xs, table[i]) for xs, table in tables.items())
+    return material
+
+
+def check_material(material, temps, tables, rtol=0):
+    """ Raises if a converted material does not hold the same data as the
+    tables it came from."""
+    if list(material['temp']) != list(temps):
+        raise Exception('Temperatures changed in conversion')
+    for xs, table in tables.items():
+        converted = np.array([material[str(t)][xs] for t in temps])
+        if converted.shape != table.shape or \
+                not np.allclose(converted, table, rtol=rtol, atol=0):
+            raise Exception('{} changed in conversion'.format(xs))
+
+
+def txt_to_json(roots, json_file, digits=None, check=True, strict=True):
+    """
+        Converts txt tables into one JSON library, one material per root.
+
+        Parameters
+        ----------
+        roots: dict
+            Maps each table root, e.g. 'property_file_dir/newt_msre_fuel_',
+            to whether it uses the sss2_input names. See find_roots.
+        json_file: str
+            Name of the JSON file to write
+        digits: int
+            Significant digits of the written floats, full precision if
+            None
+        check: bool
+            Read the JSON file back and compare it with the tables
+        strict: bool
+            Raise on a root that cannot be converted, for instance because
+            its tables have different temperatures. Otherwise the root is
+            reported and left out.
+        Returns
+        ----------
+        out_dict: dict
+            The library, keyed by root name without its trailing '_'
+    """
+    out_dict = {}
+    read = {}
+    for root, sss2 in sorted(roots.items()):
+        key = os.path.basename(root).rstrip('_')
+        try:
+            read[key] = read_tables(root, sss2)
+        except Exception as err:
+            if strict:
+                raise
+            print('Skipping {}: {}'.format(root, err))
+            continue
+        out_dict[key] = tables_to_material(*read[key])
+    with open(json_file, 'w') as f:
+        write_json(out_dict, f, digits)
+    if check:
+        written = load_library(json_file)
+        rtol = 0 if digits is None else 10.**(1 - digits)
+        for key, (temps, tables) in read.items():
+            check_material(written[key], temps, tables, rtol)
+    return out_dict
+
+
+def json_to_txt(json_file, outdir, sss2=False, check=True):
+    """
+        Writes every material of a JSON library as txt tables named
+        outdir/<material>_<XS>.txt, with the sss2_input names if sss2 is
+        set. Without sss2, CHI_T is written to the shared CHI table.
+        json_file may also be a library already in memory, as returned by
+        load_library or moltres_xs.build_library. Returns the roots that
+        were written.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    library = load_library(json_file) if isinstance(json_file, str) \
+        else json_file
+    roots = {}
+    for key, material in sorted(library.items()):
+        root = os.path.join(outdir, key + '_')
+        temps = material['temp']
+        tables = {}
+        for xs in xsec_names:
+            if xs == 'CHI_P' and not sss2:
+                continue
+            if any(xs not in material[str(t)] for t in temps):
+                continue
+            tables[xs] = np.array([material[str(t)][xs] for t in temps])
+            rows = np.column_stack([temps, tables[xs]])
+            with open(table_path(root, sss2, xs), 'w') as f:
+                f.writelines(
+                    ' '.join([str(int(row[0]))] +
+                             list(map(repr, row[1:]))) + '\n'
+                    for row in rows.tolist())
+        if check:
+            check_material(tables_to_material(*read_tables(root, sss2)),
+                           temps, tables)
+        roots[root] = sss2
+    return roots
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Converts between GenericMoltresMaterial txt tables \
+            and MoltresJsonMaterial JSON libraries.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    to_json = subparsers.add_parser(
+        'to-json', help='convert txt tables to one JSON library')
+    to_json.add_argument('sources', type=str, nargs='+',
+                         help='property directories or table roots, \
+                             e.g. property_file_dir/newt_msre_fuel_')
+    to_json.add_argument('json_file', type=str, help='JSON file to write')
+    to_json.add_argument('--sss2', action='store_true',
+                         help='table roots use the sss2_input names')
+    to_json.add_argument('--digits', type=int, default=None,
+                         help='significant digits of the written floats')
+    to_txt = subparsers.add_parser(
+        'to-txt', help='convert a JSON library to txt tables')
+    to_txt.add_argument('json_file', type=str, help='JSON file to read')
+    to_txt.add_argument('outdir', type=str,
+                        help='directory to write the tables to')
+    to_txt.add_argument('--sss2', action='store_true',
+                        help='write tables with the sss2_input names')
+    args = parser.parse_args()
+
+    if args.command == 'to-json':
+        roots = {}
+        incomplete = {}
+        for source in args.sources:
+            if os.path.isdir(source):
+                roots.update(find_roots(source))
+                incomplete.update(incomplete_roots(source))
+            else:
+                roots[source] = args.sss2
+        for root, missing in sorted(incomplete.items()):
+            print('Skipping {}: missing {}'.format(root, ', '.join(missing)))
+        out_dict = txt_to_json(roots, args.json_file, args.digits,
+                               strict=False)
+        print("Converted {} materials into {}, skipped {}.".format(
+            len(out_dict), args.json_file,
+            len(roots) - len(out_dict) + len(incomplete)))
+    else:
+        roots = json_to_txt(args.json_file, args.outdir, args.sss2)
+        print("Wrote txt tables for {} materials to {}.".format(
+            len(roots), args.outdir))
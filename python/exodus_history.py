@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# This script reduces every time step of a transient Moltres Exodus output
+# (max, min, volume average and volume integral of each block) without
+# holding more than a bounded chunk of time steps in memory. The volume
+# weights of the nodes and elements are computed once, by quadrature of the
+# element shape functions, so each reduction is a matrix product per chunk.
+import argparse
+import numpy as np
+from exodus_sampler import exodus_file, element_types, num_nodes, \
+    reference_dim, shape_functions
+from nemesis_reader import open_output
+
+reductions = ['max', 'min', 'average', 'integral']
+
+
+def gauss_points(order):
+    """ Gauss-Legendre points and weights on [0, 1]."""
+    x, w = np.polynomial.legendre.leggauss(order)
+    return (x + 1) / 2, w / 2
+
+
+def quadrature(elem_type, order=3):
+    """
+        Quadrature rule of the reference element of elem_type. Simplices
+        use collapsed tensor product rules.
+
+        Returns
+        ----------
+        points: array
+            Reference coordinates, shape (points, reference dimension)
+        weights: array
+            Weights, summing to the reference element volume
+    """
+    x, w = gauss_points(order)
+    dim = reference_dim[elem_type]
+    if elem_type in ['QUAD4', 'QUAD9', 'HEX8']:
+        grid = np.meshgrid(*[2 * x - 1] * dim, indexing='ij')
+        weights = np.prod(np.meshgrid(*[2 * w] * dim, indexing='ij'), axis=0)
+        return np.column_stack([g.ravel() for g in grid]), weights.ravel()
+    u, v = [g.ravel() for g in np.meshgrid(x, x, indexing='ij')]
+    wuv = np.outer(w, w).ravel()
+    if elem_type in ['TRI3', 'TRI6']:
+        return np.column_stack([u, v * (1 - u)]), wuv * (1 - u)
+    if elem_type == 'WEDGE6':
+        tri = np.column_stack([u, v * (1 - u)])
+        points = np.column_stack([np.repeat(tri, len(x), axis=0),
+                                  np.tile(2 * x - 1, len(tri))])
+        return points, np.outer(wuv * (1 - u), 2 * w).ravel()
+    u, v, s = [g.ravel() for g in np.meshgrid(x, x, x, indexing='ij')]
+    weights = np.einsum('i,j,k->ijk', w, w, w).ravel()
+    return np.column_stack([u, v * (1 - u), s * (1 - u) * (1 - v)]), \
+        weights * (1 - u)**2 * (1 - v)
+
+
+def volume_weights(exodus, rz=False, order=3):
+    """
+        Volume weights of the mesh of an exodus_file.
+
+        Parameters
+        ----------
+        exodus: exodus_file
+            File to take the mesh from
+        rz: bool
+            The mesh is axisymmetric with r along x, as with coord_type =
+            RZ, so volumes include the 2 pi r factor
+        order: int
+            Number of Gauss points along each reference direction
+        Returns
+        ----------
+        node_weights: list
+            For each block, the integral of each node's shape function over
+            the block, so that node_weights[b] @ u integrates the nodal
+            field u over block b. None for blocks that hold no volume.
+        elem_volumes: list
+            Volume of each element of each block
+    """
+    coords = exodus.coords
+    node_weights = []
+    elem_volumes = []
+    for elem_type, connect in exodus.blocks:
+        elem_type = element_types.get(elem_type.upper())
+        if elem_type is None or reference_dim[elem_type] != exodus.dim or \
+                len(connect) == 0:
+            node_weights.append(None)
+            elem_volumes.append(None)
+            continue
+        connect = connect[:, :num_nodes[elem_type]]
+        points, weights = quadrature(elem_type, order)
+        N, dN = shape_functions(elem_type, points)
+        X = coords[connect]
+        jacobian = np.einsum('qnr,end->eqdr', dN, X)
+        dV = np.abs(np.linalg.det(jacobian)) * weights
+        if rz:
+            dV *= 2 * np.pi * np.einsum('qn,en->eq', N, X[:, :, 0])
+        elem_volumes.append(dV.sum(axis=1))
+        node_weights.append(np.bincount(
+            connect.ravel(), (dV @ N).ravel(), minlength=len(coords)))
+    return node_weights, elem_volumes
+
+
+def block_names(exodus):
+    names = exodus.names('eb_names')
+    ids = exodus.block_ids
+    return [name if name else 'block_{}'.format(i)
+            for name, i in zip(names + [''] * len(ids), ids)]
+
+
+def time_history(filename, names=None, rz=False, regions=True,
+                 chunk_bytes=2**27, include_globals=True, workers=None):
+    """
+        Reduces each time step of variables of an Exodus file.
+
+        Parameters
+        ----------
+        filename: str
+            Exodus file, or the joined name of a split output whose pieces
+            filename.N.r are read with nemesis_reader
+        names: list of str
+            Nodal or elemental variables, all of them if None
+        rz: bool
+            Axisymmetric mesh, see volume_weights
+        regions: bool
+            Also integrate each variable over each block
+        chunk_bytes: int
+            Bound on the memory used by the values of one variable over a
+            chunk of time steps
+        include_globals: bool
+            Add the global variables (postprocessors) as columns
+        workers: int
+            Number of processes reading the pieces of a split output
+        Returns
+        ----------
+        history: dict
+            Maps 'time' and '<variable>_<reduction>' to an array with one
+            value per time step, where reductions are max, min, average,
+            integral and integral_<block name>
+    """
+    with open_output(filename, names, workers=workers) as exodus:
+        if names is None:
+            names = exodus.nodal_names + exodus.elemental_names
+        times = exodus.times[exodus.steps]
+        num_steps = len(times)
+        node_weights, elem_volumes = volume_weights(exodus, rz)
+        blocks = [b for b, w in enumerate(node_weights) if w is not None]
+        labels = block_names(exodus)
+        # One row per block, so integrals over all blocks are one product
+        weights = np.array([node_weights[b] for b in blocks])
+        nodes = np.unique(np.concatenate(
+            [exodus.blocks[b][1].ravel() for b in blocks]))
+
+        history = {'time': np.asarray(times, dtype=float)}
+        if include_globals:
+            for name, values in exodus.global_values.items():
+                history[name] = values[exodus.steps]
+        for name in names:
+            out = dict((reduction, np.empty(num_steps))
+                       for reduction in reductions)
+            block_integrals = np.zeros((num_steps, len(blocks)))
+            if name in exodus.nodal_names:
+                defined = blocks
+                chunk = max(1, chunk_bytes // (8 * len(exodus.coords)))
+                for start in range(0, num_steps, chunk):
+                    steps = slice(start, min(start + chunk, num_steps))
+                    values = exodus.nodal_steps(name, steps)
+                    out['max'][steps] = values[:, nodes].max(axis=1)
+                    out['min'][steps] = values[:, nodes].min(axis=1)
+                    block_integrals[steps] = values @ weights.T
+            elif name in exodus.elemental_names:
+                # An empty range of steps tells the blocks the variable is
+                # defined on without reading any values
+                empty = exodus.elemental_steps(name, slice(0, 0), blocks)
+                defined = [b for b, values in zip(blocks, empty)
+                           if values is not None]
+                if not defined:
+                    raise Exception('Elemental variable {} of {} is not '
+                                    'defined on any block with a volume'
+                                    .format(name, filename))
+                size = sum(len(elem_volumes[b]) for b in defined)
+                chunk = max(1, chunk_bytes // (8 * size))
+                for start in range(0, num_steps, chunk):
+                    steps = slice(start, min(start + chunk, num_steps))
+                    high, low = [], []
+                    for b, values in zip(defined, exodus.elemental_steps(
+                            name, steps, defined)):
+                        high.append(values.max(axis=1))
+                        low.append(values.min(axis=1))
+                        block_integrals[steps, blocks.index(b)] = \
+                            values @ elem_volumes[b]
+                    out['max'][steps] = np.max(high, axis=0)
+                    out['min'][steps] = np.min(low, axis=0)
+            else:
+                raise Exception('There is no nodal or elemental variable {} '
+                                'in {}'.format(name, filename))
+            out['integral'] = block_integrals.sum(axis=1)
+            # Averages are over the blocks the variable is defined on
+            out['average'] = out['integral'] / sum(
+                elem_volumes[b].sum() for b in defined)
+            for reduction in reductions:
+                history[name + '_' + reduction] = out[reduction]
+            if regions:
+                for i, b in enumerate(defined):
+                    history[name + '_integral_' + labels[b]] = \
+                        block_integrals[:, blocks.index(b)]
+    return history
+
+
+def write_history(history, filename):
+    """ Writes a history as CSV, or as .npz if the file name ends so."""
+    if filename.endswith('.npz'):
+        np.savez(filename, **history)
+        return
+    np.savetxt(filename, np.column_stack(list(history.values())),
+               delimiter=',', header=','.join(history), comments='',
+               fmt='%.12g')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Reduces every time step of Exodus variables.')
+    parser.add_argument('exodus_file', type=str,
+                        help='Exodus file to read, or the joined name of a \
+                            split output')
+    parser.add_argument('variables', type=str, nargs='*',
+                        help='variables to reduce, all nodal and elemental \
+                            variables by default')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='CSV or .npz file to write')
+    parser.add_argument('--rz', action='store_true',
+                        help='axisymmetric mesh with r along x')
+    parser.add_argument('--no-regions', action='store_true',
+                        help='skip the integrals over each block')
+    parser.add_argument('--chunk-size', type=float, default=128,
+                        help='memory bound of a chunk of time steps in MB')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes reading the pieces of a \
+                            split output')
+    args = parser.parse_args()
+
+    history = time_history(args.exodus_file, args.variables or None, args.rz,
+                           not args.no_regions, int(args.chunk_size * 2**20),
+                           workers=args.workers)
+    write_history(history, args.output)
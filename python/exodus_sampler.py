@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# This script samples Moltres Exodus outputs at arbitrary points, for
+# instance along a line to compare with measured profiles. Only the
+# coordinates, the connectivity and the requested variables at one time step
+# are read from the file, with netCDF4. Points are located with a grid of
+# element bounding boxes and nodal variables are interpolated with the
+# element shape functions, all vectorized over the points.
+import argparse
+import numpy as np
+import netCDF4
+
+# Element types with their own shape functions. Other higher order types are
+# sampled through their vertices with the first order type they reduce to.
+element_types = {'TRI': 'TRI3', 'TRI3': 'TRI3', 'TRIANGLE': 'TRI3',
+                 'TRI6': 'TRI6', 'QUAD': 'QUAD4', 'QUAD4': 'QUAD4',
+                 'QUAD8': 'QUAD4', 'QUAD9': 'QUAD9', 'TETRA': 'TET4',
+                 'TET4': 'TET4', 'TETRA4': 'TET4', 'TETRA10': 'TET10',
+                 'TET10': 'TET10', 'HEX': 'HEX8', 'HEX8': 'HEX8',
+                 'HEX20': 'HEX8', 'HEX27': 'HEX8', 'WEDGE': 'WEDGE6',
+                 'WEDGE6': 'WEDGE6', 'WEDGE15': 'WEDGE6',
+                 'WEDGE18': 'WEDGE6'}
+num_nodes = {'TRI3': 3, 'TRI6': 6, 'QUAD4': 4, 'QUAD9': 9, 'TET4': 4,
+             'TET10': 10, 'HEX8': 8, 'WEDGE6': 6}
+reference_dim = {'TRI3': 2, 'TRI6': 2, 'QUAD4': 2, 'QUAD9': 2, 'TET4': 3,
+                 'TET10': 3, 'HEX8': 3, 'WEDGE6': 3}
+reference_center = {'TRI3': [1 / 3., 1 / 3.], 'TRI6': [1 / 3., 1 / 3.],
+                    'QUAD4': [0., 0.], 'QUAD9': [0., 0.],
+                    'TET4': [.25, .25, .25], 'TET10': [.25, .25, .25],
+                    'HEX8': [0., 0., 0.], 'WEDGE6': [1 / 3., 1 / 3., 0.]}
+
+# Reference coordinates of the nodes of the tensor product elements
+quad4_nodes = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+quad9_nodes = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1], [0, -1], [1, 0],
+                        [0, 1], [-1, 0], [0, 0]])
+hex8_nodes = np.array([[-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+                       [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]])
+# Vertex pairs of the mid-edge nodes of quadratic simplices
+tri6_edges = [(0, 1), (1, 2), (2, 0)]
+tet10_edges = [(0, 1), (1, 2), (2, 0), (0, 3), (1, 3), (2, 3)]
+
+
+def barycentric(xi):
+    """ Barycentric coordinates of reference simplex points and their
+    gradients with respect to the reference coordinates."""
+    dim = xi.shape[1]
+    L = np.concatenate([1 - xi.sum(axis=1, keepdims=True), xi], axis=1)
+    dL = np.concatenate([-np.ones((1, dim)), np.eye(dim)])
+    return L, np.broadcast_to(dL, xi.shape[:1] + dL.shape)
+
+
+def lagrange_1d(x, nodes):
+    """ 1D Lagrange polynomials through nodes -1, 0, 1 (or -1, 1) at x,
+    indexed by node position, with their derivatives."""
+    if len(nodes) == 2:
+        return np.stack([(1 - x) / 2, (1 + x) / 2], -1), \
+            np.stack([-np.ones_like(x) / 2, np.ones_like(x) / 2], -1)
+    return np.stack([x * (x - 1) / 2, 1 - x**2, x * (x + 1) / 2], -1), \
+        np.stack([x - .5, -2 * x, x + .5], -1)
+
+
+def tensor_shape(xi, nodes):
+    """ Shape functions of a tensor product element whose nodes sit at the
+    reference coordinates nodes."""
+    positions = [-1, 0, 1] if np.any(nodes == 0) else [-1, 1]
+    N = np.ones((len(xi), len(nodes)))
+    dN = np.ones((len(xi), len(nodes), xi.shape[1]))
+    for d in range(xi.shape[1]):
+        l, dl = lagrange_1d(xi[:, d], positions)
+        index = [positions.index(p) for p in nodes[:, d]]
+        for e in range(xi.shape[1]):
+            dN[:, :, e] *= dl[:, index] if e == d else l[:, index]
+        N *= l[:, index]
+    return N, dN
+
+
+def shape_functions(elem_type, xi):
+    """
+        Shape functions of elem_type at the reference points xi.
+
+        Parameters
+        ----------
+        elem_type: str
+            One of the values of element_types
+        xi: array
+            Reference coordinates, shape (points, reference dimension)
+        Returns
+        ----------
+        N: array
+            Shape functions, shape (points, nodes)
+        dN: array
+            Their gradients, shape (points, nodes, reference dimension)
+    """
+    if elem_type in ['TRI3', 'TET4']:
+        return barycentric(xi)
+    if elem_type in ['TRI6', 'TET10']:
+        L, dL = barycentric(xi)
+        edges = tri6_edges if elem_type == 'TRI6' else tet10_edges
+        N = [L * (2 * L - 1)]
+        dN = [(4 * L - 1)[:, :, None] * dL]
+        i, j = np.array(edges).T
+        N.append(4 * L[:, i] * L[:, j])
+        dN.append(4 * (L[:, i, None] * dL[:, j] + L[:, j, None] * dL[:, i]))
+        return np.concatenate(N, axis=1), np.concatenate(dN, axis=1)
+    if elem_type == 'QUAD4':
+        return tensor_shape(xi, quad4_nodes)
+    if elem_type == 'QUAD9':
+        return tensor_shape(xi, quad9_nodes)
+    if elem_type == 'HEX8':
+        return tensor_shape(xi, hex8_nodes)
+    if elem_type == 'WEDGE6':
+        L, dL = barycentric(xi[:, :2])
+        z, dz = lagrange_1d(xi[:, 2], [-1, 1])
+        N = np.concatenate([L * z[:, :1], L * z[:, 1:]], axis=1)
+        dN = np.zeros((len(xi), 6, 3))
+        for k in range(2):
+            dN[:, 3 * k:3 * k + 3, :2] = dL * z[:, k, None, None]
+            dN[:, 3 * k:3 * k + 3, 2] = L * dz[:, k, None]
+        return N, dN
+    raise Exception('No shape functions for element type {}'.format(
+        elem_type))
+
+
+def inside_reference(elem_type, xi, tol=1e-8):
+    """ Whether each reference point lies in the reference element."""
+    finite = np.all(np.isfinite(xi), axis=1)
+    xi = np.where(finite[:, None], xi, 0)
+    if elem_type in ['TRI3', 'TRI6', 'TET4', 'TET10']:
+        inside = np.all(xi >= -tol, axis=1) & (xi.sum(axis=1) <= 1 + tol)
+    elif elem_type == 'WEDGE6':
+        inside = np.all(xi[:, :2] >= -tol, axis=1) & \
+            (xi[:, :2].sum(axis=1) <= 1 + tol) & (np.abs(xi[:, 2]) <= 1 + tol)
+    else:
+        inside = np.all(np.abs(xi) <= 1 + tol, axis=1)
+    return inside & finite
+
+
+def inverse_map(elem_type, X, points, iterations=20, tol=1e-12):
+    """
+        Reference coordinates of points in the elements with node
+        coordinates X, by Newton iterations on the isoparametric map.
+
+        Parameters
+        ----------
+        X: array
+            Node coordinates, shape (points, nodes, dim)
+        points: array
+            Physical coordinates, shape (points, dim)
+        Returns
+        ----------
+        xi: array
+            Reference coordinates, shape (points, dim)
+    """
+    xi = np.tile(reference_center[elem_type], (len(points), 1))
+    active = np.arange(len(points))
+    with np.errstate(all='ignore'):
+        for i in range(iterations):
+            N, dN = shape_functions(elem_type, xi[active])
+            Xa = X[active]
+            residual = points[active] - np.einsum('kn,knd->kd', N, Xa)
+            jacobian = np.einsum('knr,knd->kdr', dN, Xa)
+            singular = ~(np.abs(np.linalg.det(jacobian)) > 0)
+            jacobian[singular] = np.eye(xi.shape[1])
+            step = np.linalg.solve(jacobian, residual[:, :, None])[:, :, 0]
+            step[singular] = np.nan
+            xi[active] += step
+            # First order simplices have an affine map, one step is exact
+            if elem_type in ['TRI3', 'TET4']:
+                break
+            # Only points still moving are iterated further
+            active = active[np.any(np.abs(step) > tol, axis=1)]
+            if len(active) == 0:
+                break
+    return xi
+
+
+class point_locator:
+    """
+        Finds the element containing each of a set of points.
+
+        The bounding boxes of the elements of each block are binned on a
+        uniform grid, so each point is only tested against the few elements
+        whose bounding box covers its grid cell.
+
+        Parameters
+        ----------
+        coords: array
+            Node coordinates, shape (nodes, dim)
+        blocks: list
+            (element type, connectivity with 0-based node ids) of each block
+    """
+
+    def __init__(self, coords, blocks):
+        self.coords = coords
+        self.blocks = []
+        for elem_type, connect in blocks:
+            elem_type = element_types.get(elem_type.upper())
+            if elem_type is None or \
+                    reference_dim[elem_type] != coords.shape[1]:
+                # Lower dimensional blocks (edges, faces) hold no volume
+                self.blocks.append(None)
+                continue
+            connect = connect[:, :num_nodes[elem_type]]
+            self.blocks.append((elem_type, connect) + self.bin(connect))
+
+    def bin(self, connect):
+        X = self.coords[connect]
+        low, high = X.min(axis=1), X.max(axis=1)
+        origin = low.min(axis=0)
+        extent = high.max(axis=0) - origin
+        cell = np.median(high - low, axis=0)
+        cell = np.where(cell > 0, cell, np.where(extent > 0, extent, 1))
+        shape = np.clip(np.ceil(extent / cell), 1, None).astype(int)
+        # Keep the grid to a few cells per element
+        while np.prod(shape) > 4 * len(connect) + 64:
+            cell *= 2
+            shape = np.clip(np.ceil(extent / cell), 1, None).astype(int)
+        first = self.cell_of(low, origin, cell, shape)
+        last = self.cell_of(high, origin, cell, shape)
+        counts = np.prod(last - first + 1, axis=1)
+        elems = np.repeat(np.arange(len(connect)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) -
+                                                     counts, counts)
+        index = np.empty((len(elems), len(shape)), dtype=int)
+        for d in reversed(range(len(shape))):
+            width = (last - first + 1)[elems, d]
+            index[:, d] = first[elems, d] + offset % width
+            offset //= width
+        cells = np.ravel_multi_index(index.T, shape)
+        order = np.argsort(cells, kind='stable')
+        starts = np.searchsorted(cells[order], np.arange(np.prod(shape) + 1))
+        return origin, cell, shape, elems[order], starts, low, high
+
+    @staticmethod
+    def cell_of(x, origin, cell, shape):
+        return np.clip(np.floor((x - origin) / cell).astype(int), 0,
+                       shape - 1)
+
+    def locate(self, points):
+        """
+            Returns, for each block, the indices of the points found in it,
+            the element of each of those points within the block and their
+            shape function values. Points outside the mesh are in no block.
+        """
+        points = np.asarray(points, dtype=float)[:, :self.coords.shape[1]]
+        missing = np.ones(len(points), dtype=bool)
+        found = []
+        for block in self.blocks:
+            if block is None or not missing.any():
+                found.append(None)
+                continue
+            elem_type, connect, origin, cell, shape, elems, starts, low, \
+                high = block
+            candidates = np.nonzero(missing)[0]
+            x = points[candidates]
+            in_grid = np.all((x >= origin - 1e-12 * cell) &
+                             (x <= origin + cell * shape + 1e-12 * cell),
+                             axis=1)
+            candidates, x = candidates[in_grid], x[in_grid]
+            cells = np.ravel_multi_index(
+                self.cell_of(x, origin, cell, shape).T, shape)
+            counts = starts[cells + 1] - starts[cells]
+            pairs = np.repeat(np.arange(len(candidates)), counts)
+            pair_elems = elems[np.repeat(starts[cells], counts) +
+                               np.arange(counts.sum()) -
+                               np.repeat(np.cumsum(counts) - counts, counts)]
+            # Bounding boxes of the elements rule out most candidates before
+            # the inverse maps are computed
+            margin = 1e-8 * (high - low).max(axis=1, keepdims=True)
+            in_box = np.all((x[pairs] >= (low - margin)[pair_elems]) &
+                            (x[pairs] <= (high + margin)[pair_elems]), axis=1)
+            pairs, pair_elems = pairs[in_box], pair_elems[in_box]
+            xi = inverse_map(elem_type, self.coords[connect[pair_elems]],
+                             x[pairs])
+            inside = inside_reference(elem_type, xi)
+            # Keep the first element found for each point
+            pairs_in = np.nonzero(inside)[0]
+            unique, first = np.unique(pairs[pairs_in], return_index=True)
+            hit = pairs_in[first]
+            point_ids = candidates[unique]
+            missing[point_ids] = False
+            N = shape_functions(elem_type, xi[hit])[0]
+            found.append((point_ids, pair_elems[hit], N))
+        return found
+
+
+class exodus_file:
+    """
+        Lazy reader of an Exodus II file. Nothing but the dimensions and
+        names is read until coordinates, blocks or variables are asked for,
+        and variables are read one time step at a time.
+
+        Parameters
+        ----------
+        filename: str
+            Exodus file, e.g. a Moltres output *_out.e
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dataset = netCDF4.Dataset(filename)
+        self.dataset.set_auto_mask(False)
+        self.dim = self.dataset.dimensions['num_dim'].size
+        self._coords = None
+        self._blocks = None
+        self._locator = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.dataset.close()
+
+    def names(self, variable):
+        if variable not in self.dataset.variables:
+            return []
+        # Names are null terminated, with whatever follows left undefined
+        return [row.tobytes().split(b'\0')[0].decode('utf-8', 'replace')
+                for row in self.dataset.variables[variable][:]]
+
+    @property
+    def nodal_names(self):
+        return self.names('name_nod_var')
+
+    @property
+    def elemental_names(self):
+        return self.names('name_elem_var')
+
+    @property
+    def global_names(self):
+        return self.names('name_glo_var')
+
+    @property
+    def times(self):
+        return self.dataset.variables['time_whole'][:]
+
+    @property
+    def num_steps(self):
+        return self.dataset.dimensions['time_step'].size
+
+    @property
+    def steps(self):
+        """ Time steps whose variables can be read, all of them."""
+        return list(range(self.num_steps))
+
+    @property
+    def block_ids(self):
+        """ Id of each element block."""
+        return self.dataset.variables['eb_prop1'][:].tolist()
+
+    @property
+    def global_values(self):
+        """ Maps each global variable to its value at every time step."""
+        if 'vals_glo_var' not in self.dataset.variables:
+            return {}
+        values = self.dataset.variables['vals_glo_var'][:].astype(float)
+        return dict((name, values[:, i])
+                    for i, name in enumerate(self.global_names))
+
+    @property
+    def coords(self):
+        if self._coords is None:
+            variables = self.dataset.variables
+            if 'coord' in variables:
+                self._coords = variables['coord'][:self.dim].T.astype(float)
+            else:
+                self._coords = np.column_stack(
+                    [variables['coord' + axis][:]
+                     for axis in 'xyz'[:self.dim]]).astype(float)
+        return self._coords
+
+    @property
+    def blocks(self):
+        """ (element type, 0-based connectivity) of each element block."""
+        if self._blocks is None:
+            self._blocks = []
+            num_blocks = self.dataset.dimensions['num_el_blk'].size
+            for b in range(1, num_blocks + 1):
+                connect = self.dataset.variables.get('connect{}'.format(b))
+                if connect is None:
+                    # Empty blocks have no connectivity
+                    self._blocks.append(('NULL', np.zeros((0, 1), int)))
+                    continue
+                self._blocks.append((connect.elem_type,
+                                     connect[:].astype(int) - 1))
+        return self._blocks
+
+    @property
+    def locator(self):
+        if self._locator is None:
+            self._locator = point_locator(self.coords, self.blocks)
+        return self._locator
+
+    def step_index(self, step):
+        return step + self.num_steps if step < 0 else step
+
+    def nodal_variable(self, name):
+        names = self.nodal_names
+        if name not in names:
+            raise Exception('There is no nodal variable {} in {}'.format(
+                name, self.filename))
+        return self.dataset.variables[
+            'vals_nod_var{}'.format(names.index(name) + 1)]
+
+    def elemental_variables(self, name):
+        names = self.elemental_names
+        if name not in names:
+            raise Exception('There is no elemental variable {} in {}'.format(
+                name, self.filename))
+        index = names.index(name) + 1
+        return [self.dataset.variables.get(
+            'vals_elem_var{}eb{}'.format(index, b))
+            for b in range(1, len(self.blocks) + 1)]
+
+    def nodal(self, name, step=-1):
+        """ Values of a nodal variable at every node at one time step."""
+        return self.nodal_variable(name)[self.step_index(step)].astype(float)
+
+    def elemental(self, name, step=-1):
+        """ Values of an elemental variable in each block at one time step,
+        None for blocks it is not defined on."""
+        return [None if variable is None else
+                variable[self.step_index(step)].astype(float)
+                for variable in self.elemental_variables(name)]
+
+    def nodal_steps(self, name, steps):
+        """ Values of a nodal variable at every node at the time steps
+        of the slice steps of self.steps, shape (steps, nodes)."""
+        return np.asarray(self.nodal_variable(name)[steps], dtype=float)
+
+    def elemental_steps(self, name, steps, blocks):
+        """ Values of an elemental variable in each of the blocks at the
+        time steps of the slice steps of self.steps, shape (steps, block
+        elements), None for blocks it is not defined on."""
+        variables = self.elemental_variables(name)
+        return [None if variables[b] is None else
+                np.asarray(variables[b][steps], dtype=float) for b in blocks]
+
+    def sample(self, names, points, step=-1):
+        """
+            Interpolates variables at points.
+
+            Parameters
+            ----------
+            names: list of str
+                Nodal or elemental variables
+            points: array
+                Coordinates, shape (points, dim or more). Extra coordinates
+                are ignored, so 3D points can sample 2D meshes.
+            step: int
+                Time step, the last one by default
+            Returns
+            ----------
+            values: dict
+                Maps each name to its values at the points, NaN outside the
+                mesh
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        found = self.locator.locate(points)
+        values = {}
+        for name in names:
+            out = np.full(len(points), np.nan)
+            if name in self.nodal_names:
+                nodal = self.nodal(name, step)
+                for block, hits in zip(self.locator.blocks, found):
+                    if hits is not None:
+                        point_ids, elems, N = hits
+                        out[point_ids] = np.einsum(
+                            'pn,pn->p', N, nodal[block[1][elems]])
+            else:
+                elemental = self.elemental(name, step)
+                for block_values, hits in zip(elemental, found):
+                    if hits is not None and block_values is not None:
+                        out[hits[0]] = block_values[hits[1]]
+            values[name] = out
+        return values
+
+
+def line_points(start, end, num_points):
+    """ Points evenly spaced from start to end, and their distance from
+    start."""
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    t = np.linspace(0, 1, num_points)
+    return start + t[:, None] * (end - start), \
+        t * np.linalg.norm(end - start)
+
+
+def sample_line(filename, names, start, end, num_points, step=-1,
+                workers=None):
+    """
+        Samples variables of an Exodus file along the line from start to
+        end, like yt.LinePlot does. A split output is read from its pieces
+        filename.N.r by up to workers processes.
+
+        Returns
+        ----------
+        distance: array
+            Distance of each point from start
+        values: dict
+            Maps each variable name to its values along the line
+    """
+    # nemesis_reader builds on this module, so it is imported when used
+    from nemesis_reader import open_output
+    points, distance = line_points(start, end, num_points)
+    with open_output(filename, names, [step], workers) as exodus:
+        return distance, exodus.sample(names, points, step)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Samples variables of an Exodus file along a line.')
+    parser.add_argument('exodus_file', type=str,
+                        help='Exodus file to read, or the joined name of \
+                            a split output')
+    parser.add_argument('variables', type=str, nargs='+',
+                        help='nodal or elemental variables to sample')
+    parser.add_argument('--start', type=float, nargs='+', required=True,
+                        help='start point of the line')
+    parser.add_argument('--end', type=float, nargs='+', required=True,
+                        help='end point of the line')
+    parser.add_argument('-n', '--num-points', type=int, default=1000,
+                        help='number of points along the line')
+    parser.add_argument('--step', type=int, default=-1,
+                        help='time step, the last one by default')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='CSV file to write, printed if not given')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes reading the pieces of a \
+                            split output')
+    args = parser.parse_args()
+
+    points, distance = line_points(args.start, args.end, args.num_points)
+    values = sample_line(args.exodus_file, args.variables, args.start,
+                         args.end, args.num_points, args.step,
+                         args.workers)[1]
+    header = ','.join(['distance'] + ['xyz'[d] for d in
+                                      range(points.shape[1])] +
+                      args.variables)
+    table = np.column_stack([distance, points] +
+                            [values[name] for name in args.variables])
+    if args.output is None:
+        print(header)
+        for row in table:
+            print(','.join(map(repr, row.tolist())))
+    else:
+        np.savetxt(args.output, table, delimiter=',', header=header,
+                   comments='')
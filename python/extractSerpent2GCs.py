@@ -7,10 +7,143 @@
 # We may phase out this script in favor of the cleaner JSON format from
 # moltres_xs.py.
 import os
+import tempfile
 import numpy as np
 import argparse
-import subprocess
-import serpentTools as sT
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import xs_profile
+from xs_profile import stage
+from xs_manifest import xs_manifest
+
+
+def formatRows(temps, data):
+    """ Formats a whole property file at once: one line per temperature,
+    followed by that row of the stacked data, each value printed as its
+    shortest round-trip repr. The rows are stacked into one array and
+    filled into a single format string, instead of joining the values
+    of every row one by one."""
+    data = np.asarray(data, dtype=float).reshape(len(temps), -1)
+    values = np.empty((data.shape[0], data.shape[1] + 1), dtype=object)
+    values[:, 0] = [str(temp) for temp in temps]
+    values[:, 1:] = data.tolist()
+    line = '%s' + ' %r' * data.shape[1] + '\n'
+    return (line * data.shape[0]) % tuple(values.ravel().tolist())
+
+
+def writeAtomic(path, lines):
+    """ Writes lines to path through a temporary file in the same
+    directory, so that path is replaced in one step and never left
+    half written."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(''.join(lines))
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+# the constants moltres looks for:
+goodStuff = ['BETA_EFF', 'Chit', 'Chip', 'Chid', 'lambda', 'Diffcoef',
+             'Kappa', 'Sp0', 'Nsf', 'Invv', 'Remxs', 'Fiss', 'Nubar',
+             'Flx']
+goodMap = dict([(thing, 'inf' + thing) for thing in goodStuff])
+goodMap['BETA_EFF'] = 'betaEff'
+goodMap['lambda'] = 'lambda'
+
+
+def extractUniverse(universe):
+    """ Pulls every constant moltres looks for out of a serpentTools
+    universe. Precursor data keeps all 8 groups here; the 6 group cut
+    is made when writing."""
+    data = {}
+    for coefficient in goodStuff:
+        if coefficient == 'lambda' or coefficient == 'BETA_EFF':
+            # some additional formatting is needed here
+            data[coefficient] = universe.gc[goodMap[coefficient]][1:9]
+        else:
+            data[coefficient] = universe.infExp[goodMap[coefficient]]
+    return data
+
+
+def readMapping(mapFile, inmats):
+    """ Reads the primary branch to temperature mapping, returning
+    (material, branch, temperature) for every line. The material of a
+    branch is the first material whose name is part of the branch name."""
+    mapping = []
+    with open(mapFile) as fh:
+        for line in fh:
+            item, temp = tuple(line.split())
+            for mat in inmats:
+                if mat in item:
+                    mapping.append((mat, item, temp))
+                    break
+            else:
+                print('Considered materials: {}'.format(inmats))
+                raise Exception('Couldnt find a material corresponding to '
+                                'branch {}'.format(item))
+    return mapping
+
+
+def extractMaterial(mat, uni, items, secBranch):
+    """ Reads mat.coe and extracts the universe uni of every primary
+    branch in items, crossed with every secondary branch. Returns a dict
+    from (material, branch, secondary branch) to the extracted arrays;
+    the secondary branch is None if there are none."""
+    # serpentTools takes a second to import, more than the rest of a small
+    # run, so it is only imported once there is a .coe file to read. Its
+    # own stage keeps the import, which is much slower under memory tracing,
+    # apart from the reading.
+    with stage('import'):
+        import serpentTools as sT
+    with stage('read_coe', file=mat + '.coe'):
+        coe = sT.read(mat + '.coe')
+    index = {}
+    with stage('extract_universes'):
+        for item in items:
+            for branch in secBranch or [None]:
+                try:
+                    universe = coe.branches[
+                        item if branch is None else (item, branch)].universes[
+                            uni, 0, 0, None]
+                except KeyError:
+                    print(secBranch)
+                    raise Exception(
+                        'Check your mapping and secondary branch files.')
+                index[mat, item, branch] = extractUniverse(universe)
+    return index
+
+
+def extractMaterials(tasks, workers=None):
+    """ Runs extractMaterial on each task, in parallel by up to workers
+    processes, one per task by default, and merges their indexes."""
+    if workers is None:
+        workers = min(len(tasks), os.cpu_count() or 1)
+    index = {}
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            with stage('extract', mat=task[0]):
+                index.update(extractMaterial(*task))
+    elif xs_profile.active is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(extractMaterial, *zip(*tasks)):
+                index.update(result)
+    else:
+        # Each worker profiles its own stages and sends the records back
+        profiler = xs_profile.active
+        with stage('extract_pool'), \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(xs_profile.run_profiled,
+                                   profiler.trace_memory, extractMaterial,
+                                   *task) for task in tasks]
+            for task, future in zip(tasks, futures):
+                result, records = future.result()
+                profiler.add(records, prefix='extract', mat=task[0])
+                index.update(result)
+    return index
 
 
 def makePropertiesDir(
@@ -18,150 +151,135 @@ def makePropertiesDir(
         filebase,
         mapFile,
         secbranchFile,
-        unimapFile):
+        unimapFile,
+        workers=None,
+        incremental=False):
     """ Takes in a mapping from branch names to material temperatures,
-    then makes a properties directory."""
+    then makes a properties directory. Materials are read in parallel by
+    up to workers processes, one per material by default. Each stage and
+    material is recorded by the active profiler, see xs_profile.profiling.
+
+    With incremental, only the materials whose .coe file, universe,
+    branches or temperatures changed since the last incremental run are
+    extracted again, as recorded in outdir/filebase_manifest.json, and
+    only the files whose contents change are written."""
 
     if not os.path.isdir(outdir):
         os.mkdir(outdir)
 
-    # the constants moltres looks for:
-    goodStuff = ['BETA_EFF', 'Chit', 'Chip', 'Chid', 'lambda', 'Diffcoef',
-                 'Kappa', 'Sp0', 'Nsf', 'Invv', 'Remxs', 'Fiss', 'Nubar',
-                 'Flx']
-    goodMap = dict([(thing, 'inf' + thing) for thing in goodStuff])
-    goodMap['BETA_EFF'] = 'betaEff'
-    goodMap['lambda'] = 'lambda'
-
-    # map material names to universe names from serpent
-    with open(unimapFile) as fh:
-        uniMap = []
-        for line in fh:
-            uniMap.append(tuple(line.split()))
-    # this now maps material names to serpent universes
-    uniMap = dict(uniMap)
+    with stage('read_maps'):
+        # map material names to universe names from serpent
+        with open(unimapFile) as fh:
+            uniMap = []
+            for line in fh:
+                uniMap.append(tuple(line.split()))
+        # this now maps material names to serpent universes
+        uniMap = dict(uniMap)
+
+        # list of material names
+        inmats = list(uniMap.keys())
 
-    # list of material names
-    inmats = list(uniMap.keys())
+        print("Making properties for materials:")
+        print(inmats)
 
-    print("Making properties for materials:")
-    print(inmats)
-    coeList = dict([(mat, sT.read(mat + '.coe')) for mat in inmats])
+        # secondary branch burnup steps
+        secBranch = []
+        with open(secbranchFile) as bf:
+            for line in bf:
+                secBranch.append(line.rstrip('\n'))
 
-    # secondary branch burnup steps
-    secBranch = []
-    with open(secbranchFile) as bf:
-        for line in bf:
-            secBranch.append(line.rstrip('\n'))
+        # primary branch to temp mapping
+        mapping = readMapping(mapFile, inmats)
 
-    # primary branch to temp mapping
-    branch2TempMapping = open(mapFile)
+    # Each material's .coe file is read and its branches extracted by a
+    # separate task, building an index of the extracted arrays.
+    tasks = dict((mat, (mat, uniMap[mat],
+                        [item for currentMat, item, temp in mapping
+                         if currentMat == mat],
+                        secBranch)) for mat in inmats)
+    stale = inmats
+    if incremental:
+        with stage('check_manifest'):
+            manifest = xs_manifest(os.path.join(
+                outdir, filebase + '_manifest.json'))
+            specs = dict((mat, {'universe': uniMap[mat],
+                                'secBranch': secBranch,
+                                'mapping': [[item, temp]
+                                            for currentMat, item, temp
+                                            in mapping
+                                            if currentMat == mat]})
+                         for mat in inmats)
+            stale = [mat for mat in inmats
+                     if manifest.stale(mat, [mat + '.coe'], specs[mat])]
+    index = extractMaterials([tasks[mat] for mat in stale], workers)
 
     # Check if calculation uses 6 neutron precursor groups.
     # This prevents writing of excess zeros. Check if any
     # entries in the 7th and 8th group precursor positions
     # are nonzero, if so, use 8 groups.
-    use8Groups = False
-    for line in branch2TempMapping:
-        item, temp = tuple(line.split())
+    uses8 = dict((mat, any(np.any(data['BETA_EFF'][-2:] != 0.0)
+                           for key, data in index.items() if key[0] == mat))
+                 for mat in stale)
+    if incremental:
         for mat in inmats:
-            if mat in item:
-                currentMat = mat
-                break
-        if secBranch:
-            for branch in secBranch:
-                strData = coeList[currentMat].branches[
-                    item, branch].universes[
-                        uniMap[currentMat], 0, 0, None].gc[goodMap['BETA_EFF']]
-                strData = strData[1:9]
-                if np.any(strData[-2:] != 0.0):
-                    use8Groups = True
-        else:
-            strData = coeList[currentMat].branches[item].universes[
-                uniMap[currentMat], 0, 0, None].gc[goodMap['BETA_EFF']]
-            strData = strData[1:9]
-            if np.any(strData[-2:] != 0.0):
-                use8Groups = True
+            if mat not in uses8:
+                uses8[mat] = manifest.entry_data(mat)
+        if any(uses8.values()) != manifest.settings and \
+                len(stale) < len(inmats):
+            # The precursor data of every material is cut differently now
+            index.update(extractMaterials(
+                [tasks[mat] for mat in inmats if mat not in stale],
+                workers))
+            stale = inmats
+    use8Groups = any(uses8.values())
 
-    # Now loop through a second time
-    branch2TempMapping.close()
-    branch2TempMapping = open(mapFile)
+    # Collect the temperatures and data of every property file in memory
+    rows = {}
+    outputs = dict((mat, []) for mat in stale)
+    with stage('format_rows'):
+        for currentMat, item, temp in mapping:
+            if currentMat not in outputs:
+                continue
+            for branch in secBranch or [None]:
+                data = index[currentMat, item, branch]
+                for coefficient in goodStuff:
+                    strData = data[coefficient]
+                    # Cut off group 7 and 8 precursor params in 6
+                    # group calcs
+                    if not use8Groups and (coefficient == 'lambda' or
+                                           coefficient == 'BETA_EFF'):
+                        strData = strData[0:6]
+                    path = outdir + '/' + filebase + '_' + currentMat + '_'
+                    if branch is not None:
+                        path += branch + '_'
+                    path += coefficient.upper() + '.txt'
+                    if path not in rows:
+                        outputs[currentMat].append(path)
+                    temps, stacked = rows.setdefault(path, ([], []))
+                    temps.append(temp)
+                    stacked.append(strData)
 
-    for line in branch2TempMapping:
+    # Each file is formatted and written once, replacing any earlier
+    # run's output
+    with stage('write_files'):
+        for path, (temps, stacked) in rows.items():
+            text = formatRows(temps, stacked)
+            if incremental and manifest.same_content(path, text):
+                continue
+            writeAtomic(path, [text])
 
-        item, temp = tuple(line.split())
-        for mat in inmats:
-            if mat in item:
-                currentMat = mat
-                break
-        else:
-            print('Considered materials: {}'.format(inmats))
-            raise Exception(
-                'Couldnt find a material corresponding to branch {}'.format(
-                    item))
-
-        try:
-            if secBranch:
-                for branch in secBranch:
-                    for coefficient in goodStuff:
-                        with open(outdir + '/' + filebase + '_' + currentMat +
-                                  '_' + branch + '_' + coefficient.upper() +
-                                  '.txt', 'a') as fh:
-                            if coefficient == 'lambda' or \
-                                    coefficient == 'BETA_EFF':
-                                strData = coeList[currentMat].branches[
-                                    item, branch].universes[
-                                        uniMap[currentMat], 0, 0, None].gc[
-                                            goodMap[coefficient]]
-                                # some additional formatting is needed here
-                                strData = strData[1:9]
-
-                                # Cut off group 7 and 8 precursor params in 6
-                                # group calcs
-                                if not use8Groups:
-                                    strData = strData[0:6]
-                            else:
-                                strData = coeList[currentMat].branches[
-                                    item, branch].universes[
-                                        uniMap[currentMat], 0, 0, None].infExp[
-                                            goodMap[coefficient]]
-                            strData = ' '.join(
-                                [str(dat) for dat in strData]) if isinstance(
-                                    strData, np.ndarray) else strData
-                            fh.write(str(temp) + ' ' + strData)
-                            fh.write('\n')
+    if incremental:
+        for mat in stale:
+            manifest.record(mat, [mat + '.coe'], specs[mat], outputs[mat],
+                            bool(uses8[mat]))
+        # The files of dropped materials and secondary branches go too
+        manifest.prune(inmats, remove_outputs=True)
+        for mat in stale:
+            for path in outputs[mat]:
+                manifest.record_output(path)
+        manifest.settings = use8Groups
+        manifest.save()
 
-            else:
-                for coefficient in goodStuff:
-                    with open(outdir + '/' + filebase + '_' + currentMat +
-                              '_' + coefficient.upper() + '.txt', 'a') as fh:
-                        if coefficient == 'lambda' or \
-                                coefficient == 'BETA_EFF':
-                            strData = coeList[currentMat].branches[
-                                item].universes[
-                                    uniMap[currentMat], 0, 0, None].gc[
-                                        goodMap[coefficient]]
-                            # some additional formatting is needed here
-                            strData = strData[1:9]
-
-                            # Cut off group 7 and 8 precursor params in 6
-                            # group calcs
-                            if not use8Groups:
-                                strData = strData[0:6]
-                        else:
-                            strData = coeList[currentMat].branches[
-                                item].universes[
-                                    uniMap[currentMat], 0, 0, None].infExp[
-                                        goodMap[coefficient]]
-                        strData = ' '.join(
-                            [str(dat) for dat in strData]) if isinstance(
-                                strData, np.ndarray) else strData
-                        fh.write(str(temp) + ' ' + strData)
-                        fh.write('\n')
-
-        except KeyError:
-            print(secBranch)
-            raise Exception('Check your mapping and secondary branch files.')
 
 if __name__ == '__main__':
 
@@ -191,6 +309,22 @@ if __name__ == '__main__':
         type=str,
         nargs=1,
         help='File that maps material names to serpent universe')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes reading .coe files, \
+                            defaults to one per material up to the CPU \
+                            count')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only extract the materials whose .coe file or \
+                            mapping changed since the last incremental run')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='write the wall time, CPU time and peak memory \
+                            of each stage and material to this CSV file, \
+                            or JSON file if it ends in .json')
+    parser.add_argument('--cprofile', type=str, default=None,
+                        help='dump cProfile stats of the run to this file')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='do not trace the peak memory of the profiled \
+                            stages, which slows them down')
     args = parser.parse_args()
 
     # these are unpacked, so it fails if they werent passed to the script
@@ -200,7 +334,15 @@ if __name__ == '__main__':
     secbranchFile = args.secbranchFile[0]
     unimapFile = args.universeMap[0]
 
-    makePropertiesDir(outdir, fileBase, mapFile, secbranchFile,
-                      unimapFile)
+    profiler = xs_profile.stage_profiler(not args.no_trace_memory)
+    with contextlib.ExitStack() as context:
+        if args.profile is not None or args.cprofile is not None:
+            context.enter_context(xs_profile.profiling(profiler,
+                                                       args.cprofile))
+        makePropertiesDir(outdir, fileBase, mapFile, secbranchFile,
+                          unimapFile, args.workers, args.incremental)
+    if args.profile is not None:
+        profiler.write(args.profile)
+        print('\n'.join(profiler.summary()))
 
     print("Successfully made property files in directory {}.".format(outdir))
@@ -2,10 +2,172 @@
 # This script extracts homogenized group constants from Serpent 2 or SCALE into
 # a JSON data file to be used with MoltresJsonMaterial.
 import json
+import mmap
+import os
+import re
 import sys
 import argparse
+import contextlib
+import importlib
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from pyne import serpent
+from xs_cache import xs_cache
+from xs_manifest import xs_manifest
+import xs_profile
+from xs_profile import stage
+
+
+class xs_library:
+    """
+        Dense cross section library shared by scale_xs and serpent_xs. One
+        numpy array is kept per quantity, with axes (burnup, universe,
+        branch, group). GTRANSFXS has axes (burnup, universe, branch,
+        group, group) and BETA_EFF and DECAY_CONSTANT have the delayed
+        neutron groups as their last axis.
+
+        The library can still be indexed like the old nested dictionary,
+        xs_lib[burnup][universe][branch][XS], which returns a view into
+        the underlying array. Indexing by XS name alone returns the whole
+        array.
+
+        Parameters
+        ----------
+        num_burn: int
+            Number of burnup steps
+        num_uni: int
+            Number of universes
+        num_branch: int
+            Number of branches
+        num_groups: int
+            Number of energy groups
+        num_precursors: int
+            Number of delayed neutron precursor groups
+        select: tuple
+            (burnups, universes, branches) to store, each a list of
+            indices or None for all of them. Only the selected entries
+            are allocated but they keep their original indices.
+    """
+
+    XS_entries = ['REMXS', 'FISSXS', 'NSF', 'FISSE', 'DIFFCOEF',
+                  'RECIPVEL', 'CHI_T', 'BETA_EFF', 'DECAY_CONSTANT',
+                  'CHI_P', 'CHI_D', 'GTRANSFXS'
+                  ]
+    precursor_entries = ['BETA_EFF', 'DECAY_CONSTANT']
+    axes = ['burnup', 'universe', 'branch']
+
+    def __init__(self, num_burn, num_uni, num_branch, num_groups,
+                 num_precursors=0, select=None):
+        self.labels = []
+        for axis, num, labels in zip(self.axes,
+                                     (num_burn, num_uni, num_branch),
+                                     select or (None, None, None)):
+            if labels is None:
+                labels = range(num)
+            for label in labels:
+                if label not in range(num):
+                    raise Exception('There is no {} {} in this file'.format(
+                        axis, label + 1))
+            self.labels.append(list(labels))
+        self.positions = [dict((label, i) for i, label in enumerate(labels))
+                          for labels in self.labels]
+        self.shape = tuple(len(labels) for labels in self.labels)
+        self.num_groups = num_groups
+        self.data = {}
+        for entry in self.XS_entries:
+            if entry == 'GTRANSFXS':
+                self.data[entry] = np.zeros(
+                    self.shape + (num_groups, num_groups))
+            elif entry not in self.precursor_entries:
+                self.data[entry] = np.zeros(self.shape + (num_groups,))
+        self.set_num_precursors(num_precursors)
+
+    def to_arrays(self):
+        """Returns the XS arrays and the labels of each axis."""
+        arrays = dict(self.data)
+        for axis, labels in zip(self.axes, self.labels):
+            arrays[axis + '_labels'] = np.array(labels, dtype=int)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data):
+        """Rebuilds a library from the arrays of xs_library.to_arrays."""
+        select = [list(data[axis + '_labels']) for axis in cls.axes]
+        lib = cls(*[max(labels, default=-1) + 1 for labels in select],
+                  num_groups=data['REMXS'].shape[3],
+                  num_precursors=data['BETA_EFF'].shape[3],
+                  select=select)
+        for entry in cls.XS_entries:
+            lib.data[entry][...] = data[entry]
+        return lib
+
+    def subset(self, select):
+        """Returns a library of the selected (burnups, universes,
+        branches) of this one, None selecting all of them along an
+        axis."""
+        select = [labels if s is None else list(s)
+                  for labels, s in zip(self.labels, select)]
+        index = np.ix_(*[[positions[label] for label in labels]
+                         for positions, labels in zip(self.positions,
+                                                      select)])
+        arrays = dict((entry, self.data[entry][index])
+                      for entry in self.XS_entries)
+        for axis, labels in zip(self.axes, select):
+            arrays[axis + '_labels'] = np.array(labels, dtype=int)
+        return xs_library.from_arrays(arrays)
+
+    def set_num_precursors(self, num_precursors):
+        self.num_precursors = num_precursors
+        for entry in self.precursor_entries:
+            self.data[entry] = np.zeros(self.shape + (num_precursors,))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[key]
+        return xs_view(self, ())[key]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self.labels[0])
+
+
+class xs_view(Mapping):
+    """
+        Partially indexed xs_library. Once burnup, universe and branch are
+        all given, the keys are the XS names and the values are views into
+        the library arrays.
+    """
+
+    def __init__(self, lib, index):
+        self.lib = lib
+        self.index = index
+
+    def __getitem__(self, key):
+        axis = len(self.index)
+        if axis == len(self.lib.shape):
+            return self.lib.data[key][self.index]
+        if key not in self.lib.positions[axis]:
+            raise KeyError(key)
+        return xs_view(self.lib,
+                       self.index + (self.lib.positions[axis][key],))
+
+    def __len__(self):
+        if len(self.index) == len(self.lib.shape):
+            return len(self.lib.XS_entries)
+        return self.lib.shape[len(self.index)]
+
+    def __iter__(self):
+        if len(self.index) == len(self.lib.shape):
+            return iter(self.lib.XS_entries)
+        return iter(self.lib.labels[len(self.index)])
+
+    def to_dict(self):
+        """Returns the XS of a single branch as flat arrays, as they are
+        written to the JSON file, copied out of the library."""
+        return dict((entry, self[entry].ravel().copy())
+                    for entry in self.lib.XS_entries)
 
 
 class scale_xs:
@@ -16,131 +178,212 @@ class scale_xs:
         neutron groups, an arbitrary number of identities, an arbitrary
         number of temperature branches, and an arbitrary number of burnups.
 
+        The t16 file is streamed a single time. Record headers are matched
+        against a precompiled dispatch table and the numbers following them
+        are parsed straight into preallocated arrays.
+
         Parameters
         ----------
         xs_filename: str
             Name of file containing collapsed cross section data
         Returns
         ----------
-        xs_lib: dict
-            A hierarchical dictionary, organized by burnup, id,
+        xs_lib: xs_library
+            Cross section library, organized by burnup, id,
             and temperature.
             Currently stores REMXS, FISSXS, NSF, FISSE, DIFFCOEF, RECIPVEL,
             CHI, BETA_EFF, DECAY_CONSTANT and GTRANSFXS.
     """
 
-    def __init__(self, xs_filename):
-        with open(xs_filename) as f:
-            self.lines = f.readlines()
-        self.catch = {
-            'Betas': self.t16_line([], True, ['BETA_EFF']),
-            'Lambdas': self.t16_line([], True, ['DECAY_CONSTANT']),
-            'total-transfer': self.t16_line([1], False, ['REMXS']),
-            'fission': self.t16_line([0, 3, 4], False,
-                                     ['FISSXS', 'NSF', 'FISSE']
-                                     ),
-            'chi': self.t16_line([1, 1, 1, 2], False,
-                                 ['CHI_T', 'CHI_P', 'CHI_D', 'DIFFCOEF']
-                                 ),
-            'detector': self.t16_line([4], False, ['RECIPVEL']),
-            'Scattering cross': self.t16_line([], True, ['GTRANSFXS'])
-            }
-        XS_entries = ['REMXS', 'FISSXS', 'NSF', 'FISSE', 'DIFFCOEF',
-                      'RECIPVEL', 'CHI_T', 'BETA_EFF', 'DECAY_CONSTANT',
-                      'CHI_P', 'CHI_D', 'GTRANSFXS'
-                      ]
-        struct = (self.lines[3].split()[:4])
-        self.num_burn = int(struct[0])
-        self.num_temps = int(struct[1]) + 1
-        self.num_uni = int(struct[2])
-        self.num_groups = int(struct[3])
-        self.xs_lib = {}
-        for i in range(self.num_burn):
-            self.xs_lib[i] = {}
-            for j in range(self.num_uni):
-                self.xs_lib[i][j] = {}
-                for k in range(self.num_temps):
-                    self.xs_lib[i][j][k] = {}
-                    for entry in XS_entries:
-                        self.xs_lib[i][j][k][entry] = []
-        self.get_xs()
-        self.fix_xs()
-
     class t16_line:
         def __init__(self, ind, multi, entry):
             self.index = ind
             self.multi_line_flag = multi
             self.xs_entry = entry
 
+    catch = {
+        'Betas': t16_line([], True, ['BETA_EFF']),
+        'Lambdas': t16_line([], True, ['DECAY_CONSTANT']),
+        'total-transfer': t16_line([1], False, ['REMXS']),
+        'fission': t16_line([0, 3, 4], False, ['FISSXS', 'NSF', 'FISSE']),
+        'chi': t16_line([1, 1, 1, 2], False,
+                        ['CHI_T', 'CHI_P', 'CHI_D', 'DIFFCOEF']
+                        ),
+        'detector': t16_line([4], False, ['RECIPVEL']),
+        'Scattering cross': t16_line([], True, ['GTRANSFXS'])
+        }
+    # Bump when a change to the parser changes its results, so that cached
+    # libraries are parsed again.
+    parser_version = 1
+    # Headers that move the parser to a new branch, universe or group,
+    # followed by the headers of the records in catch.
+    header = re.compile(
+        r'branch no\.|Identifier|Energy group(?=\s+\d)|' +
+        '|'.join(re.escape(key) for key in catch))
+
+    def __init__(self, xs_filename, select=None):
+        with open(xs_filename) as f:
+            for i in range(4):
+                line = f.readline()
+            struct = (line.split()[:4])
+            self.num_burn = int(struct[0])
+            self.num_temps = int(struct[1]) + 1
+            self.num_uni = int(struct[2])
+            self.num_groups = int(struct[3])
+            self.xs_lib = xs_library(self.num_burn, self.num_uni,
+                                     self.num_temps, self.num_groups,
+                                     select=select)
+            with stage('parse'):
+                self.get_xs(f)
+        with stage('fix_xs'):
+            self.fix_xs()
+
     def fix_xs(self):
-        for i in range(self.num_burn):
-            for j in range(self.num_uni):
-                for k in range(self.num_temps):
-                    for ii in range(self.num_groups):
-                        start = ii*self.num_groups
-                        stop = start + self.num_groups
-                        self.xs_lib[i][j][k]["REMXS"][ii] += np.sum(
-                            self.xs_lib[i][j][k]["GTRANSFXS"][start:stop])\
-                            - self.xs_lib[i][j][k]["GTRANSFXS"][start+ii]
-                        if self.xs_lib[i][j][k]["FISSE"][ii] != 0:
-                            self.xs_lib[i][j][k]["FISSE"][ii] = (
-                                self.xs_lib[i][j][k]["FISSE"][ii] /
-                                self.xs_lib[i][j][k]["FISSXS"][ii]
-                                )
-
-    def get_xs(self):
-        uni = []
-        L = 0
-        m = 0
-        n = 0
-        lam_temp = 0
-        beta_temp = 0
-        for k, line in enumerate(self.lines):
-            if 'Identifier' in line:
-                val = int(self.lines[k+1].split()[0])
-                if val not in uni:
-                    uni.extend([val])
-                m = uni.index(val)
-                self.xs_lib[L][m][n]['BETA_EFF']\
-                    .extend(beta_temp)
-                self.xs_lib[L][m][n]['DECAY_CONSTANT']\
-                    .extend(lam_temp)
-            if 'branch no.' in line:
+        # Add the out-scatter to REMXS and turn kappa*fission into the
+        # energy released per fission, over the whole library at once.
+        scatter = self.xs_lib['GTRANSFXS']
+        remxs = self.xs_lib['REMXS']
+        remxs += scatter.sum(axis=-1) - np.diagonal(scatter, axis1=-2,
+                                                    axis2=-1)
+        fisse = self.xs_lib['FISSE']
+        np.divide(fisse, self.xs_lib['FISSXS'], out=fisse, where=fisse != 0)
+
+    def get_xs(self, f):
+        # Records of branches and universes that are not in the library
+        # are skipped without converting any of their numbers.
+        burns, unis, brans = self.xs_lib.positions
+        uni = {}
+        pos = None
+        branch_pos = None
+        g = 0
+        lam_temp = []
+        beta_temp = []
+        line = f.readline()
+        while line:
+            match = self.header.search(line) if line[0] == "'" else None
+            if match is None:
+                line = f.readline()
+                continue
+            key = match.group()
+            if key == 'branch no.':
                 index = line.find(',')
-                L = int(line[index-4:index])
-                n = int(line.split()[-1])
-            for key in self.catch.keys():
-                if key in line:
-                    if self.catch[key].multi_line_flag:
-                        if (key == 'Betas'):
-                            beta_temp = self.get_multi_line_values(k)
-                        elif(key == 'Lambdas'):
-                            lam_temp = self.get_multi_line_values(k)
-                        else:
-                            self.xs_lib[L][m][n][self.catch[key].xs_entry[0]]\
-                                .extend(
-                                    self.get_multi_line_values(k)
-                                    )
+                L = burns.get(int(line[index-4:index]))
+                n = brans.get(int(line.split()[-1]))
+                branch_pos = None if L is None or n is None else (L, n)
+                pos = None
+            elif key == 'Identifier':
+                val = int(f.readline().split()[0])
+                m = unis.get(uni.setdefault(val, len(uni)))
+                if branch_pos is None or m is None:
+                    pos = None
+                else:
+                    pos = (branch_pos[0], m, branch_pos[1])
+                    self.xs_lib['BETA_EFF'][pos] = beta_temp
+                    self.xs_lib['DECAY_CONSTANT'][pos] = lam_temp
+            elif key == 'Energy group':
+                g = int(line.split()[-1]) - 1
+            elif key in ['Betas', 'Lambdas']:
+                if branch_pos is not None:
+                    # The line ending a multi line record is the next header
+                    values, line = self.get_multi_line_values(f)
+                    if key == 'Betas':
+                        beta_temp = values
+                        if not self.xs_lib.num_precursors:
+                            self.xs_lib.set_num_precursors(len(values))
                     else:
-                        for dex, xs in enumerate(self.catch[key].xs_entry):
-                            dex = self.catch[key].index[dex]
-                            self.xs_lib[L][m][n][xs]\
-                                .append(self.get_values(k, dex))
-
-    def get_values(self, k, index):
-        val = list(np.array(self.lines[k+1].split()).astype(float))
-        return val[index]
-
-    def get_multi_line_values(self, k):
-        values = []
-        while True:
-            val = self.lines[k+1].split()
-            k += 1
-            for ent in val:
-                try:
-                    values.append(float(ent))
-                except(ValueError):
-                    return values
+                        lam_temp = values
+                    continue
+            elif pos is None:
+                pass
+            elif self.catch[key].multi_line_flag:
+                values, line = self.get_multi_line_values(f)
+                self.xs_lib[self.catch[key].xs_entry[0]][pos + (g,)] = values
+                continue
+            else:
+                val = f.readline().split()
+                for dex, xs in zip(self.catch[key].index,
+                                   self.catch[key].xs_entry):
+                    self.xs_lib[xs][pos + (g,)] = float(val[dex])
+            line = f.readline()
+
+    def get_multi_line_values(self, f):
+        block = []
+        line = f.readline()
+        while line and line[0] != "'":
+            block.append(line)
+            line = f.readline()
+        return np.array(''.join(block).split(), dtype=float), line
+
+
+class serpent_res:
+    """
+        Selective reader for Serpent 2 _res.m files. The file is memory
+        mapped and scanned once for the assignments of the requested
+        variables only. Their values are decoded into numpy arrays the
+        first time they are accessed; everything else in the file is never
+        decoded.
+
+        Parameters
+        ----------
+        res_filename: str
+            Name of the Serpent 2 _res.m file
+        keys: list of str
+            Names of the variables to read
+        Returns
+        ----------
+        serpent_res[key]: numpy array
+            One row per idx block of the file. As in the _res.m file,
+            numeric rows interleave values and relative errors, and string
+            variables are returned as an array of str.
+    """
+
+    def __init__(self, res_filename, keys):
+        self.offsets = dict((key, []) for key in keys)
+        self.values = {}
+        pattern = re.compile(
+            rb'^(' + b'|'.join(re.escape(key.encode()) for key in keys) +
+            rb')\s+\(idx[^=]*=', re.M)
+        with open(res_filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for match in pattern.finditer(self.mm):
+            end = self.mm.find(b';', match.end())
+            self.offsets[match.group(1).decode()].append((match.end(), end))
+
+    def __contains__(self, key):
+        return bool(self.offsets.get(key))
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            self.values[key] = self.rows(key, range(self.count(key)))
+        return self.values[key]
+
+    def count(self, key):
+        """Returns the number of idx blocks assigning key."""
+        if key not in self:
+            raise KeyError(key)
+        return len(self.offsets[key])
+
+    def rows(self, key, index):
+        """Decodes only the rows of key at the given idx positions. The
+        result has the shape of index plus the length of a row."""
+        index = np.asarray(index, dtype=int)
+        offsets = self.offsets[key] if key in self else []
+        rows = [self.mm[offsets[i][0]:offsets[i][1]].strip()
+                for i in index.ravel()]
+        if rows and rows[0][:1] == b"'":
+            return np.array([row.strip(b"'").decode()
+                             for row in rows]).reshape(index.shape)
+        return np.array(b' '.join(row.strip(b'[]') for row in rows).split(),
+                        dtype=float).reshape(index.shape + (-1,))
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class serpent_xs:
@@ -156,61 +399,327 @@ class serpent_xs:
             Name of file containing collapsed cross section data
         Returns
         ----------
-        xs_lib: dict
-            A hierarchical dict, organized by burnup, id, and temperature.
+        xs_lib: xs_library
+            Cross section library, organized by burnup, id, and temperature.
             Stores REMXS, FISSXS, NSF, FISSE, DIFFCOEF, RECIPVEL, CHI,
             BETA_EFF, DECAY_CONSTANT and GTRANSFXS.
     """
 
-    def __init__(self, xs_filename):
-        data = serpent.parse_res(xs_filename)
-        try:
-            num_burn = len(np.unique(data['BURNUP'][:][0]))
-        except(KeyError):
+    res_keys = {'REMXS': 'INF_REMXS', 'FISSXS': 'INF_FISS',
+                'NSF': 'INF_NSF', 'FISSE': 'INF_KAPPA',
+                'DIFFCOEF': 'INF_DIFFCOEF', 'RECIPVEL': 'INF_INVV',
+                'CHI_T': 'INF_CHIT', 'CHI_P': 'INF_CHIP',
+                'CHI_D': 'INF_CHID', 'GTRANSFXS': 'INF_SP0'}
+    parser_version = 1
+
+    def __init__(self, xs_filename, select=None):
+        keys = ['GC_UNIVERSE_NAME', 'BURNUP', 'BETA_EFF', 'LAMBDA'] + \
+            list(self.res_keys.values())
+        with stage('scan'):
+            data = serpent_res(xs_filename, keys)
+        with data, stage('parse'):
+            self.get_xs(data, select)
+
+    def get_xs(self, data, select=None):
+        if 'BURNUP' in data:
+            num_burn = len(np.unique(data['BURNUP'][:, 0]))
+        else:
             num_burn = 1
         num_uni = len(np.unique(data['GC_UNIVERSE_NAME']))
         num_temps = int(len(data['GC_UNIVERSE_NAME'])/(num_uni*num_burn))
-        self.xs_lib = {}
-        for i in range(num_burn):
-            self.xs_lib[i] = {}
-            for j in range(num_uni):
-                self.xs_lib[i][j] = {}
-                for k in range(num_temps):
-                    self.xs_lib[i][j][k] = {}
-                    index = i*(num_uni)+k*(num_burn*num_uni)+j
-                    self.xs_lib[i][j][k]["REMXS"] = list(
-                        data['INF_REMXS'][index][::2])
-                    self.xs_lib[i][j][k]["FISSXS"] = list(
-                        data['INF_FISS'][index][::2])
-                    self.xs_lib[i][j][k]["NSF"] = list(
-                        data['INF_NSF'][index][::2])
-                    self.xs_lib[i][j][k]["FISSE"] = list(
-                        data['INF_KAPPA'][index][::2])
-                    self.xs_lib[i][j][k]["DIFFCOEF"] = list(
-                        data['INF_DIFFCOEF'][index][::2])
-                    self.xs_lib[i][j][k]["RECIPVEL"] = list(
-                        data['INF_INVV'][index][::2])
-                    self.xs_lib[i][j][k]["CHI_T"] = list(
-                        data['INF_CHIT'][index][::2])
-                    self.xs_lib[i][j][k]["CHI_P"] = list(
-                        data['INF_CHIP'][index][::2])
-                    self.xs_lib[i][j][k]["CHI_D"] = list(
-                        data['INF_CHID'][index][::2])
-                    self.xs_lib[i][j][k]["BETA_EFF"] = list(
-                        data['BETA_EFF'][index][2::2])
-                    self.xs_lib[i][j][k]["DECAY_CONSTANT"] = list(
-                        data['LAMBDA'][index][2::2])
-                    self.xs_lib[i][j][k]["GTRANSFXS"] = list(
-                        data['INF_SP0'][index][::2])
-
-
-def read_input(fin):
+        num_groups = len(data.rows('INF_REMXS', [0])[0]) // 2
+        num_precursors = len(data.rows('BETA_EFF', [0])[0]) // 2 - 1
+        self.xs_lib = xs_library(num_burn, num_uni, num_temps, num_groups,
+                                 num_precursors, select)
+        # idx blocks are ordered by branch, then burnup, then universe.
+        # Only the blocks kept in the library are decoded.
+        order = np.arange(num_burn*num_uni*num_temps).reshape(
+            num_temps, num_burn, num_uni).transpose(1, 2, 0)
+        order = order[np.ix_(*self.xs_lib.labels)]
+        for entry, key in self.res_keys.items():
+            self.xs_lib[entry][...] = data.rows(key, order)[..., ::2].reshape(
+                self.xs_lib[entry].shape)
+        self.xs_lib["BETA_EFF"][...] = data.rows('BETA_EFF', order)[..., 2::2]
+        self.xs_lib["DECAY_CONSTANT"][...] = \
+            data.rows('LAMBDA', order)[..., 2::2]
+
+
+# Readers of the XS file types of the [FILES] section. A reader may be
+# registered as a 'module:class' string, which is imported the first time a
+# file of its type is read, so that a backend with heavy dependencies costs
+# nothing to the decks that do not use it.
+xs_readers = {'scale': scale_xs, 'serpent': serpent_xs}
+
+
+def register_reader(xs_type, reader):
+    """
+        Registers the reader of the XS files of type xs_type. The reader is
+        a class, or a 'module:class' string naming it, whose instances are
+        made from (xs_filename, select) and hold the xs_library in xs_lib.
+        It also needs a parser_version, to be bumped whenever its output
+        changes, which keys the xs_cache.
+    """
+    xs_readers[xs_type] = reader
+
+
+def get_reader(xs_type):
+    """
+        Returns the reader registered for xs_type, or for the first
+        registered type contained in it, importing it on first use.
+    """
+    name = xs_type if xs_type in xs_readers else next(
+        (name for name in xs_readers if name in xs_type), None)
+    if name is None:
+        raise Exception("XS data not understood\n \
+                        Please use: {}".format(' or '.join(xs_readers)))
+    reader = xs_readers[name]
+    if isinstance(reader, str):
+        module, attribute = reader.split(':')
+        reader = xs_readers[name] = getattr(importlib.import_module(module),
+                                            attribute)
+    return reader
+
+
+def load_xs(xs_filename, xs_type, cache=None, select=None):
+    """
+        Returns the xs_library of an XS file of a type registered in
+        xs_readers. When an xs_cache is given, the library is taken from it
+        if the file was parsed before and stored in it otherwise. select
+        limits the library to some burnups, universes and branches, see
+        xs_library.
+
+        The cache keeps one entry per file, holding the union along each
+        axis of the selections read so far. A selection within it is
+        served from the cache, and one reaching outside it parses the file
+        again for the widened union.
+    """
+    reader = get_reader(xs_type)
+    with stage('load', file=xs_filename):
+        if cache is None:
+            return reader(xs_filename, select).xs_lib
+        select = tuple(select or (None, None, None))
+        with stage('cache_load'):
+            key = cache.key(xs_filename, reader.__name__,
+                            reader.parser_version)
+            data = cache.load(key)
+        if data is not None and 'complete' in data:
+            # complete marks the axes stored whole, which a None selection
+            # needs
+            stored = [set(data[axis + '_labels']) for axis in
+                      xs_library.axes]
+            complete = data['complete']
+            if all(c or (s is not None and set(s) <= labels)
+                   for s, labels, c in zip(select, stored, complete)):
+                return xs_library.from_arrays(data).subset(select)
+            select_all = tuple(
+                None if c or s is None else sorted(labels | set(s))
+                for s, labels, c in zip(select, stored, complete))
+        else:
+            select_all = select
+        lib = reader(xs_filename, select_all).xs_lib
+        with stage('cache_store'):
+            arrays = lib.to_arrays()
+            arrays['complete'] = np.array([s is None for s in select_all])
+            cache.store(key, arrays)
+        if select_all == select:
+            return lib
+        return lib.subset(select)
+
+
+def load_files(xs_files, workers=None):
+    """
+        Loads the libraries of several XS files with load_xs, in parallel
+        over a pool of worker processes. The libraries are returned under
+        the keys of xs_files and a failure names the file it came from.
+
+        Parameters
+        ----------
+        xs_files: dict
+            Maps the position of each file in the deck to its
+            (xs_filename, xs_type, cache, select) arguments of load_xs
+        workers: int
+            Number of worker processes. Defaults to one per file, up to
+            the number of CPUs. With one worker the files are read in
+            this process.
+    """
+    if workers is None:
+        workers = min(len(xs_files), os.cpu_count() or 1)
+    if workers <= 1 or len(xs_files) <= 1:
+        files = {}
+        for i, args in sorted(xs_files.items()):
+            try:
+                files[i] = load_xs(*args)
+            except Exception as err:
+                raise Exception('Could not read XS file {}: {}'.format(
+                    args[0], err)) from err
+        return files
+    profiler = xs_profile.active
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if profiler is None:
+            futures = dict((i, pool.submit(load_xs, *args))
+                           for i, args in xs_files.items())
+        else:
+            # Workers profile themselves and send their records back
+            futures = dict((i, pool.submit(xs_profile.run_profiled,
+                                           profiler.trace_memory, load_xs,
+                                           *args))
+                           for i, args in xs_files.items())
+        files = {}
+        for i, future in sorted(futures.items()):
+            try:
+                files[i] = future.result()
+            except Exception as err:
+                raise Exception('Could not read XS file {}: {}'.format(
+                    xs_files[i][0], err)) from err
+            if profiler is not None:
+                files[i], records = files[i]
+                profiler.add(records)
+    return files
+
+
+def write_json(out_dict, f, digits=None):
+    """
+        Streams a library to the open file f as minified JSON, with keys
+        sorted as json.dumps(..., sort_keys=True) would. Values are
+        written a branch at a time, so the document is never built as one
+        string.
+
+        Parameters
+        ----------
+        out_dict: dict
+            Library as built by read_input
+        f: file
+            Open text file to write to
+        digits: int
+            Significant digits of the written floats. Defaults to the
+            shortest repr that reads back to the same float.
+
+        Non-finite values, e.g. from groups without flux, are written as
+        NaN, Infinity and -Infinity, as json.dumps writes them.
+    """
+    if digits is None:
+        finite = repr
+    else:
+        finite = '{{:.{}g}}'.format(digits).format
+
+    def fmt(value):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return finite(value)
+    f.write('{')
+    for i, mat in enumerate(sorted(out_dict)):
+        f.write('{}{}:{{'.format(',' if i else '', json.dumps(mat)))
+        for j, key in enumerate(sorted(out_dict[mat])):
+            f.write('{}{}:'.format(',' if j else '', json.dumps(key)))
+            if key == 'temp':
+                f.write(json.dumps(list(out_dict[mat][key])))
+                continue
+            xs_dict = out_dict[mat][key]
+            f.write('{')
+            for k, xs in enumerate(sorted(xs_dict)):
+                values = np.asarray(xs_dict[xs], dtype=float).ravel()
+                f.write('{}{}:[{}]'.format(
+                    ',' if k else '', json.dumps(xs),
+                    ','.join(map(finite if np.isfinite(values).all()
+                                 else fmt, values.tolist()))))
+            f.write('}')
+        f.write('}')
+    f.write('}')
+
+
+def save_library(out_dict, filename):
+    """
+        Writes a library to a binary .npz or, with a .h5 or .hdf5
+        extension, HDF5 file. Every XS array is stored under
+        material/temperature/XS and the temperatures of a material under
+        material/temp. Use load_library to read it back.
+    """
+    arrays = {}
+    for mat in out_dict:
+        arrays[mat + '/temp'] = np.asarray(out_dict[mat]['temp'])
+        for t in out_dict[mat]['temp']:
+            for xs, values in out_dict[mat][str(t)].items():
+                arrays['/'.join([mat, str(t), xs])] = np.asarray(values)
+    if os.path.splitext(filename)[1] in ['.h5', '.hdf5']:
+        import h5py
+        with h5py.File(filename, 'w') as f:
+            for key, values in arrays.items():
+                f[key] = values
+    else:
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+
+def load_library(filename):
+    """
+        Reads a library written as JSON, .npz or HDF5. Returns the
+        read_input layout with numpy arrays for the XS values and a list
+        for the temperatures of each material.
+    """
+    ext = os.path.splitext(filename)[1]
+    if ext == '.json':
+        with open(filename) as f:
+            arrays = {}
+            for mat, mat_dict in json.load(f).items():
+                for key, values in mat_dict.items():
+                    if key == 'temp':
+                        arrays[mat + '/temp'] = values
+                    else:
+                        for xs, xs_values in values.items():
+                            arrays['/'.join([mat, key, xs])] = xs_values
+    elif ext in ['.h5', '.hdf5']:
+        import h5py
+        with h5py.File(filename, 'r') as f:
+            arrays = {}
+            f.visititems(lambda key, node: arrays.__setitem__(key, node[()])
+                         if isinstance(node, h5py.Dataset) else None)
+    else:
+        with np.load(filename) as f:
+            arrays = dict(f)
+    out_dict = {}
+    for key, values in arrays.items():
+        path = key.split('/')
+        mat_dict = out_dict.setdefault(path[0], {})
+        if path[1] == 'temp':
+            mat_dict['temp'] = [int(t) for t in values]
+        else:
+            mat_dict.setdefault(path[1], {})[path[2]] = np.asarray(
+                values, dtype=float)
+    return out_dict
+
+
+binary_extensions = {'npz': '.npz', 'hdf5': '.h5'}
+
+
+def parse_deck(fin, directory=None):
+    """
+        Reads a moltres_xs input deck, without reading its XS files.
+
+        Parameters
+        ----------
+        fin: str
+            Name of the input deck
+        directory: str
+            Directory the XS files in [FILES] are relative to, the current
+            one by default
+        Returns
+        ----------
+        deck: dict
+            title: name of the JSON library in [TITLE]
+            materials: maps each material to its temperatures
+            files: (name, type) of each XS file in [FILES]
+            branches: (key, file, burnup, universe, branch) of each
+            [BRANCH] line, keyed 'material/temperature', with 0-based
+            indices
+    """
     with open(fin) as f:
         lines = f.readlines()
     k = 0
     for k, line in enumerate(lines):
         if '[TITLE]' in line:
-            f = open(lines[k+1].split()[0], 'w')
+            title = lines[k+1].split()[0]
         if '[MAT]' in line:
             mat_dict = {}
             num_mats = int(lines[k+1].split()[0])
@@ -239,26 +748,234 @@ def read_input(fin):
 
         if 'FILES' in line:
             num_files = int(lines[k+1].split()[0])
-            files = {}
+            xs_files = []
             for i in range(num_files):
                 XS_in, XS_t = lines[k+2+i].split()
-                if 'scale' in XS_t:
-                    files[i] = scale_xs(XS_in)
-                elif 'serpent'in XS_t:
-                    files[i] = serpent_xs(XS_in)
-                else:
-                    raise("XS data not understood\n \
-                          Please use: scale or serpent")
-    out_dict = {}
+                if directory is not None:
+                    XS_in = os.path.join(directory, XS_in)
+                xs_files.append((XS_in, XS_t))
+    branches = []
     for entry in mat_dict:
-        out_dict[entry] = {'temp': mat_dict[entry]['temps']}
         for i, t in enumerate(mat_dict[entry]['temps']):
             L = mat_dict[entry]['file'][i] - 1
-            m = mat_dict[entry]['burn'][i] - 1
-            n = mat_dict[entry]['uni'][i] - 1
-            p = mat_dict[entry]['bran'][i] - 1
-            out_dict[entry][str(t)] = files[L].xs_lib[m][n][p]
-    f.write(json.dumps(out_dict, sort_keys=True, indent=4))
+            if not 0 <= L < len(xs_files):
+                raise Exception(
+                    '[BRANCH] refers to file {}, but [FILES] lists {}'.format(
+                        L + 1, len(xs_files)))
+            branches.append(('{}/{}'.format(entry, t), L,
+                             mat_dict[entry]['burn'][i] - 1,
+                             mat_dict[entry]['uni'][i] - 1,
+                             mat_dict[entry]['bran'][i] - 1))
+    return {'title': title,
+            'materials': dict((entry, mat_dict[entry]['temps'])
+                              for entry in mat_dict),
+            'files': xs_files, 'branches': branches}
+
+
+def build_library(deck, cache_dir=None, use_cache=True, clear_cache=False,
+                  max_cache_size=2**30, workers=None, previous=None):
+    """
+        Reads the XS files of a deck and assembles its library in memory.
+        Nothing is written but the cache.
+
+        Parameters
+        ----------
+        deck: dict
+            Deck as returned by parse_deck
+        cache_dir: str
+            Directory of the parsed XS file cache. Defaults to a .xs_cache
+            directory next to each XS file.
+        use_cache: bool
+            Whether to use the cache at all
+        clear_cache: bool
+            Whether to empty the cache before reading the XS files
+        max_cache_size: int
+            Size limit of the cache directory in bytes
+        workers: int
+            Number of processes reading the XS files, see load_files
+        previous: dict
+            XS of some temperatures of some materials, in the library
+            layout, to take as they are instead of reading them
+        Returns
+        ----------
+        out_dict: dict
+            Maps each material to its temperatures under 'temp', and to
+            the XS of each temperature as flat arrays under the temperature
+            as a str. This is the layout load_library returns, which
+            xs_interp and convert_xs_tables take.
+    """
+    previous = previous or {}
+    stale = []
+    for b in deck['branches']:
+        entry, t = b[0].rsplit('/', 1)
+        if t not in previous.get(entry, {}):
+            stale.append(b)
+    # Only the burnups, universes and branches named in [BRANCH] are read,
+    # and files that [BRANCH] does not refer to are not read at all.
+    select = {}
+    for key, L, m, n, p in stale:
+        indices = select.setdefault(L, (set(), set(), set()))
+        indices[0].add(m)
+        indices[1].add(n)
+        indices[2].add(p)
+    xs_files = {}
+    caches = {}
+    for L, indices in select.items():
+        XS_in, XS_t = deck['files'][L]
+        cache = None
+        if use_cache:
+            path = cache_dir or os.path.join(
+                os.path.dirname(os.path.abspath(XS_in)), '.xs_cache')
+            if path not in caches:
+                caches[path] = xs_cache(path, max_cache_size)
+                if clear_cache:
+                    caches[path].clear()
+            cache = caches[path]
+        xs_files[L] = (XS_in, XS_t, cache,
+                       tuple(sorted(axis) for axis in indices))
+    files = load_files(xs_files, workers)
+    with stage('assemble'):
+        out_dict = dict((entry, {'temp': list(temps)})
+                        for entry, temps in deck['materials'].items())
+        stale_keys = set(b[0] for b in stale)
+        for key, L, m, n, p in deck['branches']:
+            entry, t = key.rsplit('/', 1)
+            if key in stale_keys:
+                out_dict[entry][t] = files[L][m][n][p].to_dict()
+            else:
+                out_dict[entry][t] = dict(
+                    (xs, np.asarray(values, dtype=float))
+                    for xs, values in previous[entry][t].items())
+    return out_dict
+
+
+def write_library(out_dict, filename, compact=False, digits=None,
+                  binary=None):
+    """
+        Writes a library as JSON, and optionally as a binary file next to
+        it. Returns the names of the files written.
+
+        Parameters
+        ----------
+        out_dict: dict
+            Library as returned by build_library
+        filename: str
+            JSON file to write
+        compact: bool
+            Stream the JSON file minified instead of indented
+        digits: int
+            Significant digits of the floats in a compact JSON file
+        binary: str
+            'npz' or 'hdf5' to also save the library in that binary
+            format, see save_library
+    """
+    with open(filename, 'w') as f:
+        if compact:
+            # Compact JSON is streamed, so serialization includes the writes
+            with stage('serialize', file=filename):
+                write_json(out_dict, f, digits)
+        else:
+            with stage('serialize', file=filename):
+                text = json.dumps(out_dict, sort_keys=True, indent=4,
+                                  default=np.ndarray.tolist)
+            with stage('write', file=filename):
+                f.write(text)
+    outputs = [filename]
+    if binary is not None:
+        outputs.append(os.path.splitext(filename)[0] +
+                       binary_extensions[binary])
+        with stage('save_binary', file=outputs[1]):
+            save_library(out_dict, outputs[1])
+    return outputs
+
+
+def read_input(fin, cache_dir=None, use_cache=True, clear_cache=False,
+               max_cache_size=2**30, workers=None, compact=False,
+               digits=None, binary=None, incremental=False):
+    """
+        Reads a moltres_xs input deck and writes the JSON library named in
+        its [TITLE] section, with parse_deck, build_library and
+        write_library. Returns the library, as build_library does.
+
+        Parameters
+        ----------
+        fin: str
+            Name of the input deck
+        cache_dir: str
+            Directory of the parsed XS file cache. Defaults to a .xs_cache
+            directory next to each XS file.
+        use_cache: bool
+            Whether to use the cache at all
+        clear_cache: bool
+            Whether to empty the cache before reading the XS files
+        max_cache_size: int
+            Size limit of the cache directory in bytes
+        workers: int
+            Number of processes reading the XS files, see load_files
+        compact: bool
+            Stream the JSON file minified instead of indented
+        digits: int
+            Significant digits of the floats in a compact JSON file
+        binary: str
+            'npz' or 'hdf5' to also save the library in that binary
+            format, next to the JSON file
+        incremental: bool
+            Only read the entries whose XS file or [BRANCH] line changed
+            since the last incremental run, as recorded in the manifest
+            next to the JSON file, and take the others from the JSON file.
+            Outputs are not written at all if nothing changed.
+
+        Each stage and XS file is recorded by the active profiler, see
+        xs_profile.profiling.
+    """
+    with stage('read_deck', file=fin):
+        deck = parse_deck(fin)
+    title = deck['title']
+    branches = deck['branches']
+    outputs = [title]
+    if binary is not None:
+        outputs.append(os.path.splitext(title)[0] + binary_extensions[binary])
+    previous = None
+    if incremental:
+        with stage('check_manifest'):
+            manifest = xs_manifest(os.path.splitext(title)[0] +
+                                   '.manifest.json')
+            settings = {'compact': compact, 'digits': digits}
+            stale = branches
+            if manifest.settings == settings and \
+                    manifest.output_intact(title):
+                stale = [b for b in branches if manifest.stale(
+                    b[0], [deck['files'][b[1]][0]],
+                    [deck['files'][b[1]][1]] + list(b[2:]))]
+            if not stale and \
+                    set(manifest.entries) == set(b[0] for b in branches) and \
+                    all(manifest.output_intact(path) for path in outputs):
+                with stage('read_previous', file=title):
+                    return load_library(title)
+        if len(stale) < len(branches):
+            # The unchanged entries are spliced in from the last output
+            with stage('read_previous', file=title):
+                with open(title) as f:
+                    library = json.load(f)
+            stale_keys = set(b[0] for b in stale)
+            previous = {}
+            for key, L, m, n, p in branches:
+                if key not in stale_keys:
+                    entry, t = key.rsplit('/', 1)
+                    previous.setdefault(entry, {})[t] = library[entry][t]
+    out_dict = build_library(deck, cache_dir, use_cache, clear_cache,
+                             max_cache_size, workers, previous)
+    write_library(out_dict, title, compact, digits, binary)
+    if incremental:
+        for key, L, m, n, p in branches:
+            manifest.record(key, [deck['files'][L][0]],
+                            [deck['files'][L][1], m, n, p], [title])
+        manifest.prune(set(b[0] for b in branches))
+        for path in outputs:
+            manifest.record_output(path)
+        manifest.settings = settings
+        manifest.save()
+    return out_dict
 
 
 if __name__ == '__main__':
@@ -271,8 +988,52 @@ if __name__ == '__main__':
                         nargs=1, help='*_res.m or *.t16 XS \
                             file from Serpent 2 or SCALE, \
                             respectively')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='directory of the parsed XS file cache, \
+                            defaults to .xs_cache next to each XS file')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='size limit of the cache in MB')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every XS file without using the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='empty the cache before parsing')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes reading the XS files, \
+                            defaults to one per file up to the CPU count')
+    parser.add_argument('--compact', action='store_true',
+                        help='write minified JSON instead of indented JSON')
+    parser.add_argument('--digits', type=int, default=None,
+                        help='significant digits of floats in compact JSON, \
+                            defaults to full precision')
+    parser.add_argument('--binary', choices=['npz', 'hdf5'], default=None,
+                        help='also save the library in this binary format')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only read the entries whose XS file or branch \
+                            changed since the last incremental run')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='write the wall time, CPU time and peak memory \
+                            of each stage and XS file to this CSV file, or \
+                            JSON file if it ends in .json')
+    parser.add_argument('--cprofile', type=str, default=None,
+                        help='dump cProfile stats of the run to this file')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='do not trace the peak memory of the profiled \
+                            stages, which slows them down')
     args = parser.parse_args()
 
-    read_input(sys.argv[1])
+    profiler = xs_profile.stage_profiler(not args.no_trace_memory)
+    with contextlib.ExitStack() as context:
+        if args.profile is not None or args.cprofile is not None:
+            context.enter_context(xs_profile.profiling(profiler,
+                                                       args.cprofile))
+        read_input(args.input_file[0], cache_dir=args.cache_dir,
+                   use_cache=not args.no_cache, clear_cache=args.clear_cache,
+                   max_cache_size=int(args.cache_size * 2**20),
+                   workers=args.workers, compact=args.compact,
+                   digits=args.digits, binary=args.binary,
+                   incremental=args.incremental)
+    if args.profile is not None:
+        profiler.write(args.profile)
+        print('\n'.join(profiler.summary()))
 
     print("Successfully made JSON property file.")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# This script reads the per rank pieces (out.e.N.r) that distributed Moltres
+# runs write with Nemesis output, without joining them into one file first.
+# The pieces are read in parallel processes, only for the variables and time
+# steps asked for, and the local node and element numbers of each piece are
+# mapped to the global ones through node_num_map and elem_num_map. The
+# result has the same arrays as the joined file and the interface of
+# exodus_sampler.exodus_file, so it can be sampled, reduced and rendered like
+# one. open_output opens either kind of output.
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from exodus_sampler import exodus_file
+
+
+def piece_files(base):
+    """
+        The pieces base.N.r of a split output, in rank order. Raises if
+        some rank is missing.
+    """
+    pattern = re.compile(re.escape(base) + r'\.(\d+)\.(\d+)$')
+    pieces = {}
+    for f in glob.glob(glob.escape(base) + '.*.*'):
+        match = pattern.match(f)
+        if match:
+            pieces[int(match.group(2))] = (int(match.group(1)), f)
+    if not pieces:
+        raise Exception('There are no pieces {}.N.r'.format(base))
+    sizes = set(size for size, f in pieces.values())
+    if len(sizes) != 1 or sorted(pieces) != list(range(sizes.pop())):
+        raise Exception('The pieces of {} are not ranks 0 to N - 1 of the '
+                        'same run'.format(base))
+    return [pieces[rank][1] for rank in sorted(pieces)]
+
+
+def read_piece(filename, nodal, elemental, steps):
+    """
+        Reads the mesh of one piece in global numbering, and the given
+        nodal and elemental variables at the given time steps.
+
+        Returns
+        ----------
+        piece: dict
+            nodes: global index of each local node
+            coords: coordinates of the local nodes
+            blocks: (block id, element type, global element indices,
+            connectivity in global node indices) of each block
+            names: maps block ids to block names
+            nodal: maps names to arrays of shape (steps, local nodes)
+            elemental: maps names to a list with the array of shape
+            (steps, block elements) of each block, None where the variable
+            is not defined
+    """
+    with exodus_file(filename) as exodus:
+        variables = exodus.dataset.variables
+        coords = exodus.coords
+        local = np.arange(len(coords))
+        nodes = variables['node_num_map'][:].astype(int) - 1 \
+            if 'node_num_map' in variables else local
+        elem_map = variables['elem_num_map'][:].astype(int) - 1 \
+            if 'elem_num_map' in variables else None
+        block_ids = exodus.block_ids
+        blocks = []
+        offset = 0
+        for block_id, (elem_type, connect) in zip(block_ids, exodus.blocks):
+            count = len(connect)
+            elems = np.arange(offset, offset + count) if elem_map is None \
+                else elem_map[offset:offset + count]
+            blocks.append((block_id, elem_type, elems, nodes[connect]))
+            offset += count
+        piece = {'nodes': nodes, 'coords': coords, 'blocks': blocks,
+                 'names': dict(zip(block_ids, exodus.names('eb_names'))),
+                 'nodal': {}, 'elemental': {}}
+        for name in nodal:
+            piece['nodal'][name] = variables['vals_nod_var{}'.format(
+                exodus.nodal_names.index(name) + 1)][steps]
+        for name in elemental:
+            index = exodus.elemental_names.index(name) + 1
+            piece['elemental'][name] = []
+            for b in range(1, len(blocks) + 1):
+                variable = variables.get(
+                    'vals_elem_var{}eb{}'.format(index, b))
+                piece['elemental'][name].append(
+                    None if variable is None else variable[steps])
+    return piece
+
+
+class nemesis_file(exodus_file):
+    """
+        The pieces of a split Exodus output, joined in memory.
+
+        Parameters
+        ----------
+        base: str
+            Name of the joined file, e.g. out.e for the pieces out.e.N.r
+        names: list of str
+            Nodal and elemental variables to read, all of them if None
+        steps: list of int
+            Time steps to read, all of them if None. Negative steps count
+            from the last one. Only these steps can be asked for later.
+        workers: int
+            Number of processes reading pieces, serial if 1
+    """
+
+    def __init__(self, base, names=None, steps=None, workers=None):
+        self.filename = base
+        self.pieces = piece_files(base)
+        with exodus_file(self.pieces[0]) as first:
+            self.dim = first.dim
+            self._times = first.times.astype(float)
+            self._global_names = first.global_names
+            all_nodal = first.nodal_names
+            all_elemental = first.elemental_names
+            variables = first.dataset.variables
+            dimensions = first.dataset.dimensions
+            self._global_values = first.global_values
+            num_nodes = dimensions['num_nodes_global'].size \
+                if 'num_nodes_global' in dimensions else None
+            block_order = variables['el_blk_ids_global'][:].tolist() \
+                if 'el_blk_ids_global' in variables else None
+        if names is None:
+            names = all_nodal + all_elemental
+        for name in names:
+            if name not in all_nodal and name not in all_elemental:
+                raise Exception('There is no nodal or elemental variable {} '
+                                'in {}'.format(name, self.pieces[0]))
+        self._nodal_names = [name for name in names if name in all_nodal]
+        self._elemental_names = [name for name in names
+                                 if name in all_elemental]
+        if steps is None:
+            steps = range(self.num_steps)
+        self._steps = sorted(set(self.step_index(s) for s in steps))
+
+        tasks = [(f, self._nodal_names, self._elemental_names, self.steps)
+                 for f in self.pieces]
+        if (workers is not None and workers <= 1) or len(tasks) <= 1:
+            pieces = [read_piece(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                pieces = list(pool.map(read_piece, *zip(*tasks)))
+        self._join(pieces, num_nodes, block_order)
+        self._locator = None
+
+    def _join(self, pieces, num_nodes, block_order):
+        if num_nodes is None:
+            num_nodes = max(piece['nodes'].max() + 1 for piece in pieces
+                            if len(piece['nodes']))
+        # Nodes on the boundaries between pieces get the same values from
+        # each of them
+        self._coords = np.zeros((num_nodes, self.dim))
+        self._nodal = dict((name, np.zeros((len(self.steps), num_nodes)))
+                           for name in self._nodal_names)
+        for piece in pieces:
+            self._coords[piece['nodes']] = piece['coords']
+            for name in self._nodal_names:
+                self._nodal[name][:, piece['nodes']] = piece['nodal'][name]
+
+        if block_order is None:
+            block_order = sorted(set(block[0] for piece in pieces
+                                     for block in piece['blocks']))
+        names = {}
+        for piece in pieces:
+            names.update((i, name) for i, name in piece['names'].items()
+                         if name)
+        self._block_ids = block_order
+        self._block_names = [names.get(i, '') for i in block_order]
+        self._blocks = []
+        self._elemental = dict((name, []) for name in self._elemental_names)
+        for block_id in block_order:
+            parts = [(piece, b) for piece in pieces
+                     for b, block in enumerate(piece['blocks'])
+                     if block[0] == block_id and len(block[2])]
+            if not parts:
+                self._blocks.append(('NULL', np.zeros((0, 1), int)))
+                for name in self._elemental_names:
+                    self._elemental[name].append(None)
+                continue
+            elems = np.concatenate([piece['blocks'][b][2]
+                                    for piece, b in parts])
+            # The joined file numbers the elements of a block in the order
+            # of their global ids
+            elems, order = np.unique(elems, return_index=True)
+            connect = np.concatenate([piece['blocks'][b][3]
+                                      for piece, b in parts])[order]
+            self._blocks.append((parts[0][0]['blocks'][parts[0][1]][1],
+                                 connect))
+            for name in self._elemental_names:
+                values = [piece['elemental'][name][b] for piece, b in parts]
+                if all(v is None for v in values):
+                    self._elemental[name].append(None)
+                    continue
+                values = [np.full((len(self.steps),
+                                   len(piece['blocks'][b][2])), np.nan)
+                          if v is None else v
+                          for v, (piece, b) in zip(values, parts)]
+                self._elemental[name].append(
+                    np.concatenate(values, axis=1)[:, order])
+
+    def close(self):
+        pass
+
+    def names(self, variable):
+        return {'name_nod_var': self._nodal_names,
+                'name_elem_var': self._elemental_names,
+                'name_glo_var': self._global_names,
+                'eb_names': self._block_names}.get(variable, [])
+
+    @property
+    def nodal_names(self):
+        return self._nodal_names
+
+    @property
+    def elemental_names(self):
+        return self._elemental_names
+
+    @property
+    def global_names(self):
+        return self._global_names
+
+    @property
+    def times(self):
+        return self._times
+
+    @property
+    def num_steps(self):
+        return len(self._times)
+
+    @property
+    def steps(self):
+        """ Time steps that were read."""
+        return self._steps
+
+    @property
+    def block_ids(self):
+        return self._block_ids
+
+    @property
+    def global_values(self):
+        return self._global_values
+
+    def step_position(self, step):
+        step = self.step_index(step)
+        if step not in self.steps:
+            raise Exception('Time step {} of {} was not read'.format(
+                step, self.filename))
+        return self.steps.index(step)
+
+    def nodal(self, name, step=-1):
+        """ Values of a nodal variable at every node at one time step."""
+        if name not in self._nodal:
+            raise Exception('Nodal variable {} of {} was not read'.format(
+                name, self.filename))
+        return self._nodal[name][self.step_position(step)]
+
+    def elemental(self, name, step=-1):
+        """ Values of an elemental variable in each block at one time step,
+        None for blocks it is not defined on."""
+        if name not in self._elemental:
+            raise Exception('Elemental variable {} of {} was not read'.format(
+                name, self.filename))
+        position = self.step_position(step)
+        return [None if values is None else values[position]
+                for values in self._elemental[name]]
+
+    def nodal_steps(self, name, steps):
+        """ Values of a nodal variable at every node at the time steps
+        of the slice steps of self.steps, shape (steps, nodes)."""
+        if name not in self._nodal:
+            raise Exception('Nodal variable {} of {} was not read'.format(
+                name, self.filename))
+        return self._nodal[name][steps]
+
+    def elemental_steps(self, name, steps, blocks):
+        """ Values of an elemental variable in each of the blocks at the
+        time steps of the slice steps of self.steps, shape (steps, block
+        elements), None for blocks it is not defined on."""
+        if name not in self._elemental:
+            raise Exception('Elemental variable {} of {} was not read'.format(
+                name, self.filename))
+        values = self._elemental[name]
+        return [None if values[b] is None else values[b][steps]
+                for b in blocks]
+
+
+def open_output(filename, names=None, steps=None, workers=None):
+    """
+        Opens filename as an exodus_file if it exists, or else joins its
+        pieces filename.N.r as a nemesis_file.
+    """
+    if os.path.exists(filename):
+        return exodus_file(filename)
+    return nemesis_file(filename, names, steps, workers)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Joins the pieces of a split Exodus output in memory and \
+            saves the mesh and variables to a .npz file.')
+    parser.add_argument('base', type=str,
+                        help='name of the joined file, e.g. out.e for the \
+                            pieces out.e.N.r')
+    parser.add_argument('variables', type=str, nargs='*',
+                        help='variables to read, all of them by default')
+    parser.add_argument('--steps', type=int, nargs='+', default=None,
+                        help='time steps to read, all of them by default')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes reading pieces')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='.npz file to write')
+    args = parser.parse_args()
+
+    joined = nemesis_file(args.base, args.variables or None, args.steps,
+                          args.workers)
+    arrays = {'coords': joined.coords, 'time': joined.times[joined.steps],
+              'steps': np.array(joined.steps)}
+    for b, (elem_type, connect) in enumerate(joined.blocks):
+        arrays['connect{}'.format(b + 1)] = connect
+    for name in joined.nodal_names:
+        arrays[name] = joined._nodal[name]
+    for name in joined.elemental_names:
+        for b, values in enumerate(joined._elemental[name]):
+            if values is not None:
+                arrays['{}_eb{}'.format(name, b + 1)] = values
+    for name, values in joined.global_values.items():
+        arrays[name] = values
+    np.savez(args.output, **arrays)
@@ -1,33 +1,144 @@
 #!/usr/bin/env python
-
+# This script fits polynomials in temperature to the property tables of a
+# material, for use in function materials like
+# MsreFuelTwoGrpXSFunctionMaterial. Every group of every cross section is a
+# column of one multi right hand side least squares problem, so the number
+# of groups and precursor groups is read from the tables.
+import argparse
 import numpy as np
-import subprocess
 
 xsecs = ["FLUX", "REMXS", "FISSXS", "NUBAR", "NSF", "FISSE", "DIFFCOEF",
          "RECIPVEL", "CHI", "GTRANSFXS", "BETA_EFF", "DECAY_CONSTANT"]
-num_groups = 2
-num_precursor_groups = 8
-xsec_dict = {"FLUX": num_groups, "REMXS": num_groups, "FISSXS": num_groups,
-             "NUBAR": num_groups, "NSF": num_groups, "FISSE": num_groups,
-             "DIFFCOEF": num_groups, "RECIPVEL": num_groups, "CHI": num_groups,
-             "GTRANSFXS": num_groups * num_groups,
-             "BETA_EFF": num_precursor_groups,
-             "DECAY_CONSTANT": num_precursor_groups}
 materials = ["fuel", "mod"]
+file_base = "msr2g_Th_U_two_mat_homogenization_dens_func_{mat}_data_func_of_" \
+    "{mat}_temp"
+
 
-for material in materials:
-    write_file_name = subprocess.call(["touch", "write_" + material])
-    file_base = "msr2g_Th_U_two_mat_homogenization_dens_func_" + \
-        material + "_data_func_of_" + material + "_temp"
-    write_file = open("write_" + material, 'r+')
+def read_tables(file_base, xsecs=xsecs):
+    """
+        Reads file_base + "_" + xsec + ".txt" for each xsec. Returns the
+        temperatures and a dict from xsec to an array with one column per
+        group.
+    """
+    temperature = None
+    tables = {}
     for xsec in xsecs:
         file_name = file_base + "_" + xsec + ".txt"
-        data = np.loadtxt(file_name)
-        temperature = data[:, 0]
-        A = np.vstack([temperature, np.ones(len(temperature))]).T
-        for k in range(xsec_dict[xsec]):
-            dep_var = data[:, k + 1]
-            m, c = np.linalg.lstsq(A, dep_var)[0]
-            write_file.write(str(m) + " " + str(c))
-            write_file.write('\n')
-    write_file.close()
+        data = np.loadtxt(file_name, ndmin=2)
+        if temperature is None:
+            temperature = data[:, 0]
+        elif not np.array_equal(data[:, 0], temperature):
+            raise Exception('Temperatures of {} differ from those of {}'
+                            .format(file_name,
+                                    file_base + "_" + xsecs[0] + ".txt"))
+        tables[xsec] = data[:, 1:]
+    return temperature, tables
+
+
+def fit_tables(temperature, tables, degree=1, log_temp=None):
+    """
+        Fits a polynomial of the given degree to every column of every table
+        with one least squares solve.
+
+        Parameters
+        ----------
+        temperature: array
+            Temperatures of the table rows
+        tables: dict
+            Maps each xsec to an array with one row per temperature
+        degree: int
+            Degree of the polynomials
+        log_temp: float
+            If given, the polynomials are in log(T / log_temp), like
+            MsreFuelTwoGrpXSFunctionMaterial, instead of in T
+        Returns
+        ----------
+        coefs: dict
+            Maps each xsec to an array of shape (columns, degree + 1),
+            highest power first
+        residuals: dict
+            Maps each xsec to the residuals of the fit at the table
+            temperatures, with the shape of its table
+    """
+    if len(temperature) <= degree:
+        raise Exception('{} temperatures cannot determine a polynomial of '
+                        'degree {}'.format(len(temperature), degree))
+    x = temperature if log_temp is None else np.log(temperature / log_temp)
+    A = np.vander(x, degree + 1)
+    # Scaling the columns keeps high degree fits in T well conditioned
+    scale = np.linalg.norm(A, axis=0)
+    scale[scale == 0] = 1
+    names = list(tables)
+    widths = [tables[xsec].shape[1] for xsec in names]
+    Y = np.hstack([tables[xsec] for xsec in names])
+    C = np.linalg.lstsq(A / scale, Y, rcond=None)[0] / scale[:, None]
+    R = Y - A @ C
+    coefs = {}
+    residuals = {}
+    bounds = np.cumsum([0] + widths)
+    for xsec, start, stop in zip(names, bounds[:-1], bounds[1:]):
+        coefs[xsec] = C[:, start:stop].T
+        residuals[xsec] = R[:, start:stop]
+    return coefs, residuals
+
+
+def write_coefficients(write_file, coefs):
+    """
+        Writes the coefficients of each column on its own line, highest
+        power first, going through the xsecs in order.
+    """
+    with open(write_file, 'w') as f:
+        for xsec, xsec_coefs in coefs.items():
+            for row in xsec_coefs.tolist():
+                f.write(" ".join(map(repr, row)) + "\n")
+
+
+def residual_report(tables, residuals):
+    """
+        Returns the lines of a report of the root mean square and maximum
+        absolute residual of each xsec, and of the maximum residual relative
+        to the largest value of the column.
+    """
+    lines = ['{:<16} {:>12} {:>12} {:>12}'.format(
+        'xsec', 'rms', 'max abs', 'max rel')]
+    for xsec, residual in residuals.items():
+        size = np.abs(tables[xsec]).max(axis=0)
+        rel = np.divide(np.abs(residual).max(axis=0), size,
+                        out=np.zeros(residual.shape[1]), where=size != 0)
+        lines.append('{:<16} {:>12.4e} {:>12.4e} {:>12.4e}'.format(
+            xsec, np.sqrt(np.mean(residual**2)), np.abs(residual).max(),
+            rel.max()))
+    return lines
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Fits polynomials in temperature to property tables.')
+    parser.add_argument('--materials', type=str, nargs='+',
+                        default=materials, help='materials to fit')
+    parser.add_argument('--file-base', type=str, default=file_base,
+                        help='root of the tables, {mat} is replaced by the \
+                            material')
+    parser.add_argument('--xsecs', type=str, nargs='+', default=xsecs,
+                        help='cross sections to fit')
+    parser.add_argument('--degree', type=int, default=1,
+                        help='degree of the polynomials')
+    parser.add_argument('--log-temp', type=float, default=None,
+                        help='fit in log(T / LOG_TEMP) instead of T')
+    parser.add_argument('--write-file', type=str, default="write_{mat}",
+                        help='coefficient file, {mat} is replaced by the \
+                            material')
+    parser.add_argument('--report', action='store_true',
+                        help='print the residuals of the fits')
+    args = parser.parse_args()
+
+    for material in args.materials:
+        temperature, tables = read_tables(
+            args.file_base.format(mat=material), args.xsecs)
+        coefs, residuals = fit_tables(temperature, tables, args.degree,
+                                      args.log_temp)
+        write_coefficients(args.write_file.format(mat=material), coefs)
+        if args.report:
+            print(material)
+            print("\n".join(residual_report(tables, residuals)))
@@ -1,5 +1,4 @@
-import yt
-from moltres_functions import actual_center_and_widths
+from slice_render import render_slices
 
 home_root = '/Users/lindad/'
 
@@ -14,40 +13,18 @@ field_label = {
     'pre5': r'C$_5$ cm$^{-3}$',
     'pre6': r'C$_6$ cm$^{-3}$'}
 names = [name for name in field_label.keys() if 'pre' in name]
-for name in names:
-    field_label[name + '_scaled'] = field_label[name]
 
+# Precursor concentrations are plotted scaled by 1e13, under a _scaled name
+figures = dict((name, home_root + 'publications/figures/2d_gamma_heating_' +
+                name + ('_scaled' if name in names else '') + '.eps')
+               for name in field_label)
 
-def _scale(field, data):
-    new_field = field.name
-    ftype, fname = new_field
-    original_fname = fname.split('_')[0]
-    return 1e13 * data[('all', original_fname)]
-
-
-ds = yt.load(
-    home_root +
-    'projects/moltres/tests/'
-    'twod_axi_coupled/2x_refined_from_base_with_gammas.e', step=-1)
-for i in range(1, 7):
-    fname = 'pre%d_scaled' % i
-    ds.add_field(('all', fname), function=_scale, take_log=False)
-actual_domain_widths, actual_center = actual_center_and_widths(ds)
-
-for field in ds.field_info.keys():
-    field_type, field_name = field
-    if field_type != 'all':
-        continue
-    if 'scaled' not in field_name and 'temp' not in field_name and 'group' not in field_name:
-        continue
-    slc = yt.SlicePlot(ds, 'z', field, origin='native', center=actual_center)
-    slc.set_log(field, False)
-    slc.set_width((actual_domain_widths[0], actual_domain_widths[1]))
-    slc.set_xlabel("r (cm)")
-    slc.set_ylabel("z (cm)")
-    if field_name == 'temp':
-        slc.set_zlim(field, 922, ds.all_data()[('all', 'temp')].max())
-    slc.set_colorbar_label(field, field_label[field_name])
-    slc.set_figure_size(3)
-    slc.save(home_root + 'publications/figures/2d_gamma_heating_' +
-             field_name + '.eps')
+if __name__ == '__main__':
+    render_slices(
+        home_root +
+        'projects/moltres/tests/'
+        'twod_axi_coupled/2x_refined_from_base_with_gammas.e',
+        list(field_label), figures, labels=field_label,
+        scale=dict((name, 1e13) for name in names),
+        zlim={'temp': (922, None)}, xlabel="r (cm)", ylabel="z (cm)",
+        size=3)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# This script renders slices of Moltres Exodus outputs for many fields at
+# once, without yt or a display. The chosen time step is read once, the
+# slice pixels are located in the mesh once and shared by all fields, the
+# color limits of every field come out of one pass over the stacked images,
+# and the figures are drawn in parallel processes.
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from exodus_sampler import exodus_file
+from nemesis_reader import open_output, piece_files
+
+axes = {'x': 0, 'y': 1, 'z': 2}
+
+
+def slice_points(low, high, axis='z', coord=None, resolution=800):
+    """
+        Pixel centers of a slice through the box from low to high.
+
+        Parameters
+        ----------
+        low, high: array
+            Corners of the box, of the dimension of the mesh
+        axis: str
+            Normal of the slice, x, y or z. The whole domain of a 2D mesh is
+            rendered with axis z.
+        coord: float
+            Position of the slice along axis, the middle of the box if None
+        resolution: int
+            Number of pixels along the longer side of the slice
+        Returns
+        ----------
+        points: array
+            Pixel centers, shape (rows * columns, dim)
+        shape: tuple
+            (rows, columns) of the image
+        extent: list
+            [left, right, bottom, top] of the image, for imshow
+    """
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    normal = axes[axis]
+    plane = [d for d in range(3) if d != normal][:2] if len(low) == 3 \
+        else [0, 1]
+    widths = high[plane] - low[plane]
+    pixel = widths.max() / resolution
+    columns, rows = np.maximum(np.round(widths / pixel).astype(int), 1)
+    u = low[plane[0]] + (np.arange(columns) + .5) * widths[0] / columns
+    v = low[plane[1]] + (np.arange(rows) + .5) * widths[1] / rows
+    U, V = np.meshgrid(u, v)
+    points = np.empty((rows * columns, len(low)))
+    points[:, plane[0]] = U.ravel()
+    points[:, plane[1]] = V.ravel()
+    if len(low) == 3:
+        points[:, normal] = (low[normal] + high[normal]) / 2 \
+            if coord is None else coord
+    extent = [low[plane[0]], high[plane[0]], low[plane[1]], high[plane[1]]]
+    return points, (rows, columns), extent
+
+
+def color_limits(images, zlim={}):
+    """
+        Color limits of every image in one pass over the stacked images.
+        zlim maps names to (low, high) limits overriding the automatic ones,
+        where either may be None to keep the automatic value.
+    """
+    names = list(images)
+    stacked = np.stack([images[name].ravel() for name in names])
+    with np.errstate(all='ignore'):
+        valid = np.isfinite(stacked)
+        low = np.where(valid, stacked, np.inf).min(axis=1)
+        high = np.where(valid, stacked, -np.inf).max(axis=1)
+    limits = {}
+    for name, vmin, vmax in zip(names, low.tolist(), high.tolist()):
+        fixed = zlim.get(name, (None, None))
+        limits[name] = (vmin if fixed[0] is None else fixed[0],
+                        vmax if fixed[1] is None else fixed[1])
+    return limits
+
+
+def draw(image, extent, limits, label, xlabel, ylabel, size, filename):
+    """ Draws one image to filename, run in a worker process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    height = size * image.shape[0] / float(image.shape[1])
+    fig, ax = plt.subplots(figsize=(size * 1.25, max(height, size / 4.)))
+    im = ax.imshow(np.ma.masked_invalid(image), origin='lower',
+                   extent=extent, vmin=limits[0], vmax=limits[1])
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.colorbar(im, ax=ax, label=label)
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+    return filename
+
+
+def render_slices(filename, names, output, axis='z', coord=None,
+                  resolution=800, step=-1, labels={}, scale={}, zlim={},
+                  xlabel='x (cm)', ylabel='y (cm)', size=3, workers=None):
+    """
+        Renders a slice of each field of an Exodus file to its own figure.
+
+        Parameters
+        ----------
+        filename: str
+            Exodus file, or the name of the joined file of a split output
+        names: list of str
+            Nodal or elemental variables to render
+        output: str or dict
+            Figure file names, {name} is replaced by the variable name, or
+            the file name of each variable
+        axis, coord, resolution:
+            See slice_points
+        step: int
+            Time step, the last one by default
+        labels: dict
+            Colorbar label of each variable, its name by default
+        scale: dict
+            Factor each variable is multiplied by before rendering
+        zlim: dict
+            Color limits overriding the automatic ones, see color_limits
+        xlabel, ylabel: str
+            Axis labels
+        size: float
+            Figure width in inches
+        workers: int
+            Number of processes reading pieces and drawing figures, serial
+            if 1
+        Returns
+        ----------
+        files: list
+            Names of the figures written
+    """
+    with open_output(filename, names, [step], workers) as exodus:
+        coords = exodus.coords
+        points, shape, extent = slice_points(
+            coords.min(axis=0), coords.max(axis=0), axis, coord, resolution)
+        values = exodus.sample(names, points, step)
+    images = dict((name, values[name].reshape(shape) * scale.get(name, 1))
+                  for name in names)
+    limits = color_limits(images, zlim)
+    if not isinstance(output, dict):
+        output = dict((name, output.format(name=name)) for name in names)
+    tasks = [(images[name], extent, limits[name], labels.get(name, name),
+              xlabel, ylabel, size, output[name]) for name in names]
+    if (workers is not None and workers <= 1) or len(tasks) <= 1:
+        return [draw(*task) for task in tasks]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(draw, *zip(*tasks)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Renders slices of Exodus variables to figures.')
+    parser.add_argument('exodus_file', type=str, help='Exodus file to read')
+    parser.add_argument('variables', type=str, nargs='*',
+                        help='variables to render, all nodal and elemental \
+                            variables by default')
+    parser.add_argument('-o', '--output', type=str, default='{name}.png',
+                        help='figure names, {name} is replaced by the \
+                            variable')
+    parser.add_argument('--axis', type=str, default='z', choices=list(axes),
+                        help='normal of the slice')
+    parser.add_argument('--coord', type=float, default=None,
+                        help='position of the slice, the middle by default')
+    parser.add_argument('--resolution', type=int, default=800,
+                        help='pixels along the longer side of the slice')
+    parser.add_argument('--step', type=int, default=-1,
+                        help='time step, the last one by default')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes drawing figures')
+    args = parser.parse_args()
+
+    names = args.variables
+    if not names:
+        first = args.exodus_file if os.path.exists(args.exodus_file) \
+            else piece_files(args.exodus_file)[0]
+        with exodus_file(first) as exodus:
+            names = exodus.nodal_names + exodus.elemental_names
+    for f in render_slices(args.exodus_file, names, args.output, args.axis,
+                           args.coord, args.resolution, args.step,
+                           workers=args.workers):
+        print(f)
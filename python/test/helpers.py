@@ -0,0 +1,25 @@
+# Helpers shared by the tests. Tests that write files do so in a temporary
+# directory, so that they can run in parallel and never leave outputs in
+# the test directory, even when they fail.
+import contextlib
+import os
+import shutil
+import tempfile
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+@contextlib.contextmanager
+def in_directory(files=()):
+    """Runs the body in a new temporary directory holding copies of files
+    of the test directory, and removes it afterwards"""
+    directory = tempfile.mkdtemp()
+    for f in files:
+        shutil.copy(os.path.join(test_dir, f), directory)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
@@ -0,0 +1,86 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from controlRodWorthMatcher import *
+from helpers import in_directory
+
+
+def standIn(factors, positions):
+    """Two rods 200 cm long whose worths saturate with the absorbtion
+    factor and shadow each other a little"""
+    if positions is None:
+        return 1.045
+    inserted = 1 - np.array(positions) / 200.
+    worth = 0.03 * (1 - np.exp(-np.array(factors) / 10.)) * inserted
+    rho = reactivity(1.045) - worth.sum() + 0.1 * worth.prod()
+    return 1 / (1 - rho)
+
+
+def test_matchRodWorths():
+    """Recovers the absorbtion factors of the stand-in model from its
+    worths, with the Jacobian columns evaluated in a process pool
+    """
+    positions = [[23.622, 200.], [200., 50.], [23.622, 50.]]
+    true = [14.22, 3.]
+    worths = [reactivity(standIn(true, p)) - reactivity(1.045)
+              for p in positions]
+    factors, residual = matchRodWorths(standIn, positions, worths, [5., 5.],
+                                       uncertainty=1e-9, workers=2)
+    assert np.allclose(factors, true, rtol=1e-4)
+    assert np.all(np.abs(residual) <= 1e-9)
+
+
+def test_moltresEvaluator():
+    """Runs a stand-in executable the way Moltres is run"""
+    with in_directory():
+        with open('rodded_test.i', 'w') as f:
+            f.write("[Materials]\n  [./fuel]\n"
+                    "    type = GenericMoltresMaterial\n"
+                    "  [../]\n  [./rodA]\n    type = RoddedMaterial\n"
+                    "    absorb_factor = 1\n  [../]\n  [./rodB]\n"
+                    "    block = 'rod'\n    type = RoddedMaterial\n"
+                    "  [../]\n[]\n")
+        with open('fake_moltres.py', 'w') as f:
+            f.write("import sys\n"
+                    "values = dict(a.split('=') for a in sys.argv[3:])\n"
+                    "assert sys.argv[1:3] == ['-i', 'rodded_test.i']\n"
+                    "open(values['Outputs/file_base'] + '.csv', 'w').close()\n"
+                    "print('k = 1.2')\n"
+                    "print('k = {}'.format(float(values['Materials/rodA/"
+                    "absorb_factor']) + float(values.get('Materials/rodB/"
+                    "rodPosition', 0))))\n")
+
+        with open('rodded_test.i') as f:
+            rods = findRods(f.read())
+        assert rods == ['rodA', 'rodB']
+        evaluator = moltresEvaluator('rodded_test.i', rods,
+                                     [sys.executable, 'fake_moltres.py'])
+        assert evaluator((2., 3.), None) == 2.
+        assert evaluator((2., 3.), (10., 20.)) == 22.
+        assert not glob.glob('rodMatch_*')
+
+
+def test_readFactors():
+    """Initial factors come from the rod blocks, past their sub-blocks,
+    or from [GlobalParams], and bad starting factors are refused
+    """
+    text = ("[GlobalParams]\n  absorb_factor = 4\n[]\n[Materials]\n"
+            "  [./rodA]\n    type = RoddedMaterial\n    [./sub]\n"
+            "      absorb_factor = 9\n    [../]\n"
+            "    absorb_factor = 2.5 # tuned\n  [../]\n"
+            "  [rodB]\n    type = RoddedMaterial\n  []\n[]\n")
+    assert readFactors(text, ['rodA', 'rodB']) == [2.5, 4.]
+    try:
+        readFactors(text.replace('absorb_factor = 4', ''), ['rodB'])
+        assert False
+    except Exception as e:
+        assert 'rodB' in str(e) and '--factors' in str(e)
+
+    for factors in [[0., 5.], [-1., 5.]]:
+        try:
+            matchRodWorths(standIn, [[23.622, 200.]], [-0.01], factors,
+                           workers=1)
+            assert False
+        except Exception as e:
+            assert 'positive' in str(e)
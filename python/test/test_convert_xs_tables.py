@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from convert_xs_tables import *
+from helpers import in_directory, test_dir
+
+
+def test_round_trip():
+    """Converts the gold Serpent txt tables to a JSON library and back,
+    checking that the tables keep their values
+    """
+    gold = os.path.join(test_dir, 'gold', 'xs')
+    roots = find_roots(gold)
+    assert roots == {os.path.join(gold, 'msfr_fuel_'): True,
+                     os.path.join(gold, 'msfr_blanket_'): True}
+
+    with in_directory():
+        out_dict = txt_to_json(roots, 'tables.json')
+        assert sorted(out_dict) == ['msfr_blanket', 'msfr_fuel']
+        assert out_dict['msfr_fuel']['temp'] == [900, 1200]
+        assert len(out_dict['msfr_fuel']['900']['GTRANSFXS']) == 36
+
+        json_to_txt('tables.json', 'tables', sss2=True)
+        for root in roots:
+            temps, tables = read_tables(root, True)
+            key = os.path.basename(root)
+            new_temps, new_tables = read_tables('tables/' + key, True)
+            assert new_temps == temps
+            for xs in tables:
+                assert np.array_equal(new_tables[xs], tables[xs])
+
+        # Without sss2_input names CHI_T goes to the shared CHI table
+        json_to_txt('tables.json', 'tables_std')
+        assert os.path.exists('tables_std/msfr_fuel_CHI.txt')
+        assert not os.path.exists('tables_std/msfr_fuel_CHIT.txt')
+
+
+def test_incomplete_roots():
+    """Prefixes of the property directory that are not converted are
+    reported with the tables they lack
+    """
+    directory = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))), 'property_file_dir')
+    incomplete = incomplete_roots(directory)
+    for part in ['all', 'fuel', 'moder']:
+        root = os.path.join(directory,
+                            'B1_msre_single_unit_cell_{}_'.format(part))
+        assert incomplete[root] == [os.path.basename(root) + 'CHIP.txt']
+    roots = find_roots(directory)
+    assert not set(roots) & set(incomplete)
@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exodus_history import *
+
+gold = '../../tests/{}/gold/{}.e'
+
+
+def test_volume_weights():
+    """Volumes of the cartesian and RZ box meshes are exact, and the node
+    weights of each block add up to its volume
+    """
+    with exodus_file(gold.format('pre', 'pre_out')) as exodus:
+        node_weights, elem_volumes = volume_weights(exodus)
+        assert np.isclose(sum(v.sum() for v in elem_volumes), 72.5 * 150)
+        for w, v in zip(node_weights, elem_volumes):
+            assert np.isclose(w.sum(), v.sum())
+        node_weights, elem_volumes = volume_weights(exodus, rz=True)
+        assert np.isclose(sum(v.sum() for v in elem_volumes),
+                          np.pi * 72.5**2 * 150)
+    with exodus_file(gold.format('laminar_flow', '3d_channel_flow_out')) \
+            as exodus:
+        coords = exodus.coords
+        node_weights, elem_volumes = volume_weights(exodus)
+        assert np.isclose(elem_volumes[0].sum(),
+                          np.prod(coords.max(axis=0) - coords.min(axis=0)))
+
+
+def test_time_history():
+    """Streaming in one step chunks matches reductions of the whole arrays,
+    and integrating a constant gives the volume
+    """
+    filename = gold.format('decay_heat', 'decay_heat_out')
+    history = time_history(filename, ['heat1'], rz=True, chunk_bytes=1)
+    with exodus_file(filename) as exodus:
+        volumes = volume_weights(exodus, rz=True)[1]
+        values = exodus.dataset.variables['vals_elem_var1eb1'][:]
+    assert np.allclose(history['time'], [0, 1])
+    assert np.array_equal(history['heat1_max'], values.max(axis=1))
+    assert np.allclose(history['heat1_integral_fuel'], values @ volumes[0])
+    assert np.allclose(history['heat1_average'],
+                       values @ volumes[0] / volumes[0].sum())
+
+    filename = gold.format('twod_axi_coupled', 'auto_diff_rho')
+    history = time_history(filename, ['temp'])
+    with exodus_file(filename) as exodus:
+        temp = exodus.nodal('temp')
+    assert history['temp_max'][0] == temp.max()
+    assert np.isclose(history['temp_integral'][0],
+                      history['temp_integral_fuel'][0] +
+                      history['temp_integral_moder'][0])
+    assert temp.min() <= history['temp_average'][0] <= temp.max()
+    assert 'multiplication' in history
+
+
+def test_write_history():
+    filename = gold.format('pre', 'pre_out')
+    history = time_history(filename, ['pre1'])
+    write_history(history, 'history_test.csv')
+    with open('history_test.csv') as f:
+        assert f.readline().strip().split(',') == list(history)
+    data = np.loadtxt('history_test.csv', delimiter=',', skiprows=1)
+    assert np.allclose(data[:, list(history).index('pre1_integral')],
+                       history['pre1_integral'])
+    os.remove('history_test.csv')
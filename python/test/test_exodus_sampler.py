@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exodus_sampler import *
+
+gold = '../../tests/{}/gold/{}.e'
+
+
+def test_sample_nodes():
+    """Sampling at the nodes gives back the nodal values, and elemental
+    values come from the containing element
+    """
+    with exodus_file(gold.format('twod_axi_coupled', 'auto_diff_rho')) \
+            as exodus:
+        assert exodus.nodal_names == ['group1', 'group2', 'temp']
+        nodes = np.arange(0, len(exodus.coords), 7)
+        values = exodus.sample(['temp', 'pre1'], exodus.coords[nodes])
+        assert np.allclose(values['temp'], exodus.nodal('temp')[nodes])
+
+        connect = exodus.blocks[0][1]
+        centers = exodus.coords[connect].mean(axis=1)
+        values = exodus.sample(['pre1'], centers, step=0)
+        assert np.array_equal(values['pre1'], exodus.elemental('pre1', 0)[0])
+
+
+def test_shape_functions():
+    """The isoparametric map of every element type found in the gold files
+    takes the reference coordinates of located points back to the points
+    """
+    for test, name in [('twod_axi_coupled', 'auto_diff_rho'),
+                       ('laminar_flow', 'RZ_p_parts_do_nothing_bcs_out'),
+                       ('laminar_flow', 'RZ_p_parts_do_nothing_bcs_cone_out'),
+                       ('laminar_flow',
+                        'constant_ending_channel_3d_unstructured_out'),
+                       ('laminar_flow', '3d_channel_flow_out')]:
+        with exodus_file(gold.format(test, name)) as exodus:
+            coords = exodus.coords
+            low, high = coords.min(axis=0), coords.max(axis=0)
+            points = low + (high - low) * np.random.default_rng(0).random(
+                (500, exodus.dim))
+            found = exodus.locator.locate(points)
+            total = 0
+            for block, hits in zip(exodus.locator.blocks, found):
+                if hits is None:
+                    continue
+                point_ids, elems, N = hits
+                total += len(point_ids)
+                assert np.allclose(np.einsum('pn,pnd->pd', N,
+                                             coords[block[1][elems]]),
+                                   points[point_ids], atol=1e-10)
+                assert np.allclose(N.sum(axis=1), 1)
+            assert total > 0
+
+
+def test_sample_line():
+    """Samples a line running out of the mesh"""
+    distance, values = sample_line(
+        gold.format('twod_axi_coupled', 'auto_diff_rho'), ['temp'],
+        [0, 0, 0], [0, 162.56, 0], 5)
+    assert np.allclose(distance, np.linspace(0, 162.56, 5))
+    assert values['temp'][0] == 922
+    assert np.all(np.isfinite(values['temp'][:4]))
+    assert np.isnan(values['temp'][4])
@@ -71,3 +71,39 @@ def test_makePropertiesDir():
             assert data == expected
             os.remove(path)     # Delete xs file after check
     os.rmdir(outdir)        # Delete empty xs directory
+
+
+def test_makePropertiesDir_rerun():
+    """Tests that running extractSerpent2GCs.py twice into the same
+    directory gives the same files as a single run.
+    """
+    outdir = 'xs'
+    fileBase = 'msfr'
+    mapFile = 'tempMapping.txt'
+    secbranchFile = 'sec.txt'
+    unimapFile = 'unimapFile.txt'
+
+    for i in range(2):
+        extract_properties(outdir, fileBase, mapFile, secbranchFile,
+                           unimapFile)
+
+    for name in os.listdir(outdir):
+        path = outdir + '/' + name
+        data = list(open(path, 'r'))
+        expected = list(open('gold/' + path, 'r'))
+        assert data == expected
+        os.remove(path)
+    os.rmdir(outdir)
+
+
+def test_formatRows():
+    """A whole file is formatted at once, and every value reads back
+    exactly
+    """
+    data = [np.array([0.1 + 0.2, 1e-300, 6.02214076e23]),
+            np.array([1 / 3., -0., 7.])]
+    text = formatRows(['900', 1200], data)
+    assert text == ('900 0.30000000000000004 1e-300 6.02214076e+23\n'
+                    '1200 0.3333333333333333 -0.0 7.0\n')
+    rows = [line.split() for line in text.splitlines()]
+    assert np.array_equal(np.array(rows, dtype=float)[:, 1:], data)
@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+benchmark_dir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))), 'property_file_dir', 'cnrs-benchmark')
+sys.path.append(benchmark_dir)
+from feedback import *
+
+# At 950 and 1000 K the density is 2000 * (1 - 2e-4 * 50) = 1980 and
+# 2000 * (1 - 2e-4 * 100) = 1960 kg m-3, 0.99 and 0.98 of the 900 K density
+ratios = {950: 0.99, 1000: 0.98}
+tables = {'REMXS': [[900, 1., 2.]], 'DIFFCOEF': [[900, 1.5, 0.5]],
+          'CHIT': [[900, 0.25, 0.75]], 'FISS': [[900, 0.5, 1.]],
+          'NSF': [[900, 1.25, 2.5]], 'SP0': [[900, 0.5, 0.1]]}
+
+
+def write_tables(directory):
+    for xs, rows in tables.items():
+        with open(os.path.join(directory, 'x_' + xs + '.txt'), 'w') as f:
+            f.write('# 900 K data\n\n')
+            for row in rows:
+                f.write(' '.join(map(repr, row)) + '\n')
+
+
+def expected(xs, t):
+    values = np.array(tables[xs][0][1:])
+    if xs in ['REMXS', 'FISS', 'NSF', 'SP0']:
+        return values * ratios[t]
+    if xs == 'DIFFCOEF':
+        return values / ratios[t]
+    return values
+
+
+def test_density_scaling():
+    assert np.allclose(density([900, 950, 1000]), [2000, 1980, 1960])
+    data = apply_feedback('DIFFCOEF', [[1., 2.]], [950, 1000])
+    assert data.shape == (2, 1, 2)
+    assert np.allclose(data[:, 0], [[1 / 0.99, 2 / 0.99],
+                                    [1 / 0.98, 2 / 0.98]])
+    assert np.allclose(apply_feedback('SP0', [1., 2.], [1000]),
+                       [[0.98, 1.96]])
+    assert np.array_equal(apply_feedback('CHIT', [1., 2.], [1000]),
+                          [[1., 2.]])
+
+
+def test_extrapolate():
+    """Txt tables are rewritten with the 900 K row followed by the scaled
+    rows, and the CLI only touches the tables asked for
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        write_tables(directory)
+        root = os.path.join(directory, 'x_')
+        for xs in ['REMXS', 'DIFFCOEF']:
+            extrapolate(xs, [950, 1000], root)
+            data = np.loadtxt(root + xs + '.txt')
+            assert np.array_equal(data[0], tables[xs][0])
+            assert np.array_equal(data[1:, 0], [950, 1000])
+            for row in data[1:]:
+                assert np.allclose(row[1:], expected(xs, row[0]), rtol=1e-5)
+
+        write_tables(directory)
+        script = os.path.join(benchmark_dir, 'feedback.py')
+        subprocess.run([sys.executable, script, '--root', 'x_', '--temps',
+                        '950', '1000'], cwd=directory, check=True)
+        # CHIT is not one of the default tables
+        with open(root + 'CHIT.txt') as f:
+            assert f.read().startswith('# 900 K data')
+        for xs in default_xs:
+            data = np.loadtxt(root + xs + '.txt')
+            assert np.allclose(data[2, 1:], expected(xs, 1000), rtol=1e-5)
+        subprocess.run([sys.executable, script, '--root', 'x_', '--all',
+                        '--temps', '950', '1000'], cwd=directory, check=True)
+        data = np.loadtxt(root + 'CHIT.txt')
+        assert np.array_equal(data[:, 1:], [[0.25, 0.75]] * 3)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_extrapolate_json():
+    directory = tempfile.mkdtemp()
+    try:
+        library = {'fuel': {'temp': [900], '900': {
+            'REMXS': [1., 2.], 'DIFFCOEF': [1.5, 0.5], 'CHI_T': [0.25, 0.75]}},
+            'moder': {'temp': [900], '900': {'REMXS': [3.]}}}
+        json_file = os.path.join(directory, 'lib.json')
+        out_file = os.path.join(directory, 'out.json')
+        with open(json_file, 'w') as f:
+            json.dump(library, f)
+        extrapolate_json(json_file, out_file, [950, 1000], ['fuel'])
+        with open(out_file) as f:
+            out = json.load(f)
+        assert out['moder'] == library['moder']
+        assert out['fuel']['temp'] == [900, 950, 1000]
+        for t in [950, 1000]:
+            data = out['fuel'][str(t)]
+            assert np.allclose(data['REMXS'], np.array([1., 2.]) * ratios[t])
+            assert np.allclose(data['DIFFCOEF'],
+                               np.array([1.5, 0.5]) / ratios[t])
+            assert data['CHI_T'] == [0.25, 0.75]
+    finally:
+        shutil.rmtree(directory)
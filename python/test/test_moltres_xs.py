@@ -1,11 +1,12 @@
 import json
 import argparse
 import numpy as np
-from pyne import serpent
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from moltres_xs import *
+from xs_profile import stage_profiler, profiling
+from helpers import in_directory, test_dir
 
 
 def test_serpent_xs():
@@ -14,7 +15,7 @@ def test_serpent_xs():
     """
 
     # Run moltres_xs with Serpent 2 data
-    read_input('msfr_xs.inp')
+    read_input('msfr_xs.inp', use_cache=False)
 
     # Load the output json xs file
     with open('msfrXS.json') as f:
@@ -40,7 +41,7 @@ def test_scale_xs():
     """
 
     # Run moltres_xs with SCALE data
-    read_input('pin_cell_XS.inp')
+    read_input('pin_cell_XS.inp', use_cache=False)
 
     # Load the output json xs file
     with open('PinXS.json') as f:
@@ -58,3 +59,264 @@ def test_scale_xs():
         os.remove('PinXS.json')
     else:
         print('Attempted to delete JSON output file but it does not exist')
+
+
+def test_serpent_res():
+    """Testing that serpent_res only reads the requested variables and
+    keeps both values and relative errors
+    """
+    with serpent_res('MSFR_base_res.m', ['GC_UNIVERSE_NAME', 'LAMBDA']) as res:
+        assert 'INF_REMXS' not in res
+        assert list(res['GC_UNIVERSE_NAME']) == ['1', '3'] * 4
+        assert res['LAMBDA'].shape == (8, 18)
+        assert res['LAMBDA'][0, 2] == 1.24667E-02
+        assert res['LAMBDA'][0, 1] == 0.00452
+
+
+def test_serpent_burnups():
+    """The number of burnups comes from the distinct values of the first
+    BURNUP column across the idx blocks, which are ordered by branch, then
+    burnup, then universe
+    """
+    with open(os.path.join(test_dir, 'MSFR_base_res.m')) as f:
+        text = f.read()
+    blocks = text.split('GC_UNIVERSE_NAME')
+    # Blocks 0, 1, 4 and 5 are at 0 MWd/kg, blocks 2, 3, 6 and 7 at 5
+    text = blocks[0] + ''.join(
+        'BURNUP (idx, [1: 2]) = [ {0:.5E} {1:.5E} ];\nGC_UNIVERSE_NAME'
+        .format(5. * (i // 2 % 2), 50. * (i // 2 % 2)) + block
+        for i, block in enumerate(blocks[1:]))
+    with in_directory():
+        with open('burnup_res.m', 'w') as f:
+            f.write(text)
+        lib = serpent_xs('burnup_res.m').xs_lib
+        with serpent_res('burnup_res.m', ['INF_REMXS']) as res:
+            remxs = res['INF_REMXS'][:, 0::2]
+    assert lib['REMXS'].shape[:3] == (2, 2, 2)
+    for b in range(2):
+        for u in range(2):
+            for t in range(2):
+                assert np.array_equal(lib[b][u][t]['REMXS'],
+                                      remxs[4 * t + 2 * b + u])
+
+
+def test_xs_cache():
+    """Testing that a second run of moltres_xs.py loads the parsed SCALE
+    file from the cache and still matches the gold JSON file
+    """
+    with in_directory(['pin_cell_XS.inp', 'pin.t16']):
+        cache_dir = 'xs_cache_test'
+        for i in range(2):
+            read_input('pin_cell_XS.inp', cache_dir=cache_dir)
+            with open('PinXS.json') as f:
+                data = json.load(f)
+            with open(os.path.join(test_dir, 'gold', 'PinXS.json')) as h:
+                expected = json.load(h)
+            assert data == expected
+            assert len(xs_cache(cache_dir).entries()) == 1
+
+        # A cache too small for any entry evicts everything
+        read_input('pin_cell_XS.inp', cache_dir=cache_dir, clear_cache=True,
+                   max_cache_size=0)
+        assert xs_cache(cache_dir).entries() == []
+
+        # A failed write leaves no temporary file behind
+        class unpicklable:
+            def __reduce__(self):
+                raise RuntimeError('cannot pickle')
+        cache = xs_cache(cache_dir)
+        try:
+            cache.store('bad', {'a': np.array([unpicklable()])})
+        except RuntimeError:
+            pass
+        else:
+            assert False
+        assert os.listdir(cache_dir) == []
+
+
+def test_cache_selection():
+    """A [BRANCH] section within the entries cached for a file is served
+    from the cache, and one reaching outside them widens the cached entry
+    """
+    deck = parse_deck(os.path.join(test_dir, 'pin_cell_XS.inp'), test_dir)
+    expected = build_library(deck, use_cache=False)
+    cache_dir = 'xs_cache_test'
+
+    def parses(keys):
+        narrowed = dict(deck, branches=[b for b in deck['branches']
+                                        if b[0] in keys])
+        narrowed['materials'] = dict(
+            (mat, [t for t in temps if '{}/{}'.format(mat, t) in keys])
+            for mat, temps in deck['materials'].items())
+        profiler = stage_profiler(trace_memory=False)
+        with profiling(profiler):
+            lib = build_library(narrowed, cache_dir=cache_dir, workers=1)
+        for key in keys:
+            mat, t = key.split('/')
+            for xs, values in lib[mat][t].items():
+                assert np.array_equal(values, expected[mat][t][xs])
+        return [r['stage'] for r in profiler.records].count('load/parse')
+
+    with in_directory():
+        assert parses(['F/600']) == 1
+        assert parses(['F/600', 'F/900', 'C/600', 'W/600']) == 1
+        assert parses(['F/600']) == 0
+        assert parses(['C/600', 'F/900']) == 0
+        assert len(os.listdir(cache_dir)) == 1
+
+
+def test_parallel_files():
+    """Testing moltres_xs.py with a SCALE and a Serpent 2 file read by
+    separate processes, compared with both gold JSON files
+    """
+    deck = ['[TITLE]\n', '  BothXS.json\n',
+            '[MAT]\n', '  2\n', '  F fuel\n',
+            '[BRANCH]\n', '  3\n',
+            '  F     600 1 1 1 1\n', '  F     900 1 1 1 2\n',
+            '  fuel 1200 2 1 1 2\n',
+            '[FILES]\n', '  2\n',
+            '  pin.t16 scale\n', '  MSFR_base_res.m serpent\n']
+    with in_directory(['pin.t16', 'MSFR_base_res.m']):
+        with open('both_xs.inp', 'w') as f:
+            f.writelines(deck)
+        read_input('both_xs.inp', use_cache=False, workers=2)
+        with open('BothXS.json') as f:
+            data = json.load(f)
+        with open(os.path.join(test_dir, 'gold', 'PinXS.json')) as h:
+            assert data['F'] == json.load(h)['F']
+        with open(os.path.join(test_dir, 'gold', 'msfrXS.json')) as h:
+            assert data['fuel']['1200'] == json.load(h)['fuel']['1200']
+
+        # A failing file is reported by name
+        deck[-1] = '  missing_res.m serpent\n'
+        with open('both_xs.inp', 'w') as f:
+            f.writelines(deck)
+        try:
+            read_input('both_xs.inp', use_cache=False, workers=2)
+        except Exception as err:
+            assert 'missing_res.m' in str(err)
+        else:
+            assert False
+
+
+def test_select():
+    """Testing that the readers only build the selected burnups, universes
+    and branches, with the same values as a full read
+    """
+    for reader, xs_file, select in [
+            (scale_xs, 'pin.t16', ([1], [0, 2], [1])),
+            (serpent_xs, 'MSFR_base_res.m', ([0], [1], [2, 3]))]:
+        full = reader(xs_file).xs_lib
+        part = reader(xs_file, select).xs_lib
+        assert part['REMXS'].shape[:3] == tuple(len(s) for s in select)
+        assert list(part) == select[0]
+        assert list(part[select[0][0]]) == select[1]
+        for m in select[0]:
+            for n in select[1]:
+                for p in select[2]:
+                    for xs in xs_library.XS_entries:
+                        assert np.array_equal(part[m][n][p][xs],
+                                              full[m][n][p][xs])
+        try:
+            part[0][0][0]
+        except KeyError:
+            pass
+        else:
+            assert False
+
+
+def test_non_finite_json():
+    """Groups without flux give NaN cross sections, which are written as
+    json.dumps writes them and read back
+    """
+    with in_directory():
+        with open(os.path.join(test_dir, 'MSFR_base_res.m')) as f:
+            text = f.read()
+        with open('MSFR_base_res.m', 'w') as f:
+            f.write(text.replace('[  2.33658E+00 9.2E-05', '[  NaN 9.2E-05'))
+        lib = build_library(parse_deck(os.path.join(test_dir, 'msfr_xs.inp'),
+                                       '.'), use_cache=False)
+        lib['fuel']['1200']['REMXS'][1] = np.inf
+        lib['fuel']['1200']['REMXS'][2] = -np.inf
+        nans = 0
+        for compact, digits in [(False, None), (True, None), (True, 4)]:
+            write_library(lib, 'out.json', compact, digits)
+            with open('out.json') as f:
+                text = f.read()
+            assert 'nan' not in text and 'inf' not in text
+            read = load_library('out.json')
+            for mat in lib:
+                for t in lib[mat]['temp']:
+                    for xs, values in lib[mat][str(t)].items():
+                        assert np.allclose(read[mat][str(t)][xs], values,
+                                           rtol=1e-3, atol=0, equal_nan=True)
+                        nans += np.isnan(values).sum()
+        assert nans > 0
+
+
+def test_output_formats():
+    """Testing the compact JSON writer and the binary exports of
+    moltres_xs.py against the gold JSON file
+    """
+    gold = os.path.join(test_dir, 'gold', 'msfrXS.json')
+    with in_directory(['msfr_xs.inp', 'MSFR_base_res.m']):
+        read_input('msfr_xs.inp', use_cache=False, compact=True, binary='npz')
+        with open('msfrXS.json') as f:
+            assert '\n' not in f.read()
+        with open('msfrXS.json') as f:
+            data = json.load(f)
+        with open(gold) as h:
+            expected = json.load(h)
+        assert data == expected
+
+        for filename in ['msfrXS.npz', 'msfrXS.h5', gold]:
+            if filename == 'msfrXS.h5':
+                save_library(load_library('msfrXS.npz'), filename)
+            lib = load_library(filename)
+            assert sorted(lib) == sorted(expected)
+            for mat in expected:
+                assert lib[mat]['temp'] == expected[mat]['temp']
+                for t in expected[mat]['temp']:
+                    for xs, values in expected[mat][str(t)].items():
+                        assert lib[mat][str(t)][xs].tolist() == values
+
+        # Rounded output stays within the requested precision
+        read_input('msfr_xs.inp', use_cache=False, compact=True, digits=4)
+        with open('msfrXS.json') as f:
+            data = json.load(f)
+        for mat in expected:
+            for t in expected[mat]['temp']:
+                for xs, values in expected[mat][str(t)].items():
+                    assert np.allclose(data[mat][str(t)][xs], values,
+                                       rtol=1e-3, atol=0)
+
+
+def test_in_memory_library():
+    """Building the library of a deck from any directory, without writing
+    it, and passing it on to the downstream tools
+    """
+    with in_directory():
+        deck = parse_deck(os.path.join(test_dir, 'msfr_xs.inp'), test_dir)
+        assert deck['title'] == 'msfrXS.json'
+        lib = build_library(deck, use_cache=False)
+        assert not os.path.exists(os.path.join(test_dir, 'msfrXS.json'))
+        expected = load_library(os.path.join(test_dir, 'gold', 'msfrXS.json'))
+        assert sorted(lib) == sorted(expected)
+        for mat in expected:
+            assert lib[mat]['temp'] == expected[mat]['temp']
+            for t in expected[mat]['temp']:
+                for xs, values in expected[mat][str(t)].items():
+                    assert np.array_equal(lib[mat][str(t)][xs], values)
+
+        # Entries given as previous are not read again
+        mat = sorted(lib)[0]
+        t = str(lib[mat]['temp'][0])
+        previous = {mat: {t: dict((xs, np.zeros(1)) for xs in lib[mat][t])}}
+        partial = build_library(deck, use_cache=False, previous=previous)
+        assert all(values.tolist() == [0]
+                   for values in partial[mat][t].values())
+
+        from xs_interp import xs_interpolator
+        xs_interpolator(lib[mat])
+        from convert_xs_tables import json_to_txt
+        assert json_to_txt(lib, 'in_memory_tables')
@@ -0,0 +1,164 @@
+import os
+import sys
+import netCDF4
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nemesis_reader import *
+from exodus_sampler import sample_line
+from exodus_history import time_history
+from helpers import in_directory, test_dir
+
+gold = os.path.join(test_dir, '..', '..', 'tests', '{}', 'gold', '{}.e')
+
+
+def split(filename, base, num_ranks):
+    """Writes the pieces base.N.r of filename, partitioned along x, with
+    the local nodes of each piece numbered backwards"""
+    with exodus_file(filename) as exodus:
+        variables = exodus.dataset.variables
+        coords = exodus.coords
+        offsets = np.cumsum([0] + [len(c) for t, c in exodus.blocks])
+        centers = np.concatenate([coords[c].mean(axis=1)[:, 0]
+                                  for t, c in exodus.blocks])
+        rank_of = np.minimum((num_ranks * (centers - centers.min()) /
+                              np.ptp(centers)).astype(int), num_ranks - 1)
+        for rank in range(num_ranks):
+            piece = netCDF4.Dataset('{}.{}.{}'.format(base, num_ranks, rank),
+                                    'w')
+            blocks = [np.flatnonzero(rank_of[start:stop] == rank)
+                      for start, stop in zip(offsets[:-1], offsets[1:])]
+            nodes = np.unique(np.concatenate(
+                [c[e].ravel() for (t, c), e in zip(exodus.blocks, blocks)]))
+            nodes = nodes[::-1]
+            local = np.full(len(coords), -1)
+            local[nodes] = np.arange(len(nodes))
+            piece.createDimension('num_dim', exodus.dim)
+            piece.createDimension('num_nodes', len(nodes))
+            piece.createDimension('num_el_blk', len(blocks))
+            piece.createDimension('time_step', None)
+            for name in ['len_name', 'num_nod_var', 'num_elem_var',
+                         'num_glo_var']:
+                if name in exodus.dataset.dimensions:
+                    piece.createDimension(
+                        name, exodus.dataset.dimensions[name].size)
+            for name in ['time_whole', 'eb_prop1', 'eb_names',
+                         'name_nod_var', 'name_elem_var', 'name_glo_var',
+                         'vals_glo_var']:
+                if name in variables:
+                    var = variables[name]
+                    piece.createVariable(name, var.dtype, var.dimensions)[:] \
+                        = var[:]
+            piece.createVariable('coord', 'f8', ('num_dim', 'num_nodes'))[:] \
+                = coords[nodes].T
+            piece.createVariable('node_num_map', 'i4', ('num_nodes',))[:] \
+                = nodes + 1
+            elem_map = []
+            for b, ((elem_type, connect), elems) in enumerate(
+                    zip(exodus.blocks, blocks)):
+                piece.createDimension('num_el_in_blk{}'.format(b + 1),
+                                      len(elems))
+                piece.createDimension('num_nod_per_el{}'.format(b + 1),
+                                      connect.shape[1])
+                var = piece.createVariable(
+                    'connect{}'.format(b + 1), 'i4',
+                    ('num_el_in_blk{}'.format(b + 1),
+                     'num_nod_per_el{}'.format(b + 1)))
+                var.elem_type = elem_type
+                var[:] = local[connect[elems]] + 1
+                elem_map.append(offsets[b] + elems)
+                for j in range(len(exodus.elemental_names)):
+                    name = 'vals_elem_var{}eb{}'.format(j + 1, b + 1)
+                    if name in variables:
+                        piece.createVariable(
+                            name, 'f8', ('time_step',
+                                         'num_el_in_blk{}'.format(b + 1)))[:] \
+                            = variables[name][:][:, elems]
+            piece.createDimension('num_elem', sum(len(e) for e in blocks))
+            piece.createVariable('elem_num_map', 'i4', ('num_elem',))[:] \
+                = np.concatenate(elem_map) + 1
+            for j in range(len(exodus.nodal_names)):
+                name = 'vals_nod_var{}'.format(j + 1)
+                piece.createVariable(
+                    name, 'f8', ('time_step', 'num_nodes'))[:] \
+                    = variables[name][:][:, nodes]
+            piece.close()
+
+
+def test_join():
+    """Joining the pieces gives back the arrays of the file they were split
+    from
+    """
+    filename = gold.format('twod_axi_coupled', 'auto_diff_rho')
+    with in_directory():
+        split(filename, 'nemesis_test.e', 3)
+        assert len(piece_files('nemesis_test.e')) == 3
+        for workers in [1, 2]:
+            with exodus_file(filename) as exodus, \
+                    nemesis_file('nemesis_test.e', workers=workers) as joined:
+                assert np.array_equal(joined.coords, exodus.coords)
+                for (t1, c1), (t2, c2) in zip(joined.blocks, exodus.blocks):
+                    assert t1 == t2
+                    assert np.array_equal(c1, c2)
+                assert joined.nodal_names == exodus.nodal_names
+                for name in exodus.nodal_names:
+                    assert np.array_equal(joined.nodal(name),
+                                          exodus.nodal(name))
+                for name in exodus.elemental_names:
+                    for v1, v2 in zip(joined.elemental(name),
+                                      exodus.elemental(name)):
+                        assert np.array_equal(v1, v2)
+                assert joined.global_values['multiplication'][0] == 1
+                points = exodus.coords[::11] * .999
+                assert np.array_equal(joined.sample(['temp'], points)['temp'],
+                                      exodus.sample(['temp'], points)['temp'])
+
+
+def test_selection():
+    """Only the requested variables and steps are read"""
+    filename = gold.format('pre', 'pre_out')
+    with in_directory():
+        split(filename, 'nemesis_test.e', 2)
+        joined = open_output('nemesis_test.e', ['pre2'], [-1], workers=1)
+        assert joined.elemental_names == ['pre2']
+        assert joined.steps == [1]
+        with exodus_file(filename) as exodus:
+            assert np.array_equal(joined.elemental('pre2', 1)[0],
+                                  exodus.elemental('pre2', 1)[0])
+        try:
+            joined.elemental('pre2', 0)
+            assert False
+        except Exception as e:
+            assert 'was not read' in str(e)
+        os.remove('nemesis_test.e.2.1')
+        try:
+            piece_files('nemesis_test.e')
+            assert False
+        except Exception as e:
+            assert 'not ranks' in str(e)
+
+
+def test_time_history():
+    """Time histories and line samples of the pieces of a split output
+    are those of the file they were split from
+    """
+    for case, names in [(('twod_axi_coupled', 'auto_diff_rho'), None),
+                        (('pre', 'pre_out'), ['pre1', 'pre2'])]:
+        filename = gold.format(*case)
+        expected = time_history(filename, names)
+        with in_directory():
+            split(filename, 'nemesis_test.e', 3)
+            for workers in [1, 2]:
+                history = time_history('nemesis_test.e', names,
+                                       workers=workers)
+                assert list(history) == list(expected)
+                for key in expected:
+                    assert np.allclose(history[key], expected[key]), key
+
+    filename = gold.format('twod_axi_coupled', 'auto_diff_rho')
+    with in_directory():
+        split(filename, 'nemesis_test.e', 2)
+        distance, values = sample_line('nemesis_test.e', ['temp'], [0, 0],
+                                       [50, 50], 20, workers=1)
+        assert np.array_equal(values['temp'], sample_line(
+            filename, ['temp'], [0, 0], [50, 50], 20)[1]['temp'])
+        assert np.isfinite(values['temp']).any()
@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from process_serpent_data_build_least_squares_fits import *
+from helpers import in_directory, test_dir
+
+
+def test_fit_tables():
+    """Fits the two group Th/U fuel tables and checks the fits against
+    per column polynomial fits
+    """
+    base = os.path.join(test_dir, '..', '..', 'property_file_dir',
+                        'msr2g_Th_U_two_mat_homogenization_'
+                        'fuel_data_func_of_fuel_temp')
+    temperature, tables = read_tables(base, ['REMXS', 'GTRANSFXS',
+                                             'BETA_EFF'])
+    assert tables['GTRANSFXS'].shape == (25, 4)
+    assert tables['BETA_EFF'].shape == (25, 8)
+
+    for degree in [1, 3]:
+        coefs, residuals = fit_tables(temperature, tables, degree)
+        for xsec, table in tables.items():
+            assert coefs[xsec].shape == (table.shape[1], degree + 1)
+            for k in range(table.shape[1]):
+                fit = np.polyval(coefs[xsec][k], temperature)
+                assert np.allclose(fit, np.polyval(np.polyfit(
+                    temperature, table[:, k], degree), temperature),
+                    rtol=1e-8, atol=1e-14)
+                assert np.allclose(residuals[xsec][:, k], table[:, k] - fit)
+
+    coefs, residuals = fit_tables(temperature, tables, 2, log_temp=922.)
+    x = np.log(temperature / 922.)
+    assert np.allclose(np.polyval(coefs['REMXS'][1], x),
+                       tables['REMXS'][:, 1] - residuals['REMXS'][:, 1])
+    assert len(residual_report(tables, residuals)) == 4
+
+    with in_directory():
+        write_coefficients('write_test', coefs)
+        assert np.allclose(np.loadtxt('write_test'), np.vstack(
+            [coefs[xsec] for xsec in tables]))
@@ -0,0 +1,33 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from slice_render import *
+from helpers import in_directory, test_dir
+
+
+def test_color_limits():
+    images = {'a': np.array([[1., np.nan], [3., 2.]]),
+              'b': np.array([[-1., 5.], [np.inf, 0.]])}
+    limits = color_limits(images, {'b': (None, 4.)})
+    assert limits == {'a': (1., 3.), 'b': (-1., 4.)}
+
+
+def test_render_slices():
+    """Renders three fields of a gold file in two processes"""
+    points, shape, extent = slice_points([0, 0, 0], [2, 1, 4], 'x', 1.5, 8)
+    assert shape == (8, 2)
+    assert extent == [0, 1, 0, 4]
+    assert np.all(points[:, 0] == 1.5)
+
+    filename = os.path.join(test_dir, '..', '..', 'tests', 'twod_axi_coupled',
+                            'gold', 'auto_diff_rho.e')
+    with in_directory():
+        files = render_slices(filename, ['group1', 'temp', 'pre1'],
+                              'slice_{name}.png', resolution=60,
+                              zlim={'temp': (922, None)},
+                              scale={'pre1': 1e13}, workers=2)
+        assert files == ['slice_group1.png', 'slice_temp.png',
+                         'slice_pre1.png']
+        for f in files:
+            assert os.path.getsize(f) > 0
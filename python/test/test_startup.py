@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from moltres_xs import *
+
+# Modules the CLIs must not import at startup, because they are slow to
+# import and only some commands need them
+heavy = ['serpentTools', 'pyne', 'yt', 'netCDF4', 'matplotlib', 'h5py',
+         'scipy', 'pandas']
+# Setting MOLTRES_STARTUP_BUDGET to a number of seconds also checks the time
+# taken to import each CLI module on top of numpy, which they all need. The
+# measured times are around 0.05 s, but wall clock bounds are not reliable
+# on loaded machines, so this benchmark is opt-in.
+budget = os.environ.get('MOLTRES_STARTUP_BUDGET')
+check = """
+import sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+readers = getattr({module}, 'xs_readers', {{}})
+print(' '.join(reader.split(':')[0] for reader in readers.values()
+               if isinstance(reader, str)))
+print(' '.join(name.split('.')[0] for name in sys.modules))
+"""
+
+
+def test_startup_imports():
+    """The CLIs leave heavy and lazily registered backends unimported, and
+    import within the budget if one is set
+    """
+    for module in ['moltres_xs', 'extractSerpent2GCs']:
+        times = []
+        for i in range(1 if budget is None else 3):
+            out = subprocess.run(
+                [sys.executable, '-c', check.format(module=module)],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(
+                    __file__))),
+                stdout=subprocess.PIPE, universal_newlines=True, check=True)
+            elapsed, lazy, loaded = out.stdout.split('\n')[:3]
+            times.append(float(elapsed))
+            loaded = set(loaded.split())
+            assert not loaded & set(heavy + lazy.split()), module
+        if budget is not None:
+            assert min(times) < float(budget), (module, times)
+
+
+def test_reader_registry():
+    assert get_reader('scale') is scale_xs
+    assert get_reader('serpent2') is serpent_xs
+    register_reader('test', 'moltres_xs:scale_xs')
+    try:
+        assert isinstance(xs_readers['test'], str)
+        assert get_reader('test').__name__ == 'scale_xs'
+        assert not isinstance(xs_readers['test'], str)
+    finally:
+        del xs_readers['test']
+    try:
+        get_reader('mcnp')
+        assert False
+    except Exception as e:
+        assert 'scale or serpent' in str(e)
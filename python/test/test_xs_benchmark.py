@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from xs_benchmark import *
+from helpers import in_directory
+
+
+def test_synthetic_files():
+    """The parsers read back the cross sections the synthetic files were
+    written from, for every reader
+    """
+    case = make_case(5, num_precursors=8, num_uni=4, num_burn=3,
+                     num_branch=2)
+    with in_directory() as directory:
+        write_inputs(case, directory)
+        for lib in [scale_xs(os.path.join(directory, 'case.t16')).xs_lib,
+                    serpent_xs(os.path.join(directory, 'case_res.m')).xs_lib]:
+            for entry in lib.XS_entries:
+                assert np.allclose(lib[entry], case[entry], rtol=1e-7,
+                                   atol=0), entry
+
+        target_call('makePropertiesDir')()
+        for name, entry in [('REMXS', 'REMXS'), ('SP0', 'GTRANSFXS'),
+                            ('BETA_EFF', 'BETA_EFF')]:
+            data = np.loadtxt(os.path.join(directory, 'xs',
+                                           'case_u002_' + name + '.txt'))
+            assert np.array_equal(data[:, 0], [600, 700])
+            assert np.allclose(data[:, 1:], case[entry][0, 1].reshape(2, -1),
+                               rtol=1e-7)
+
+
+def test_run_and_compare():
+    results = run_benchmarks(case_grid([2], [6], [2], [1], [2]),
+                             ['scale_xs', 'read_input'], repeat=1)
+    assert sorted(results['results']) == ['read_input/g2_p6_u2_b1_r2',
+                                          'scale_xs/g2_p6_u2_b1_r2']
+    lines, regressions = compare(results, results)
+    assert regressions == []
+
+    # A baseline twice as fast, on a machine twice as fast, is no slower
+    baseline = {'calibration': results['calibration'] / 2,
+                'results': dict((key, {'time': r['time'] / 2,
+                                       'peak_memory': r['peak_memory']})
+                                for key, r in results['results'].items())}
+    assert compare(results, baseline)[1] == []
+    baseline['calibration'] = results['calibration']
+    assert compare(results, baseline, time_floor=0)[1] == \
+        sorted(results['results'])
+    for r in baseline['results'].values():
+        r['time'] *= 2
+        r['peak_memory'] //= 2
+    assert compare(results, baseline)[1] == sorted(results['results'])
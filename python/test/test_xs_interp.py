@@ -0,0 +1,71 @@
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from xs_interp import *
+
+
+def test_interp_types():
+    """Checks each interp_type on the gold MSFR fuel, which has tables at
+    900 and 1200 K
+    """
+    fuel = load_library('gold/msfrXS.json')['fuel']
+    low = fuel['900']['REMXS']
+    high = fuel['1200']['REMXS']
+    slope = (high - low) / 300
+
+    values, slopes = xs_interpolator(fuel, 'LINEAR').evaluate(
+        [800, 1000, 1300], derivative=True)
+    assert np.allclose(values['REMXS'], [low, low + 100 * slope, high])
+    assert np.allclose(slopes['REMXS'], [0 * slope, slope, 0 * slope])
+
+    values, slopes = xs_interpolator(fuel, 'NONE').evaluate(
+        np.full((2, 3), 1000.), derivative=True)
+    assert values['GTRANSFXS'].shape == (2, 3, 36)
+    assert np.allclose(values['REMXS'], low)
+    assert np.allclose(slopes['REMXS'], slope)
+
+    # With two temperatures both cubic modes reduce to a straight line
+    temps = np.linspace(900, 1200, 7)
+    exact = xs_interpolator(fuel, 'LINEAR').evaluate(temps)
+    for interp_type in ['SPLINE', 'MONOTONE_CUBIC']:
+        values = xs_interpolator(fuel, interp_type).evaluate(temps)
+        for xs in values:
+            assert np.allclose(values[xs], exact[xs], rtol=1e-12, atol=0)
+
+    fisse = fuel['900']['FISSE'] + (fuel['1200']['FISSE'] -
+                                    fuel['900']['FISSE']) / 3
+    values = xs_interpolator(fuel).evaluate(1000, joules=True)
+    assert np.allclose(values['FISSE'], fisse * mev_to_joules)
+
+
+def test_resample():
+    """Resamples a table with a kink, checks that the cubic modes go
+    through the knots, that MONOTONE_CUBIC does not overshoot, and that
+    the reported error shrinks with the spacing
+    """
+    material = {'temp': [600, 700, 800, 900, 1000]}
+    fuel = load_library('gold/msfrXS.json')['fuel']
+    for i, t in enumerate(material['temp']):
+        material[str(t)] = dict((xs, values * min(i, 2) + values)
+                                for xs, values in fuel['900'].items())
+
+    for interp_type in interp_types[1:]:
+        resampled = resample_material(material, material['temp'],
+                                      interp_type)
+        for t in material['temp']:
+            assert np.allclose(resampled[str(t)]['NSF'],
+                               material[str(t)]['NSF'])
+
+    temps = np.linspace(600, 1000, 401)
+    values = xs_interpolator(material, 'MONOTONE_CUBIC').evaluate(temps)
+    nsf = fuel['900']['NSF']
+    assert np.all(values['NSF'] <= 3 * nsf * (1 + 1e-12))
+    assert np.all(np.diff(values['NSF'], axis=0) >= -1e-15)
+    values = xs_interpolator(material, 'SPLINE').evaluate(temps)
+    assert np.any(values['NSF'] > 3 * nsf)
+
+    coarse = resample_error(material, 100, 'LINEAR')
+    fine = resample_error(material, 10, 'LINEAR')
+    assert list(temperature_grid(material, 150)) == [600, 750, 900, 1050]
+    assert 0 < fine['NSF'] < coarse['NSF']
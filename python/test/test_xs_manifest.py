@@ -0,0 +1,153 @@
+import os
+import shutil
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from xs_manifest import *
+from xs_profile import stage_profiler, profiling
+from moltres_xs import read_input
+from extractSerpent2GCs import makePropertiesDir
+from helpers import in_directory
+
+deck = ['[TITLE]\n', '  BothXS.json\n',
+        '[MAT]\n', '  2\n', '  F fuel\n',
+        '[BRANCH]\n', '  3\n',
+        '  F     600 1 1 1 1\n', '  F     900 1 1 1 2\n',
+        '  fuel 1200 2 1 1 2\n',
+        '[FILES]\n', '  2\n',
+        '  pin.t16 scale\n', '  MSFR_base_res.m serpent\n']
+
+
+def stamps(paths):
+    return dict((path, (os.stat(path).st_mtime_ns, file_hash(path)))
+                for path in paths)
+
+
+def profiled(function, *args, **kwargs):
+    profiler = stage_profiler(trace_memory=False)
+    with profiling(profiler):
+        function(*args, **kwargs)
+    return profiler.records
+
+
+def test_read_input_incremental():
+    """Only the changed XS files are read again, the others are spliced in
+    from the last JSON file, and nothing is written when nothing changed
+    """
+    with in_directory(['pin.t16', 'MSFR_base_res.m']):
+        with open('both_xs.inp', 'w') as f:
+            f.writelines(deck)
+        read_input('both_xs.inp', use_cache=False, incremental=True,
+                   binary='npz')
+        before = stamps(['BothXS.json', 'BothXS.npz'])
+        records = profiled(read_input, 'both_xs.inp', use_cache=False,
+                           incremental=True, binary='npz')
+        assert 'load' not in [r['stage'] for r in records]
+        assert stamps(['BothXS.json', 'BothXS.npz']) == before
+
+        with open('pin.t16', 'a') as f:
+            f.write('\n')
+        records = profiled(read_input, 'both_xs.inp', use_cache=False,
+                           incremental=True, binary='npz')
+        assert [r['labels']['file'] for r in records
+                if r['stage'] == 'load'] == ['pin.t16']
+        assert file_hash('BothXS.json') == before['BothXS.json'][1]
+
+        # A changed [BRANCH] line only reads the file it refers to
+        with open('both_xs.inp', 'w') as f:
+            f.writelines(deck[:9] + ['  fuel 1200 2 1 1 1\n'] + deck[10:])
+        records = profiled(read_input, 'both_xs.inp', use_cache=False,
+                           incremental=True)
+        assert [r['labels']['file'] for r in records
+                if r['stage'] == 'load'] == ['MSFR_base_res.m']
+        spliced = file_hash('BothXS.json')
+        read_input('both_xs.inp', use_cache=False)
+        assert file_hash('BothXS.json') == spliced
+
+        # An edited output is rebuilt
+        with open('BothXS.json', 'a') as f:
+            f.write(' ')
+        read_input('both_xs.inp', use_cache=False, incremental=True)
+        assert file_hash('BothXS.json') == spliced
+
+
+def test_makePropertiesDir_incremental():
+    """Only the materials whose .coe file or mapping changed are extracted
+    again, and unchanged property files are not rewritten
+    """
+    with in_directory(['MSFR_base.coe']):
+        with open('map.txt', 'w') as f:
+            f.writelines(['fuel0 900\n', 'fuel1 1200\n',
+                          'blanket0 900\n', 'blanket1 1200\n'])
+        open('sec.txt', 'w').close()
+        with open('uni.txt', 'w') as f:
+            f.writelines(['fuel 1\n', 'blanket 3\n'])
+        shutil.copyfile('MSFR_base.coe', 'fuel.coe')
+        shutil.copyfile('MSFR_base.coe', 'blanket.coe')
+        args = ('xs', 'msfr', 'map.txt', 'sec.txt', 'uni.txt', 1, True)
+
+        def extracted():
+            return [r['labels']['mat'] for r in profiled(
+                makePropertiesDir, *args) if r['stage'] == 'extract']
+
+        assert extracted() == ['fuel', 'blanket']
+        outputs = [os.path.join('xs', f) for f in os.listdir('xs')
+                   if f.endswith('.txt')]
+        before = stamps(outputs)
+        assert extracted() == []
+        assert stamps(outputs) == before
+
+        with open('blanket.coe') as f:
+            text = f.read()
+        with open('blanket.coe', 'w') as f:
+            f.write(text.replace('INF_FLX 6  1.', 'INF_FLX 6  2.'))
+        assert extracted() == ['blanket']
+        after = stamps(outputs)
+        changed = sorted(path for path in outputs
+                         if after[path] != before[path])
+        assert changed == [os.path.join('xs', 'msfr_blanket_FLX.txt')]
+
+        os.remove(os.path.join('xs', 'msfr_fuel_REMXS.txt'))
+        assert extracted() == ['fuel']
+        assert stamps(outputs)[os.path.join('xs', 'msfr_fuel_REMXS.txt')][1] \
+            == before[os.path.join('xs', 'msfr_fuel_REMXS.txt')][1]
+
+        with open('map.txt', 'w') as f:
+            f.writelines(['fuel0 900\n', 'fuel1 1300\n',
+                          'blanket0 900\n', 'blanket1 1200\n'])
+        assert extracted() == ['fuel']
+
+        # The files of a dropped material are removed, leaving what a clean
+        # run writes
+        with open('map.txt', 'w') as f:
+            f.writelines(['fuel0 900\n', 'fuel1 1300\n'])
+        with open('uni.txt', 'w') as f:
+            f.writelines(['fuel 1\n'])
+        assert extracted() == []
+        makePropertiesDir('clean', 'msfr', 'map.txt', 'sec.txt', 'uni.txt', 1)
+        assert sorted(f for f in os.listdir('xs') if f.endswith('.txt')) == \
+            sorted(os.listdir('clean'))
+        for f in os.listdir('clean'):
+            assert file_hash(os.path.join('xs', f)) == \
+                file_hash(os.path.join('clean', f))
+
+
+def test_prune_outputs():
+    """Pruning with remove_outputs deletes the outputs of dropped entries
+    and the ones an entry no longer writes, as when a secondary branch is
+    dropped, and keeps the others
+    """
+    with in_directory():
+        for name in ['a.txt', 'b.txt', 'c.txt']:
+            open(name, 'w').close()
+        manifest = xs_manifest('manifest.json')
+        manifest.record('fuel', [], {'secBranch': ['b']}, ['a.txt', 'b.txt'])
+        manifest.record('moder', [], {}, ['c.txt'])
+        manifest.prune(['fuel', 'moder'], remove_outputs=True)
+        for name in ['a.txt', 'b.txt', 'c.txt']:
+            manifest.record_output(name)
+        assert sorted(os.listdir('.')) == ['a.txt', 'b.txt', 'c.txt']
+
+        manifest.record('fuel', [], {'secBranch': []}, ['a.txt'])
+        manifest.prune(['fuel'], remove_outputs=True)
+        assert os.listdir('.') == ['a.txt']
+        assert list(manifest.outputs) == [os.path.abspath('a.txt')]
@@ -0,0 +1,88 @@
+import csv
+import json
+import os
+import pstats
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xs_profile
+from xs_profile import *
+from moltres_xs import read_input
+from helpers import in_directory
+
+
+def test_stages():
+    """Nested stages are named by their path, and a parent's peak memory
+    includes its children's
+    """
+    assert stage('idle').__class__.__name__ == 'nullcontext'
+    profiler = stage_profiler()
+    with profiling(profiler):
+        with stage('outer', file='a'):
+            with stage('inner'):
+                data = [0.] * 10**6
+            del data
+            with stage('small'):
+                pass
+    assert xs_profile.active is None
+    records = dict((r['stage'], r) for r in profiler.records)
+    assert [r['stage'] for r in profiler.records] == \
+        ['outer/inner', 'outer/small', 'outer']
+    assert records['outer']['labels'] == {'file': 'a'}
+    assert records['outer/inner']['peak_memory'] > 7 * 10**6
+    assert records['outer/small']['peak_memory'] < 10**5
+    assert records['outer']['peak_memory'] >= \
+        records['outer/inner']['peak_memory']
+    assert records['outer']['wall_time'] >= records['outer/inner']['wall_time']
+
+    profiler = stage_profiler(trace_memory=False)
+    with profiling(profiler):
+        with stage('outer'):
+            pass
+    assert profiler.records[0]['peak_memory'] is None
+
+
+def test_read_input_profile():
+    """Profiling moltres_xs.py on the SCALE pin cell, in this process and
+    in worker processes, writing the JSON and CSV reports and cProfile stats
+    """
+    with in_directory(['pin_cell_XS.inp', 'pin.t16', 'MSFR_base_res.m']):
+        profiler = stage_profiler()
+        with profiling(profiler, 'profile.prof'):
+            read_input('pin_cell_XS.inp', use_cache=False)
+        stages = [r['stage'] for r in profiler.records]
+        for name in ['read_deck', 'load/parse', 'load/fix_xs', 'load',
+                     'assemble', 'serialize', 'write']:
+            assert name in stages, name
+        load = profiler.records[stages.index('load')]
+        assert load['labels'] == {'file': 'pin.t16'}
+        assert pstats.Stats('profile.prof').total_calls > 0
+
+        profiler.write('profile.json')
+        with open('profile.json') as f:
+            assert json.load(f) == profiler.records
+        profiler.write('profile.csv')
+        with open('profile.csv') as f:
+            rows = list(csv.DictReader(f))
+        assert [row['stage'] for row in rows] == stages
+        assert rows[stages.index('load')]['file'] == 'pin.t16'
+        assert len(profiler.summary()) == len(stages) + 1
+
+        # Two files read by worker processes
+        deck = ['[TITLE]\n', '  BothXS.json\n',
+                '[MAT]\n', '  2\n', '  F fuel\n',
+                '[BRANCH]\n', '  3\n',
+                '  F     600 1 1 1 1\n', '  F     900 1 1 1 2\n',
+                '  fuel 1200 2 1 1 2\n',
+                '[FILES]\n', '  2\n',
+                '  pin.t16 scale\n', '  MSFR_base_res.m serpent\n']
+        with open('both_xs.inp', 'w') as f:
+            f.writelines(deck)
+        profiler = stage_profiler()
+        with profiling(profiler):
+            read_input('both_xs.inp', use_cache=False, workers=2)
+        loads = [r for r in profiler.records if r['stage'] == 'load']
+        assert sorted(r['labels']['file'] for r in loads) == \
+            ['MSFR_base_res.m', 'pin.t16']
+        assert all(r['labels']['pid'] != os.getpid() for r in loads)
+        assert 'load/scan' in [r['stage'] for r in profiler.records]
+
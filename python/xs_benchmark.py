@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# This script benchmarks the XS processing tools on synthetic SCALE t16,
+# Serpent 2 _res.m and Serpent 2 .coe files of any size. A case fixes the
+# number of energy groups, delayed neutron precursor groups, universes,
+# burnups and branches; the files of a case are written from one set of
+# random but physically shaped cross sections, so the parsers can also be
+# checked against the values the files were written from.
+#
+# Each tool is warmed up, run once under tracemalloc for its peak memory,
+# then timed (best of a few runs). Results are compared to stored
+# baselines, with times scaled by a calibration loop run on both machines,
+# and the run fails when a result regresses beyond the tolerances.
+#
+# usage:
+#   xs_benchmark.py run [--preset quick] [--baseline FILE] [--save FILE]
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from moltres_xs import scale_xs, serpent_xs, read_input
+from extractSerpent2GCs import makePropertiesDir
+
+presets = {
+    'quick': {'groups': [2, 16, 64], 'precursors': [6], 'universes': [3],
+              'burnups': [2], 'branches': [3]},
+    'groups': {'groups': [2, 8, 44, 128, 252], 'precursors': [6],
+               'universes': [3], 'burnups': [2], 'branches': [3]},
+    'layout': {'groups': [8], 'precursors': [6, 8], 'universes': [3, 12],
+               'burnups': [1, 6], 'branches': [3, 12]},
+}
+targets = ['scale_xs', 'serpent_xs', 'read_input', 'makePropertiesDir']
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'xs_benchmark_baseline.json')
+
+
+def make_case(num_groups, num_precursors=6, num_uni=3, num_burn=2,
+              num_branch=3, seed=0):
+    """
+        Random cross sections with the shape of an xs_library, positive
+        and with the usual structure: chi sums to one, scattering is mostly
+        downscatter and REMXS includes the out-scatter.
+
+        Returns
+        ----------
+        case: dict
+            Maps each entry of xs_library.XS_entries to an array with axes
+            (burnup, universe, branch, group), and 'shape' to the
+            (groups, precursors, universes, burnups, branches) of the case
+    """
+    rng = np.random.default_rng(seed)
+    axes = (num_burn, num_uni, num_branch)
+    G = num_groups
+    # Scattering falls off away from the diagonal, faster upward
+    offset = np.arange(G)[None, :] - np.arange(G)[:, None]
+    shape = np.where(offset >= 0, np.exp(-offset / 2.), np.exp(offset * 2.))
+    scatter = shape * rng.uniform(0.5, 1.5, axes + (G, G)) * 0.1
+    absorption = rng.uniform(1e-3, 2e-2, axes + (G,))
+    out_scatter = scatter.sum(axis=-1) - np.diagonal(scatter, axis1=-2,
+                                                     axis2=-1)
+    fission = rng.uniform(1e-3, 1e-2, axes + (G,))
+    chi = np.exp(-np.arange(G) / 2.) * rng.uniform(0.5, 1.5, axes + (G,))
+    chi /= chi.sum(axis=-1, keepdims=True)
+    beta = rng.uniform(1e-5, 1e-3, axes + (num_precursors,))
+    lam = np.sort(rng.uniform(1e-2, 3., (num_precursors,)))
+    case = {
+        'shape': (G, num_precursors, num_uni, num_burn, num_branch),
+        'REMXS': absorption + out_scatter,
+        'FISSXS': fission,
+        'NSF': fission * rng.uniform(2.4, 2.6, axes + (G,)),
+        'FISSE': rng.uniform(190., 200., axes + (G,)),
+        'DIFFCOEF': rng.uniform(0.5, 2.5, axes + (G,)),
+        'RECIPVEL': np.logspace(-10, -5, G) * rng.uniform(0.9, 1.1,
+                                                          axes + (G,)),
+        'CHI_T': chi,
+        'CHI_P': chi,
+        'CHI_D': chi,
+        'GTRANSFXS': scatter,
+        'BETA_EFF': beta,
+        'DECAY_CONSTANT': np.broadcast_to(lam, axes + (num_precursors,)),
+        'burnup': np.linspace(0, 10, num_burn),
+    }
+    return case
+
+
+def case_label(case):
+    return 'g{}_p{}_u{}_b{}_r{}'.format(*case['shape'])
+
+
+def format_rows(values, per_line, fmt='{: .8e}'):
+    """ Numbers written per_line to a line, like the SCALE records."""
+    values = list(values)
+    return ''.join(' ' + ' '.join(fmt.format(v) for v in
+                                  values[i:i + per_line]) + '\n'
+                   for i in range(0, len(values), per_line))
+
+
+def write_t16(filename, case):
+    """ Writes the case as a SCALE t16 file read by scale_xs."""
+    G, P, num_uni, num_burn, num_branch = case['shape']
+    remxs = case['REMXS'] - (case['GTRANSFXS'].sum(axis=-1) - np.diagonal(
+        case['GTRANSFXS'], axis1=-2, axis2=-1))
+    filler = format_rows([-1.] * 12, 6)
+    with open(filename, 'w') as f:
+        f.write("' Record 1: nblk, lblk, record sizes.\n"
+                "    13  1000  5120    14     7    68     0     0     3   "
+                "345    16     0     0\n"
+                "' Record 2: dimensioning data.\n")
+        f.write(' {:9d} {:9d} {:9d} {:9d}         1         6        12'
+                '         8         0         0\n'.format(
+                    num_burn, num_branch - 1, num_uni, G))
+        f.write('         0         6         0         1\n'
+                "' Record 3: depletion data.\n' Burnups\n")
+        f.write(format_rows(case['burnup'], 6, '{:e}'))
+        f.write("' Record 7: Energy group boundaries.\n' Energy bounds\n")
+        f.write(format_rows(np.logspace(7.3, -5, G + 1), 6, '{:e}'))
+        f.write("' Remaining records are written in sets of 4 for each "
+                "branch calculation\n")
+        for L, n in itertools.product(range(num_burn), range(num_branch)):
+            f.write("' Depletion pass no. {:4d}, branch no. {:4d}\n"
+                    "' Cross sections\n".format(L, n))
+            for m in range(num_uni):
+                pos = (L, m, n)
+                f.write("' k-eff\n    1.000000e+00\n' Betas\n")
+                f.write(format_rows(case['BETA_EFF'][pos], 6))
+                f.write("' Lambdas\n")
+                f.write(format_rows(case['DECAY_CONSTANT'][pos], 6))
+                f.write("' Yields: I,Xe,Pm\n  0.00000e+00  0.00000e+00  "
+                        "0.00000e+00\n' Identifier,Number Density,Atom "
+                        "Density\n  {:d}  1.00000e+00  1.00000e+00\n".format(
+                            500000000 + 1000000 * m))
+                for g in range(G):
+                    p = pos + (g,)
+                    f.write("'  Energy group {:4d}\n".format(g + 1))
+                    f.write("'   total        total-transfer    xe macro"
+                            "        sm macro        capture\n")
+                    f.write(format_rows([1., remxs[p], 0., 0., 1.], 5))
+                    f.write("'  fission          n-2n           transport"
+                            "     nu*fission     kappa*fission\n")
+                    f.write(format_rows([case['FISSXS'][p], 0., 1.,
+                                         case['NSF'][p],
+                                         case['FISSE'][p] *
+                                         case['FISSXS'][p]], 5))
+                    f.write("'    nu             chi           diff coeff"
+                            "        flux        elastic scat\n")
+                    f.write(format_rows([2.5, case['CHI_T'][p],
+                                         case['DIFFCOEF'][p], 1., 1.], 5))
+                    f.write("'  micro xe abs    micro sm abs   detector xsec"
+                            "   detector flux   inverse vel\n")
+                    f.write(format_rows([0., 0., -1., -1.,
+                                         case['RECIPVEL'][p]], 5))
+                    f.write("' ADFs\n" + filler + "' LineCurrents\n" + filler)
+                    f.write("' Scattering cross sections\n")
+                    f.write(format_rows(case['GTRANSFXS'][p], 6))
+
+
+def res_entry(name, values, errors=True):
+    """ One line of a _res.m file, values interleaved with relative
+    errors unless errors is False."""
+    values = np.ravel(values)
+    if errors:
+        values = np.column_stack([values, np.full(len(values), 1e-4)])
+    values = np.ravel(values)
+    return '{:<26}(idx, [1: {:3d}]) = [ {} ];\n'.format(
+        name, len(values), ' '.join('{:.8E}'.format(v) for v in values))
+
+
+def write_res(filename, case):
+    """ Writes the case as a Serpent 2 _res.m file read by serpent_xs, with
+    as many other variables as a real one."""
+    G, P, num_uni, num_burn, num_branch = case['shape']
+    entries = [(key, entry) for entry, key in serpent_xs.res_keys.items()]
+    header = ''.join('{:<26}(idx, 1)        = {} ;\n'.format(
+        'RUN_PARAMETER_{}'.format(i), i) for i in range(150))
+    with open(filename, 'w') as f:
+        for n, L, m in itertools.product(range(num_branch), range(num_burn),
+                                         range(num_uni)):
+            pos = (L, m, n)
+            f.write("\n% Increase counter:\n\nif (exist('idx', 'var'));\n"
+                    "  idx = idx + 1;\nelse;\n  idx = 1;\nend;\n\n")
+            f.write(header)
+            f.write(res_entry('BURNUP', [case['burnup'][L],
+                                         case['burnup'][L] * 30], False))
+            f.write("GC_UNIVERSE_NAME          (idx, [1: {:2d}])  = '{}' ;\n"
+                    .format(len(str(m + 1)), m + 1))
+            for key, entry in entries:
+                f.write(res_entry(key, case[entry][pos]))
+                # The B1 results take as much room as the infinite ones
+                f.write(res_entry('B1' + key[3:], case[entry][pos]))
+            beta = case['BETA_EFF'][pos]
+            f.write(res_entry('BETA_EFF', np.append(beta.sum(), beta)))
+            lam = case['DECAY_CONSTANT'][pos]
+            f.write(res_entry('LAMBDA', np.append(lam.mean(), lam)))
+
+
+coe_keys = {'INF_FLX': None, 'INF_REMXS': 'REMXS', 'INF_FISS': 'FISSXS',
+            'INF_NSF': 'NSF', 'INF_KAPPA': 'FISSE', 'INF_INVV': 'RECIPVEL',
+            'INF_DIFFCOEF': 'DIFFCOEF', 'INF_CHIT': 'CHI_T',
+            'INF_CHIP': 'CHI_P', 'INF_CHID': 'CHI_D', 'INF_SP0': 'GTRANSFXS',
+            'INF_NUBAR': None}
+
+
+def coe_materials(case):
+    """ Material names of the .coe files of a case, one per universe.
+    Branch names contain their material, and no material name is part of
+    another's."""
+    return ['u{:03d}'.format(m + 1) for m in range(case['shape'][2])]
+
+
+def write_coe(filename, case, material):
+    """ Writes the branches of material, named material + branch index, as
+    a Serpent 2 .coe file with every universe of the case."""
+    G, P, num_uni, num_burn, num_branch = case['shape']
+    blocks = num_branch * num_burn
+    with open(filename, 'w') as f:
+        for n, L in itertools.product(range(num_branch), range(num_burn)):
+            f.write('{} {} {} {} {}\n'.format(n * num_burn + L + 1, blocks,
+                                              n + 1, num_branch, num_uni))
+            f.write('1 {}{}\n'.format(material, n))
+            f.write('3 VERSION 2.1.31 DATE 20/08/03 TIME 07:51:33\n')
+            f.write('{} {} {}\n'.format(case['burnup'][L], L + 1, num_burn))
+            for m in range(num_uni):
+                pos = (L, m, n)
+                lines = []
+                for key, entry in coe_keys.items():
+                    values = np.ravel(np.ones(G) if entry is None
+                                      else case[entry][pos])
+                    for prefix in ['INF', 'B1']:
+                        lines.append('{}{} {} {}\n'.format(
+                            prefix, key[3:], len(values), ' '.join(
+                                '{:.8E}'.format(v) for v in values)))
+                beta = case['BETA_EFF'][pos]
+                lam = case['DECAY_CONSTANT'][pos]
+                for key, values in [('BETA_EFF', np.append(beta.sum(), beta)),
+                                    ('LAMBDA', np.append(lam.mean(), lam))]:
+                    lines.append('{} {} {}\n'.format(
+                        key, len(values),
+                        ' '.join('{:.8E}'.format(v) for v in values)))
+                f.write('{} {}\n'.format(m + 1, len(lines)))
+                f.write(''.join(lines))
+
+
+def branch_temperature(n):
+    return 600 + 100 * n
+
+
+def write_inputs(case, directory):
+    """
+        Writes every input of the benchmarked tools for a case into
+        directory: case.t16, case_res.m, the moltres_xs deck case.inp using
+        both of them, and the .coe and mapping files of makePropertiesDir.
+    """
+    G, P, num_uni, num_burn, num_branch = case['shape']
+    write_t16(os.path.join(directory, 'case.t16'), case)
+    write_res(os.path.join(directory, 'case_res.m'), case)
+    materials = [('scale{}'.format(m), 1, m) for m in range(num_uni)] + \
+        [('serpent{}'.format(m), 2, m) for m in range(num_uni)]
+    with open(os.path.join(directory, 'case.inp'), 'w') as f:
+        f.write('[TITLE]\n  case.json\n\n[MAT]\n  {}\n  {}\n\n'.format(
+            len(materials), ' '.join(name for name, L, m in materials)))
+        f.write('[BRANCH]\n  {}\n'.format(len(materials) * num_branch))
+        for (name, L, m), n in itertools.product(materials,
+                                                 range(num_branch)):
+            f.write('  {} {} {} 1 {} {}\n'.format(
+                name, branch_temperature(n), L, m + 1, n + 1))
+        f.write('\n[FILES]\n  2\n  case.t16 scale\n  case_res.m serpent\n')
+    names = coe_materials(case)
+    for m, material in enumerate(names):
+        write_coe(os.path.join(directory, material + '.coe'), case, material)
+    with open(os.path.join(directory, 'map.txt'), 'w') as f:
+        for material, n in itertools.product(names, range(num_branch)):
+            f.write('{}{} {}\n'.format(material, n, branch_temperature(n)))
+    with open(os.path.join(directory, 'unimap.txt'), 'w') as f:
+        for m, material in enumerate(names):
+            f.write('{} {}\n'.format(material, m + 1))
+    open(os.path.join(directory, 'sec.txt'), 'w').close()
+
+
+def target_call(target):
+    """ The function running target on the inputs of write_inputs, in the
+    directory they were written to."""
+    if target == 'scale_xs':
+        return lambda: scale_xs('case.t16')
+    if target == 'serpent_xs':
+        return lambda: serpent_xs('case_res.m')
+    if target == 'read_input':
+        return lambda: read_input('case.inp', use_cache=False, workers=1)
+    if target == 'makePropertiesDir':
+        return lambda: makePropertiesDir('xs', 'case', 'map.txt', 'sec.txt',
+                                         'unimap.txt', workers=1)
+    raise Exception('Unknown benchmark target {}, use one of {}'.format(
+        target, ', '.join(targets)))
+
+
+def measure(function, repeat=3):
+    """ Peak memory allocated during a call traced by tracemalloc, and the
+    best wall time of repeat more calls, after a first call that imports
+    and caches whatever the function needs."""
+    function()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), peak
+
+
+def calibrate(repeat=5):
+    """ Time of a fixed text parsing and array workload, the unit in which
+    times of different machines are compared."""
+    text = ' '.join('{:.8e}'.format(v) for v in np.linspace(0, 1, 100000))
+
+    def work():
+        values = np.array(text.split(), dtype=float)
+        np.outer(values[:1000], values[:1000]).sum()
+    return measure(work, repeat)[0]
+
+
+def case_grid(groups, precursors, universes, burnups, branches):
+    """ Every combination of the given case sizes."""
+    return [dict(zip(['num_groups', 'num_precursors', 'num_uni', 'num_burn',
+                      'num_branch'], sizes))
+            for sizes in itertools.product(groups, precursors, universes,
+                                           burnups, branches)]
+
+
+def run_benchmarks(cases, targets=targets, repeat=3, verbose=False):
+    """
+        Times and memory profiles each target on each case.
+
+        Parameters
+        ----------
+        cases: list of dict
+            Keyword arguments of make_case
+        targets: list of str
+            Tools to benchmark, see target_call
+        repeat: int
+            Number of timed runs, the best of which is kept
+        verbose: bool
+            Print each result as it comes
+        Returns
+        ----------
+        results: dict
+            'calibration' time of this machine, and 'results' mapping
+            'target/case label' to its 'time' in seconds and 'peak_memory'
+            in bytes
+    """
+    results = {'calibration': calibrate(), 'results': {}}
+    cwd = os.getcwd()
+    for kwargs in cases:
+        case = make_case(**kwargs)
+        directory = tempfile.mkdtemp(prefix='xs_benchmark_')
+        try:
+            write_inputs(case, directory)
+            os.chdir(directory)
+            for target in targets:
+                # The tools report their progress, which is not benchmarked
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed, peak = measure(target_call(target), repeat)
+                key = '{}/{}'.format(target, case_label(case))
+                results['results'][key] = {'time': elapsed,
+                                           'peak_memory': peak}
+                if verbose:
+                    print('{:<40} {:10.4f} s {:10.1f} MB'.format(
+                        key, elapsed, peak / 2.**20))
+                    sys.stdout.flush()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+    return results
+
+
+def save_results(results, filename):
+    """ Saves results to filename, keeping the results of other benchmarks
+    already in it, their times scaled to the new calibration."""
+    if os.path.exists(filename):
+        with open(filename) as f:
+            saved = json.load(f)
+        scale = results['calibration'] / saved['calibration']
+        for key, result in saved['results'].items():
+            result['time'] *= scale
+        saved['results'].update(results['results'])
+        results = {'calibration': results['calibration'],
+                   'results': saved['results']}
+    with open(filename, 'w') as f:
+        json.dump(results, f, sort_keys=True, indent=4)
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.25,
+            time_floor=5e-3):
+    """
+        Compares results to a baseline of the same form. Times are first
+        scaled by the ratio of the calibrations of the two machines, and
+        slowdowns shorter than time_floor seconds are timer noise rather
+        than regressions.
+
+        Returns
+        ----------
+        lines: list of str
+            Report of the speedup and memory ratio of each result found in
+            the baseline
+        regressions: list of str
+            Keys of the results slower or larger than the baseline by more
+            than the tolerances
+    """
+    scale = results['calibration'] / baseline['calibration']
+    lines = ['{:<40} {:>10} {:>10}'.format('benchmark', 'speedup',
+                                           'memory')]
+    regressions = []
+    for key, result in sorted(results['results'].items()):
+        if key not in baseline['results']:
+            lines.append('{:<40} {:>10} {:>10}'.format(key, 'new', 'new'))
+            continue
+        base = baseline['results'][key]
+        speedup = base['time'] * scale / result['time']
+        memory = result['peak_memory'] / float(max(base['peak_memory'], 1))
+        flag = ''
+        slower = speedup < 1 / (1 + time_tolerance) and \
+            result['time'] - base['time'] * scale > time_floor
+        if slower or memory > 1 + memory_tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        lines.append('{:<40} {:>9.2f}x {:>9.2f}x{}'.format(
+            key, speedup, memory, flag))
+    return lines, regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the XS tools on synthetic SCALE and Serpent \
+            files and compares the results to a baseline.')
+    parser.add_argument('command', choices=['run', 'generate'],
+                        help='run the benchmarks, or only generate the \
+                            inputs of one case into --directory')
+    parser.add_argument('--preset', choices=list(presets), default='quick',
+                        help='grid of cases')
+    for name in ['groups', 'precursors', 'universes', 'burnups',
+                 'branches']:
+        parser.add_argument('--' + name, type=int, nargs='+', default=None,
+                            help='{} of the cases, replacing those of the \
+                                preset'.format(name))
+    parser.add_argument('--targets', nargs='+', choices=targets,
+                        default=targets, help='tools to benchmark')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of each benchmark')
+    parser.add_argument('--baseline', type=str, default=baseline_file,
+                        help='baseline results to compare to')
+    parser.add_argument('--save', type=str, default=None,
+                        help='file to save the results to, e.g. the \
+                            baseline file to update it. Results of other \
+                            benchmarks in the file are kept.')
+    parser.add_argument('--time-tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help='allowed relative growth of peak memory')
+    parser.add_argument('--directory', type=str, default='.',
+                        help='where generate writes the inputs')
+    args = parser.parse_args()
+
+    sizes = dict(presets[args.preset])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+    cases = case_grid(sizes['groups'], sizes['precursors'],
+                      sizes['universes'], sizes['burnups'],
+                      sizes['branches'])
+    if args.command == 'generate':
+        if len(cases) != 1:
+            raise Exception('generate writes one case, give a single value \
+                of each size')
+        if not os.path.isdir(args.directory):
+            os.makedirs(args.directory)
+        write_inputs(make_case(**cases[0]), args.directory)
+        sys.exit(0)
+
+    results = run_benchmarks(cases, args.targets, args.repeat, verbose=True)
+    updated = args.save is not None and \
+        os.path.abspath(args.save) == os.path.abspath(args.baseline)
+    if args.save is not None:
+        save_results(results, args.save)
+    if not updated and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            lines, regressions = compare(results, json.load(f),
+                                         args.time_tolerance,
+                                         args.memory_tolerance)
+        print('\n'.join(lines))
+        if regressions:
+            print('{} benchmarks regressed'.format(len(regressions)))
+            sys.exit(1)
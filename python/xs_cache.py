@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# On-disk cache of parsed SCALE/Serpent cross section libraries, used by
+# moltres_xs.py so that unchanged XS files are not parsed again when only
+# the [BRANCH] mapping or [TITLE] of a deck change.
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+
+class xs_cache:
+    """
+        Directory of parsed libraries stored as .npz files. Entries are keyed
+        by the sha256 of the XS file contents together with the name and
+        version of the parser, so editing a file or changing a parser never
+        returns stale data. Once the directory grows past max_size bytes the
+        least recently used entries are deleted.
+
+        Parameters
+        ----------
+        cache_dir: str
+            Directory holding the .npz files. Created if missing.
+        max_size: int
+            Size limit of the cache directory in bytes
+    """
+
+    def __init__(self, cache_dir, max_size=2**30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, xs_filename, parser, version, *params):
+        """Returns the key of xs_filename read by version of parser. Any
+        extra parameters of the parser are hashed into the key as well."""
+        sha = hashlib.sha256()
+        with open(xs_filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+        sha.update(repr(params).encode())
+        return '{}-v{}-{}'.format(parser, version, sha.hexdigest())
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """Returns the arrays stored under key, or None on a miss."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        # Touching the entry keeps it at the back of the eviction queue
+        try:
+            os.utime(path)
+            with np.load(path) as data:
+                return dict(data)
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, arrays):
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            # A failed write must not leave a file that evict never sees
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    # evicted by another process sharing the cache
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            self.remove(name)
+            total -= size
+
+    def clear(self):
+        for mtime, size, name in self.entries():
+            self.remove(name)
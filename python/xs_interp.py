@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# This script evaluates the cross sections of a MoltresJsonMaterial library
+# the way Moltres does for each interp_type, for any number of temperatures
+# at once. It can also resample a library on a regular temperature grid and
+# report how much accuracy each interpolation mode loses on that grid.
+import argparse
+import numpy as np
+from moltres_xs import write_json, load_library
+
+xsec_names = ['REMXS', 'FISSXS', 'NSF', 'FISSE', 'DIFFCOEF', 'RECIPVEL',
+              'CHI_T', 'CHI_P', 'CHI_D', 'GTRANSFXS', 'BETA_EFF',
+              'DECAY_CONSTANT']
+interp_types = ['NONE', 'LINEAR', 'SPLINE', 'MONOTONE_CUBIC']
+
+# NuclearMaterial converts FISSE from MeV to Joules
+mev_to_joules = 1e6 * 1.6e-19
+
+
+class xs_interpolator:
+    """
+        Piecewise cubic form of every interpolator MoltresJsonMaterial
+        builds for one material. All cross sections and groups are stacked
+        into the columns of one table, so evaluating them at any number of
+        temperatures is a handful of numpy calls.
+
+        The modes follow the MOOSE interpolators:
+        NONE samples the LINEAR interpolator at the lowest temperature;
+        LINEAR and MONOTONE_CUBIC hold the end values outside the table,
+        with a zero derivative; SPLINE is a natural cubic spline that
+        extrapolates with its end intervals.
+
+        Parameters
+        ----------
+        material: dict
+            One material of a library, as returned by load_library
+        interp_type: str
+            One of NONE, LINEAR, SPLINE or MONOTONE_CUBIC
+    """
+
+    def __init__(self, material, interp_type='LINEAR'):
+        if interp_type not in interp_types:
+            raise Exception('Invalid interp_type {}, please select {}'.format(
+                interp_type, ', '.join(interp_types)))
+        self.interp_type = interp_type
+        temps = np.array(material['temp'], dtype=float)
+        order = np.argsort(temps)
+        self.temps = temps[order]
+        if np.any(np.diff(self.temps) == 0):
+            raise Exception('Temperatures of the material are not unique')
+
+        self.columns = {}
+        tables = []
+        start = 0
+        for xs in xsec_names:
+            rows = [material[str(t)].get(xs) for t in material['temp']]
+            if xs == 'CHI_D' and any(row is None or len(row) == 0
+                                     for row in rows):
+                # Like MoltresJsonMaterial, delayed neutrons are born in the
+                # top group when CHI_D is missing
+                width = len(material[str(material['temp'][0])]['CHI_T'])
+                rows = [np.eye(1, width)[0]] * len(rows)
+            if any(row is None for row in rows):
+                raise Exception('{} is missing from the material'.format(xs))
+            table = np.array(rows, dtype=float).reshape(len(rows), -1)
+            self.columns[xs] = slice(start, start + table.shape[1])
+            start += table.shape[1]
+            tables.append(table[order])
+        self.values = np.hstack(tables)
+        self.coefs = self.get_coefs()
+
+    def get_coefs(self):
+        """ Returns an array of shape (4, intervals, columns) holding the
+        coefficients of the cubic of each interval in powers of T - T_k."""
+        x, y = self.temps, self.values
+        coefs = np.zeros((4, max(len(x) - 1, 1), y.shape[1]))
+        coefs[0] = y[:max(len(x) - 1, 1)]
+        if len(x) == 1:
+            return coefs
+        h = np.diff(x)[:, None]
+        delta = np.diff(y, axis=0) / h
+        if self.interp_type in ['NONE', 'LINEAR']:
+            coefs[1] = delta
+        elif self.interp_type == 'SPLINE':
+            # Second derivatives of the natural spline, y'' = 0 at both ends
+            n = len(x)
+            system = np.zeros((n, n))
+            rhs = np.zeros((n, y.shape[1]))
+            system[0, 0] = system[-1, -1] = 1
+            i = np.arange(1, n - 1)
+            system[i, i - 1] = h[:-1, 0] / 6
+            system[i, i] = (h[:-1, 0] + h[1:, 0]) / 3
+            system[i, i + 1] = h[1:, 0] / 6
+            rhs[1:-1] = delta[1:] - delta[:-1]
+            y2 = np.linalg.solve(system, rhs)
+            coefs[1] = delta - h * (2 * y2[:-1] + y2[1:]) / 6
+            coefs[2] = y2[:-1] / 2
+            coefs[3] = (y2[1:] - y2[:-1]) / (6 * h)
+        else:
+            m = self.monotone_slopes(h, delta)
+            coefs[1] = m[:-1]
+            coefs[2] = (3 * delta - 2 * m[:-1] - m[1:]) / h
+            coefs[3] = (m[:-1] + m[1:] - 2 * delta) / h**2
+        return coefs
+
+    @staticmethod
+    def monotone_slopes(h, delta):
+        """ Fritsch-Carlson slopes at the knots: secant averages, zeroed at
+        local extrema, then limited so that each interval stays
+        monotone."""
+        m = np.empty((len(delta) + 1, delta.shape[1]))
+        m[0] = delta[0]
+        m[-1] = delta[-1]
+        m[1:-1] = np.where(delta[:-1] * delta[1:] > 0,
+                           (delta[:-1] + delta[1:]) / 2, 0)
+        flat = delta == 0
+        safe = np.where(flat, 1, delta)
+        for k in range(len(delta)):
+            alpha = m[k] / safe[k]
+            beta = m[k + 1] / safe[k]
+            norm = alpha**2 + beta**2
+            tau = np.where(norm > 9, 3 / np.sqrt(np.maximum(norm, 9)), 1)
+            m[k] = np.where(flat[k], 0, tau * alpha * delta[k])
+            m[k + 1] = np.where(flat[k], 0, tau * beta * delta[k])
+        return m
+
+    def evaluate(self, temperature, derivative=False, joules=False):
+        """
+            Evaluates every cross section at the given temperatures.
+
+            Parameters
+            ----------
+            temperature: array_like
+                Temperatures of any shape
+            derivative: bool
+                Also return the derivatives with respect to temperature,
+                like the d_*_d_temp material properties
+            joules: bool
+                Convert FISSE from MeV to Joules like NuclearMaterial
+            Returns
+            ----------
+            values: dict
+                Maps each XS name to an array of shape
+                temperature.shape + (width,)
+            derivatives: dict
+                Same layout, only returned if derivative is set
+        """
+        t = np.asarray(temperature, dtype=float)
+        shape = t.shape
+        t = t.ravel()
+        x = self.temps
+        if self.interp_type == 'NONE':
+            t = np.full_like(t, x[0])
+        outside = np.zeros(t.shape, dtype=bool)
+        if self.interp_type in ['LINEAR', 'MONOTONE_CUBIC']:
+            outside = (t < x[0]) | (t >= x[-1])
+            t = np.clip(t, x[0], x[-1])
+        k = np.clip(np.searchsorted(x, t, side='right') - 1, 0,
+                    self.coefs.shape[1] - 1)
+        s = t - x[k]
+        powers = np.stack([np.ones_like(s), s, s**2, s**3], axis=-1)
+        values = np.empty((len(t), self.values.shape[1]))
+        slopes = np.empty_like(values) if derivative else None
+        # One matrix product per interval; tables only have a few
+        # temperatures, while there may be millions of points
+        for j in np.unique(k):
+            points = np.nonzero(k == j)[0]
+            values[points] = powers[points] @ self.coefs[:, j]
+            if derivative:
+                slopes[points] = powers[points, :3] @ (
+                    self.coefs[1:, j] * np.arange(1, 4)[:, None])
+        out = self.split(values, shape, joules)
+        if not derivative:
+            return out
+        slopes[outside] = 0
+        return out, self.split(slopes, shape, joules)
+
+    def split(self, table, shape, joules):
+        out = {}
+        for xs, columns in self.columns.items():
+            out[xs] = table[:, columns].reshape(shape + (-1,))
+            if joules and xs == 'FISSE':
+                out[xs] = out[xs] * mev_to_joules
+        return out
+
+
+def resample_material(material, temps, interp_type='SPLINE'):
+    """ Returns material sampled at the integer temperatures temps with
+    interp_type, laid out like a material of a MoltresJsonMaterial file."""
+    temps = [int(t) for t in temps]
+    values = xs_interpolator(material, interp_type).evaluate(temps)
+    resampled = {'temp': temps}
+    for i, t in enumerate(temps):
+        resampled[str(t)] = dict((xs, table[i])
+                                 for xs, table in values.items())
+    return resampled
+
+
+def temperature_grid(material, spacing):
+    """ Integer temperatures from the lowest to at least the highest
+    temperature of material, spacing apart."""
+    low, high = min(material['temp']), max(material['temp'])
+    num = max(int(np.ceil((high - low) / spacing)), 1)
+    return low + spacing * np.arange(num + 1)
+
+
+def resample_error(material, spacing, interp_type, reference='SPLINE',
+                   points=1000):
+    """
+        Resamples material with the reference mode every spacing degrees,
+        interpolates the resampled table with interp_type, and compares the
+        result with the reference mode on the original table.
+
+        Returns
+        ----------
+        errors: dict
+            Maximum relative error of each XS over points temperatures
+            spanning the original table
+    """
+    grid = temperature_grid(material, spacing)
+    coarse = xs_interpolator(
+        resample_material(material, grid, reference), interp_type)
+    temps = np.linspace(min(material['temp']), max(material['temp']), points)
+    exact = xs_interpolator(material, reference).evaluate(temps)
+    approx = coarse.evaluate(temps)
+    errors = {}
+    for xs in exact:
+        scale = np.abs(exact[xs]).max(axis=0)
+        diff = np.abs(approx[xs] - exact[xs]).max(axis=0)
+        errors[xs] = float(np.max(np.divide(diff, scale,
+                                            out=np.zeros_like(diff),
+                                            where=scale != 0)))
+    return errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Interpolates MoltresJsonMaterial libraries like Moltres \
+            does.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    resample = subparsers.add_parser(
+        'resample', help='write a library resampled on a regular grid')
+    resample.add_argument('json_file', type=str, help='library to read')
+    resample.add_argument('out_file', type=str, help='library to write')
+    resample.add_argument('--spacing', type=int, required=True,
+                          help='temperature spacing of the new tables')
+    resample.add_argument('--interp-type', type=str, default='SPLINE',
+                          choices=interp_types,
+                          help='interpolation used to resample')
+    resample.add_argument('--digits', type=int, default=None,
+                          help='significant digits of the written floats')
+    errors = subparsers.add_parser(
+        'errors', help='report the error of each interp_type when the \
+            library is resampled at each spacing')
+    errors.add_argument('json_file', type=str, help='library to read')
+    errors.add_argument('--spacings', type=int, nargs='+', required=True,
+                        help='temperature spacings to try')
+    errors.add_argument('--reference', type=str, default='SPLINE',
+                        choices=interp_types,
+                        help='interpolation taken as exact')
+    errors.add_argument('--target', type=float, default=None,
+                        help='only report combinations under this relative \
+                            error')
+    args = parser.parse_args()
+
+    library = load_library(args.json_file)
+    if args.command == 'resample':
+        out_dict = dict((mat, resample_material(
+            material, temperature_grid(material, args.spacing),
+            args.interp_type)) for mat, material in library.items())
+        with open(args.out_file, 'w') as f:
+            write_json(out_dict, f, args.digits)
+    else:
+        print('{:<20} {:>8} {:<15} {:>12}'.format(
+            'material', 'spacing', 'interp_type', 'max error'))
+        for mat, material in sorted(library.items()):
+            for spacing in args.spacings:
+                for interp_type in interp_types[1:]:
+                    error = max(resample_error(material, spacing, interp_type,
+                                               args.reference).values())
+                    if args.target is None or error <= args.target:
+                        print('{:<20} {:>8} {:<15} {:>12.4e}'.format(
+                            mat, spacing, interp_type, error))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Manifest of the inputs that the outputs of moltres_xs.py and
+# extractSerpent2GCs.py were made from, for incremental regeneration. It
+# keeps the sha256 of every input file and, for each entry of the output
+# (a material temperature of a JSON library, or a material of a properties
+# directory), the inputs and settings it came from and the output files it
+# went into. A rerun only rebuilds the stale entries, those whose inputs or
+# settings changed or whose outputs were deleted or edited since.
+import hashlib
+import json
+import os
+import tempfile
+
+
+def file_hash(filename):
+    """ The sha256 of the contents of filename, None if it is missing."""
+    sha = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha.hexdigest()
+
+
+class xs_manifest:
+    """
+        Inputs, settings and outputs of the entries of an output, read from
+        and saved to a JSON file. Paths are stored absolute.
+
+        Parameters
+        ----------
+        filename: str
+            Manifest file, starting empty if it does not exist yet
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.inputs = {}
+        self.outputs = {}
+        self.entries = {}
+        self.settings = None
+        self.hashes = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                data = json.load(f)
+            if data.get('version') == self.version:
+                self.inputs = data['inputs']
+                self.outputs = data['outputs']
+                self.entries = data['entries']
+                self.settings = data['settings']
+
+    def current(self, path):
+        """ The hash of a file now, computed once per run."""
+        path = os.path.abspath(path)
+        if path not in self.hashes:
+            self.hashes[path] = file_hash(path)
+        return self.hashes[path]
+
+    def output_intact(self, path):
+        """ Whether an output still has the contents it was saved with."""
+        recorded = self.outputs.get(os.path.abspath(path))
+        return recorded is not None and recorded == self.current(path)
+
+    def stale(self, key, inputs, spec):
+        """
+            Whether entry key needs to be rebuilt from the input files
+            inputs with the settings spec: because it is new, because its
+            inputs or spec changed or because one of its outputs is missing
+            or was edited.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['spec'] != json.loads(json.dumps(spec)):
+            return True
+        paths = [os.path.abspath(path) for path in inputs]
+        if entry['inputs'] != paths:
+            return True
+        if any(self.inputs.get(path) != self.current(path)
+               for path in paths):
+            return True
+        return not all(self.output_intact(path) for path in entry['outputs'])
+
+    def record(self, key, inputs, spec, outputs, data=None):
+        """
+            Records that entry key was built from inputs with spec into
+            outputs, which record_output must be called on once written.
+            data is kept with the entry for the next run, see entry_data.
+        """
+        paths = [os.path.abspath(path) for path in inputs]
+        for path in paths:
+            self.inputs[path] = self.current(path)
+        self.entries[key] = {'inputs': paths, 'spec': spec,
+                             'outputs': [os.path.abspath(path)
+                                         for path in outputs],
+                             'data': data}
+
+    def entry_data(self, key):
+        return self.entries[key]['data']
+
+    def record_output(self, path):
+        """ Records the contents of an output file as they are now."""
+        path = os.path.abspath(path)
+        self.hashes.pop(path, None)
+        self.outputs[path] = self.current(path)
+
+    def same_content(self, path, text):
+        """ Whether the file path already holds exactly text."""
+        return self.current(path) == \
+            hashlib.sha256(text.encode()).hexdigest()
+
+    def prune(self, keys, remove_outputs=False):
+        """ Forgets the entries not in keys, and the inputs and outputs
+        that no remaining entry uses. With remove_outputs, those outputs
+        are also deleted, so that the files of dropped entries, or the ones
+        an entry no longer writes, do not outlive it."""
+        recorded = set(self.outputs).union(
+            *[entry['outputs'] for entry in self.entries.values()])
+        self.entries = dict((key, entry) for key, entry in
+                            self.entries.items() if key in keys)
+        used = set(path for entry in self.entries.values()
+                   for path in entry['inputs'])
+        self.inputs = dict((path, h) for path, h in self.inputs.items()
+                           if path in used)
+        used = set(path for entry in self.entries.values()
+                   for path in entry['outputs'])
+        self.outputs = dict((path, h) for path, h in self.outputs.items()
+                            if path in used)
+        if remove_outputs:
+            for path in sorted(recorded - used):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': self.version, 'settings': self.settings,
+                       'inputs': self.inputs, 'outputs': self.outputs,
+                       'entries': self.entries}, f, indent=4, sort_keys=True)
+        os.replace(tmp, self.filename)
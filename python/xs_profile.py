@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# This script records where the XS processing tools spend their time. Code
+# marks its stages with
+#
+#   with stage('parse', file=xs_filename):
+#       ...
+#
+# which does nothing unless a stage_profiler is active. An active profiler
+# records the wall time, CPU time and peak traced memory of each stage, with
+# nested stages named by their path, e.g. load/parse. Worker processes run
+# their own profiler and send back its records with their results.
+import contextlib
+import csv
+import json
+import os
+import time
+import tracemalloc
+
+active = None
+
+
+class stage_profiler:
+    """
+        Records the stages run while it is active, see profiling.
+
+        Parameters
+        ----------
+        trace_memory: bool
+            Trace the peak memory of each stage with tracemalloc, which
+            slows Python allocations down
+        Returns
+        ----------
+        records: list of dict
+            stage, labels, wall_time and cpu_time in seconds, and
+            peak_memory in bytes above the memory in use when the stage
+            started, None without memory tracing. Stages are listed in the
+            order they end, so nested stages come before their parent.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.stack = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        path = '/'.join([s['stage'] for s in self.stack] + [name])
+        frame = {'stage': name, 'start': 0, 'high': 0}
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.update_peak()
+            frame['start'] = frame['high'] = tracemalloc.get_traced_memory()[0]
+        self.stack.append(frame)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = None
+            if self.trace_memory and tracemalloc.is_tracing():
+                self.update_peak()
+                peak = frame['high'] - frame['start']
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1]['high'] = max(self.stack[-1]['high'],
+                                             frame['high'])
+            self.records.append({'stage': path, 'labels': labels,
+                                 'wall_time': wall, 'cpu_time': cpu,
+                                 'peak_memory': peak})
+
+    def update_peak(self):
+        # tracemalloc keeps one peak, so it is moved into the innermost
+        # stage and reset whenever stages start or end
+        if self.stack:
+            self.stack[-1]['high'] = max(self.stack[-1]['high'],
+                                         tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def add(self, records, prefix=None, **labels):
+        """ Adds the records of another profiler, e.g. of a worker process,
+        as if they were run in the current stage."""
+        if prefix is None:
+            prefix = '/'.join(s['stage'] for s in self.stack)
+        for record in records:
+            record = dict(record, labels=dict(record['labels'], **labels))
+            if prefix:
+                record['stage'] = prefix + '/' + record['stage']
+            self.records.append(record)
+
+    def summary(self):
+        """ Lines of a table of the records."""
+        lines = ['{:<40} {:>10} {:>10} {:>10}'.format(
+            'stage', 'wall (s)', 'cpu (s)', 'peak (MB)')]
+        for record in self.records:
+            name = record['stage'] + ''.join(
+                ' {}={}'.format(key, value)
+                for key, value in sorted(record['labels'].items()))
+            peak = '' if record['peak_memory'] is None else \
+                '{:.1f}'.format(record['peak_memory'] / 2.**20)
+            lines.append('{:<40} {:>10.4f} {:>10.4f} {:>10}'.format(
+                name, record['wall_time'], record['cpu_time'], peak))
+        return lines
+
+    def write(self, filename):
+        """ Writes the records as CSV, or as JSON if filename ends so."""
+        if filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(self.records, f, indent=4)
+            return
+        keys = sorted(set(key for record in self.records
+                          for key in record['labels']))
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage'] + keys + ['wall_time', 'cpu_time',
+                                                'peak_memory'])
+            for record in self.records:
+                writer.writerow([record['stage']] +
+                                [record['labels'].get(key, '')
+                                 for key in keys] +
+                                [record['wall_time'], record['cpu_time'],
+                                 record['peak_memory']])
+
+
+def stage(name, **labels):
+    """ Context of a stage of the active profiler, if there is one."""
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name, **labels)
+
+
+@contextlib.contextmanager
+def profiling(profiler, cprofile=None):
+    """
+        Makes profiler the active one, tracing memory if it asks for it.
+        If cprofile is a file name, the whole context is also profiled with
+        cProfile and the stats dumped there, for pstats or snakeviz.
+    """
+    global active
+    previous = active
+    active = profiler
+    started = profiler.trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if cprofile is not None:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        yield profiler
+    finally:
+        if cprofile is not None:
+            cprofiler.disable()
+            cprofiler.dump_stats(cprofile)
+        if started:
+            tracemalloc.stop()
+        active = previous
+
+
+def run_profiled(trace_memory, function, *args):
+    """ Runs function in a worker process under its own profiler, and
+    returns its result with the records of the profiler."""
+    profiler = stage_profiler(trace_memory)
+    with profiling(profiler):
+        result = function(*args)
+    return result, [dict(record, labels=dict(record['labels'],
+                                             pid=os.getpid()))
+                    for record in profiler.records]